@@ -0,0 +1,118 @@
+"""
+Times CardUpdateHelper.handle end to end against in-memory lookups, to check it scales linearly with the number of
+settings. Every customer is new, which is the path that used to scan the settings once per customer. Run from the
+repository root with
+
+    python -m benchmarks.bench_card_update_helper
+"""
+import logging
+import time
+from types import SimpleNamespace
+
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.card_update_helper import CardUpdateHelper
+
+
+class FakeCard:
+    def __init__(self, card_number: int):
+        self.card_number = card_number
+        self.name_id = None
+        self.person = None
+        self.access = frozenset()
+
+    def with_access(self, access: str):
+        self.access = self.access | {access}
+
+    def without_access(self, access: str):
+        self.access = self.access - {access}
+
+    def write(self):
+        pass
+
+
+class FakePerson:
+    _next_id = 1
+
+    def __init__(self):
+        self.id = None
+        self.first_name = None
+        self.last_name = None
+        self.company_id = None
+        self.user_defined_fields = {}
+
+    def write(self):
+        self.id = FakePerson._next_id
+        FakePerson._next_id += 1
+
+
+class FakeAccessCardLookup:
+    def with_people(self):
+        return self
+
+    def by_card_numbers(self, *card_numbers: int):
+        return []
+
+    def new(self, card_number: int):
+        return FakeCard(card_number)
+
+
+class FakePersonLookup:
+    def by_udf(self, key, value=None):
+        return SimpleNamespace(find=lambda: [])
+
+    def new(self):
+        return FakePerson()
+
+
+def make_config():
+    logger = logging.getLogger("bench_card_update_helper")
+    logger.setLevel(logging.WARNING)
+    return SimpleNamespace(
+        logger=logger,
+        slack=SimpleNamespace(webhook_url="https://hooks.slack.invalid", emit=lambda message: None),
+        udf_key_denhac_id="DENHAC_ID",
+        denhac_access="denhac",
+        server_room_access="Server Room",
+        main_building_access="MBD Access",
+        company_id=14,
+        card_updates=SimpleNamespace(
+            batch_lookup_threshold=None,
+            write_batch_size=None,
+            pending_ttl_seconds=None,
+            # Every card stays pending because nothing pushes it back, so don't let eviction into the timings
+            pending_max=1_000_000,
+            write_workers=None,
+            mirror=None,
+            mirror_verify_seconds=None,
+            # No callbacks are registered, so there's nothing to hand to a worker thread
+            callback_queue_size=0,
+        ),
+    )
+
+
+def make_settings(size: int):
+    return [
+        CardSetting(
+            card=1_000_000 + i,
+            first_name=f"First{i // 2}",
+            last_name=f"Last{i // 2}",
+            company="denhac",
+            customer_id=i // 2,
+            enable_denhac=True,
+        )
+        for i in range(size)
+    ]
+
+
+def main():
+    for size in (1_000, 10_000, 100_000):
+        helper = CardUpdateHelper(make_config(), FakePersonLookup(), FakeAccessCardLookup())
+        settings = make_settings(size)
+        started = time.perf_counter()
+        helper.handle(*settings)
+        elapsed = time.perf_counter() - started
+        print(f"{size:>7} settings: {elapsed * 1000:8.1f}ms ({elapsed / size * 1e6:.2f}us/setting)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Times CardUpdatePlanner.plan on its own against synthetic rosters. Run from the repository root with
+
+    python -m benchmarks.bench_card_update_plan
+"""
+import time
+from types import SimpleNamespace
+
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.card_update_plan import CardUpdatePlanner, group_by_customer
+
+CONFIG = SimpleNamespace(
+    denhac_access="denhac",
+    server_room_access="Server Room",
+    main_building_access="MBD Access",
+)
+
+
+def make_roster(size: int):
+    # Two cards per member, a tenth of them needing an access change and a tenth of members not yet in WinDSX
+    settings = []
+    existing_cards = {}
+    person_id_by_customer_id = {}
+    for i in range(size):
+        customer_id = i // 2
+        settings.append(CardSetting(
+            card=1_000_000 + i,
+            first_name=f"First{customer_id}",
+            last_name=f"Last{customer_id}",
+            company="denhac",
+            customer_id=customer_id,
+            enable_denhac=True,
+        ))
+        access = frozenset() if i % 10 == 0 else frozenset(["denhac"])
+        existing_cards[1_000_000 + i] = SimpleNamespace(name_id=customer_id, access=access)
+        if customer_id % 10 != 0:
+            person_id_by_customer_id[customer_id] = customer_id
+
+    return settings, existing_cards, person_id_by_customer_id
+
+
+def main():
+    planner = CardUpdatePlanner(CONFIG)
+    for size in (1_000, 10_000, 100_000):
+        settings, existing_cards, person_id_by_customer_id = make_roster(size)
+        settings_by_customer, _ = group_by_customer(settings)
+        started = time.perf_counter()
+        change_set = planner.plan(settings_by_customer, existing_cards, person_id_by_customer_id)
+        elapsed = time.perf_counter() - started
+        print(f"{size:>7} settings: {elapsed * 1000:8.1f}ms "
+              f"({elapsed / size * 1e6:.2f}us/setting, {len(change_set.card_changes)} card changes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Times finding the active open house, compiled once into an OpenHouseSchedule, against filtering and sorting every
+configured open house on each scan the way card_scanned used to. Run from the repository root with
+
+    python -m benchmarks.bench_open_house_schedule
+"""
+import logging
+import random
+import time
+from datetime import time as dtime
+from types import SimpleNamespace
+
+from denhac_card_access.open_house_schedule import OpenHouseSchedule
+
+LOOKUPS = 10_000
+
+
+def make_open_houses(size: int):
+    rng = random.Random(size)
+    open_houses = {}
+    for i in range(size):
+        start = rng.randrange(0, 23 * 60)
+        end = rng.randrange(start + 1, 24 * 60)
+        open_houses[f"Open House {i}"] = SimpleNamespace(
+            day_of_week=rng.randrange(7),
+            scan_after_time=dtime(start // 60, start % 60),
+            end_time=dtime(end // 60, end % 60),
+            door_ids=[1, 2],
+        )
+    return open_houses
+
+
+def make_queries():
+    rng = random.Random(0)
+    return [(rng.randrange(7), dtime(rng.randrange(24), rng.randrange(60))) for _ in range(LOOKUPS)]
+
+
+def scan_every_open_house(open_houses, weekday, at):
+    valid = {
+        name: oh for (name, oh) in open_houses.items()
+        if oh.day_of_week == weekday and oh.scan_after_time <= at < oh.end_time
+    }
+    if len(valid) == 0:
+        return None
+    return sorted(valid.items(), key=lambda x: x[1].end_time)[0][0]
+
+
+def main():
+    queries = make_queries()
+    for size in (1_000, 10_000, 100_000):
+        open_houses = make_open_houses(size)
+
+        started = time.perf_counter()
+        schedule = OpenHouseSchedule.compile(open_houses.items(), logging.getLogger("bench_open_house_schedule"))
+        compiled = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for weekday, at in queries:
+            schedule.active(weekday, at)
+        indexed = time.perf_counter() - started
+
+        # The old path is far slower, so it only gets a sample of the lookups
+        sample = queries[:max(LOOKUPS * 1_000 // size, 10)]
+        started = time.perf_counter()
+        for weekday, at in sample:
+            scan_every_open_house(open_houses, weekday, at)
+        scanned = time.perf_counter() - started
+
+        print(f"{size:>7} open houses: compile {compiled * 1000:7.1f}ms, "
+              f"lookup {indexed / len(queries) * 1e6:8.2f}us indexed vs {scanned / len(sample) * 1e6:10.2f}us scanned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Sequence
+
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.config import Config
+
+
+@dataclass(frozen=True)
+class ManagedAccess:
+    # Access level name in WinDSX
+    name: str
+    # How the level is described in Slack notices
+    label: str
+    # The CardSetting flag that grants this level. Levels without one are always removed from denhac cards.
+    setting_flag: Optional[str] = None
+
+
+class AccessLevelRegistry:
+    """
+    Gives every access level we manage one bit, so a card's current levels and a setting's desired levels are plain
+    integers. A diff is then two bitwise operations however many levels are managed. Access levels we don't manage
+    never get a bit and are left alone.
+    """
+
+    def __init__(self, levels: Sequence[ManagedAccess]):
+        self._levels = tuple(levels)
+        self._bit_by_name = {level.name: 1 << index for index, level in enumerate(self._levels)}
+        self._flag_bits = tuple(
+            (level.setting_flag, 1 << index)
+            for index, level in enumerate(self._levels)
+            if level.setting_flag is not None
+        )
+
+    @classmethod
+    def from_config(cls, config: Config) -> "AccessLevelRegistry":
+        # denhac cards should not also get main building access
+        return cls([
+            ManagedAccess(config.denhac_access, "denhac", "enable_denhac"),
+            ManagedAccess(config.server_room_access, "server room", "enable_server_room"),
+            ManagedAccess(config.main_building_access, "extra MBD"),
+        ])
+
+    def __len__(self):
+        return len(self._levels)
+
+    def bit(self, name: str) -> int:
+        return self._bit_by_name[name]
+
+    def mask(self, access: Iterable[str]) -> int:
+        """The bits for whichever managed levels appear in `access`"""
+        bit_by_name = self._bit_by_name
+        mask = 0
+        for name in access:
+            mask |= bit_by_name.get(name, 0)
+        return mask
+
+    def desired(self, setting: CardSetting) -> int:
+        mask = 0
+        for flag, bit in self._flag_bits:
+            if getattr(setting, flag):
+                mask |= bit
+        return mask
+
+    @staticmethod
+    def diff(current: int, desired: int) -> tuple[int, int]:
+        """The bits to add and the bits to remove to get from `current` to `desired`"""
+        return desired & ~current, current & ~desired
+
+    def levels(self, mask: int) -> Iterator[ManagedAccess]:
+        """The levels in `mask`, in registration order"""
+        while mask:
+            low_bit = mask & -mask
+            yield self._levels[low_bit.bit_length() - 1]
+            mask ^= low_bit
+
+    def names(self, mask: int) -> tuple[str, ...]:
+        return tuple(level.name for level in self.levels(mask))
@@ -1,17 +1,103 @@
-import uuid
-from datetime import timedelta
-from typing import Optional
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional, TypeVar
 
 from card_automation_server.plugins.interfaces import PluginLoop, PluginCardDataPushed
 from card_automation_server.windsx.lookup.access_card import AccessCard
-from card_automation_server.windsx.lookup.person import PersonLookup
+from card_automation_server.windsx.lookup.person import PersonLookup, Person
 
+from denhac_card_access.card_snapshot import CardSnapshot, RosterPage
 from denhac_card_access.card_update_helper import CardUpdateHelper, CardSetting
 from denhac_card_access.config import Config
+from denhac_card_access.denhac_id import denhac_ids
+from denhac_card_access.metrics import TimingStat, PhaseTimings, NULL_TIMINGS
 from denhac_card_access.plugin import CardSyncMutex
 
+T = TypeVar("T")
+
+_END = object()
+
+
+def _prefetch(items: Iterator[T], depth: int) -> Iterator[T]:
+    """
+    Iterate `items` on a background thread, keeping up to `depth` results buffered ahead of the consumer. Errors
+    raised by `items` are re-raised to the consumer in order.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as ex:
+            put((_END, ex))
+            return
+        put((_END, None))
+
+    thread = threading.Thread(target=worker, name="bulk-card-sync-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _SyncRun:
+    """Progress of one pass over the roster. In sharded mode it is the cursor carried between loop ticks."""
+
+    def __init__(self, started_at: datetime, full_sync: bool, timings: PhaseTimings):
+        self.started_at = started_at
+        self.full_sync = full_sync
+        self.timings = timings
+        self.can_open_house_ids: set[int] = set()
+        self.fingerprints: dict[int, int] = {}
+        self.pages: list[RosterPage] = []
+        self.chunks: Iterator[list[CardSetting]] = iter(())
+        self.shards = 0
+        self.handled = 0
+        self.removed = 0
+        # Cards the helper failed to write, left out of the snapshot so the next run tries them again
+        self.failed_cards: set[int] = set()
+        # Cards handled by anything else while the run is between shards. The roster pages were read before those
+        # updates, so these cards are left out of later shards and out of the snapshot.
+        self.handled_elsewhere: set[int] = set()
+        # Every denhac person by DENHAC_ID, loaded once for the whole run and kept up to date by the helper
+        self.person_by_uuid: Optional[dict[str, Person]] = None
+        # Card sync mutex hold times for this run only
+        self.lock_hold = TimingStat()
+
 
 class BulkCardSync(PluginLoop, PluginCardDataPushed):
+    _sync_every: timedelta = timedelta(hours=6)
+    _default_shard_interval: timedelta = timedelta(seconds=1)
+    _default_chunk_size: int = 500
+    _default_prefetch_depth: int = 0
+    _default_full_sync_interval: timedelta = timedelta(hours=24)
+    _default_max_skipped_runs: int = 3
+    _default_run_history_size: int = 10
+
     def __init__(self,
                  config: Config,
                  card_update_helper: CardUpdateHelper,
@@ -23,73 +109,375 @@ class BulkCardSync(PluginLoop, PluginCardDataPushed):
         self._person_lookup = person_lookup
         self._card_sync_mutex = card_sync_mutex
 
+        self._chunk_size = self._config.bulk_sync.chunk_size or self._default_chunk_size
+        # Number of /all_cards pages fetched ahead of the page being reconciled. 0 fetches pages serially.
+        self._prefetch_depth = self._config.bulk_sync.prefetch_depth or self._default_prefetch_depth
+
+        # Cards whose fingerprint matches the snapshot are skipped, except on a full sync which re-checks every card
+        # against WinDSX to catch changes made outside this plugin.
+        self._snapshot = CardSnapshot(self._config.bulk_sync.snapshot_path)
+        full_sync_hours = self._config.bulk_sync.full_sync_hours
+        self._full_sync_interval = self._default_full_sync_interval if full_sync_hours is None \
+            else timedelta(hours=full_sync_hours)
+
+        # An unchanged roster skips the reconcile entirely, but never more than this many runs in a row
+        max_skipped_runs = self._config.bulk_sync.max_skipped_runs
+        self._max_skipped_runs = self._default_max_skipped_runs if max_skipped_runs is None else max_skipped_runs
+        self._skipped_runs = 0
+
+        # Sharded mode reconciles one chunk per loop tick, releasing the card sync mutex in between so piecemeal
+        # updates aren't stuck behind the whole roster.
+        self._sharded = bool(self._config.bulk_sync.sharded)
+        shard_interval_seconds = self._config.bulk_sync.shard_interval_seconds
+        self._shard_interval = self._default_shard_interval if shard_interval_seconds is None \
+            else timedelta(seconds=shard_interval_seconds)
+        self._run: Optional[_SyncRun] = None
+        self._handling_chunk = False
+        self._card_update_helper.register_handled(self._handled_elsewhere)
+
+        self.lock_hold = TimingStat()
+
+        # Per-phase timings of the most recent runs, newest last
+        self._instrument = self._config.bulk_sync.instrument is not False
+        self.runs: deque[PhaseTimings] = deque(
+            maxlen=self._config.bulk_sync.run_history_size or self._default_run_history_size
+        )
+
     def loop(self) -> int:
+        if self._sharded:
+            return self._loop_sharded()
+
+        if not self._skip_unchanged_roster():
+            run = self._start_run()
+            with self._locked(run):
+                self._loop_locked(run)
+            self._report_run(run)
+
+        return int(self._sync_every.total_seconds())
+
+    def _loop_sharded(self) -> int:
+        try:
+            if self._run is None:
+                if self._skip_unchanged_roster():
+                    return int(self._sync_every.total_seconds())
+                self._run = self._start_run()
+
+            # Pages are fetched outside the lock, only the reconcile needs it
+            run = self._run
+            chunk = next(run.chunks, None)
+            with self._locked(run):
+                if chunk is not None:
+                    self._handle_chunk(run, chunk)
+                else:
+                    self._finish_run(run)
+                    self._run = None
+
+            if chunk is None:
+                self._report_run(run)
+                return int(self._sync_every.total_seconds())
+        except BaseException:
+            # Start over from the first page on the next tick
+            self._run = None
+            raise
+
+        return int(self._shard_interval.total_seconds())
+
+    @contextmanager
+    def _locked(self, run: _SyncRun) -> Iterator[None]:
         with self._card_sync_mutex:
-            self._loop_locked()
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                held = time.monotonic() - started
+                self.lock_hold.record(held)
+                run.lock_hold.record(held)
+
+    def _skip_unchanged_roster(self) -> bool:
+        if self._skipped_runs >= self._max_skipped_runs:
+            return False
+
+        if self._snapshot.full_sync_due(datetime.now(), self._full_sync_interval):
+            return False
+
+        started = time.monotonic()
+        if not self._roster_unchanged():
+            return False
+
+        self._skipped_runs += 1
+        self._logger.info(
+            f"Roster unchanged across {len(self._snapshot.pages)} pages, checked in "
+            f"{time.monotonic() - started:.2f}s. Skipping bulk sync ({self._skipped_runs} of "
+            f"{self._max_skipped_runs} skips before a full sync)"
+        )
+        return True
+
+    def _roster_unchanged(self) -> bool:
+        """
+        Walk the /all_cards pages recorded by the last sync, sending their validators so an API that supports them can
+        answer 304, and otherwise comparing content digests. Stops at the first page that differs.
+        """
+        if len(self._snapshot.pages) == 0:
+            return False
+
+        url: Optional[str] = f"{self._config.webhooks.base_url}/all_cards"
+        for page in self._snapshot.pages:
+            if page["url"] != url:
+                return False
+
+            headers = {}
+            if page["etag"] is not None:
+                headers["If-None-Match"] = page["etag"]
+            if page["last_modified"] is not None:
+                headers["If-Modified-Since"] = page["last_modified"]
+
+            response = self._config.webhooks.session.get(url, headers=headers)
+            if response.status_code != 304:
+                response.raise_for_status()
+                if CardSnapshot.digest(response.content) != page["digest"]:
+                    return False
 
-        return int(timedelta(hours=6).total_seconds())
+            # Identical content means an identical next_page_url
+            url = page["next_url"]
 
-    def _loop_locked(self):
-        all_settings: list[CardSetting] = []
-        can_open_house_ids: set[int] = set()
+        return url is None
 
+    def _loop_locked(self, run: _SyncRun):
+        for chunk in run.chunks:
+            self._handle_chunk(run, chunk)
+
+        self._finish_run(run)
+
+    def _start_run(self) -> _SyncRun:
+        now = datetime.now()
+        full_sync = self._skipped_runs >= self._max_skipped_runs or \
+            self._snapshot.full_sync_due(now, self._full_sync_interval)
+        timings = PhaseTimings("full" if full_sync else "delta") if self._instrument else NULL_TIMINGS
+        run = _SyncRun(now, full_sync, timings)
+
+        run.chunks = self._chunks(self._page_settings(run), run.fingerprints, full_sync)
+
+        return run
+
+    def _handle_chunk(self, run: _SyncRun, chunk: list[CardSetting]) -> None:
+        if run.handled_elsewhere:
+            settings = [s for s in chunk if s.card not in run.handled_elsewhere]
+            if len(settings) != len(chunk):
+                self._logger.info(f"Skipping {len(chunk) - len(settings)} cards updated since this sync started")
+            chunk = settings
+
+        self._handling_chunk = True
+        try:
+            failed_cards = self._card_update_helper.handle(
+                *chunk, timings=run.timings, person_by_uuid=self._person_by_uuid(run)
+            )
+        finally:
+            self._handling_chunk = False
+        for card in failed_cards:
+            run.fingerprints.pop(card, None)
+        run.failed_cards |= failed_cards
+        run.shards += 1
+        run.handled += len(chunk)
+
+    def _finish_run(self, run: _SyncRun) -> None:
+        self._update_can_open_house(run.can_open_house_ids, self._person_by_uuid(run), run.timings)
+
+        run.removed = len(self._snapshot) - sum(1 for card in run.fingerprints if card in self._snapshot)
+        for card in run.handled_elsewhere:
+            run.fingerprints.pop(card, None)
+        run.timings.finish()
+        if self._instrument:
+            self.runs.append(run.timings)
+
+        # Without pages the next run can't be skipped as unchanged, so cards that failed to write are retried
+        pages = [] if run.failed_cards else run.pages
+        self._snapshot.replace(run.fingerprints, pages, run.started_at if run.full_sync else None)
+        self._skipped_runs = 0
+
+    def _person_by_uuid(self, run: _SyncRun) -> dict[str, Person]:
+        if run.person_by_uuid is None:
+            with run.timings.phase("udf_lookup"):
+                people = self._person_lookup.by_udf(self._config.udf_key_denhac_id).find()
+
+            run.person_by_uuid = {}
+            for person in people:
+                run.person_by_uuid.setdefault(person.user_defined_fields.get(self._config.udf_key_denhac_id), person)
+
+        return run.person_by_uuid
+
+    def _report_run(self, run: _SyncRun) -> None:
+        # Logged once the mutex is released, so the run's last hold is included
+        cache_info = denhac_ids.cache_info()
+        self._logger.info(
+            f"Bulk sync finished: mode={'full' if run.full_sync else 'delta'} handled={run.handled} "
+            f"cards={len(run.fingerprints)} chunks={run.shards} removed={run.removed} "
+            f"failed={len(run.failed_cards)} max_lock_hold={run.lock_hold.max:.3f}s denhac_id_hits={cache_info.hits} "
+            f"denhac_id_misses={cache_info.misses} {run.timings.summary() if self._instrument else ''}".rstrip()
+        )
+
+        # Raised only once the whole roster was reconciled, so one bad card doesn't hold up the rest
+        if run.failed_cards:
+            raise Exception(f"Bulk sync failed to write {len(run.failed_cards)} cards: {sorted(run.failed_cards)}")
+
+    def _pages(self, run: _SyncRun) -> Iterator[list[dict]]:
+        if self._prefetch_depth > 0:
+            return _prefetch(self._fetch_pages(run), self._prefetch_depth)
+
+        return self._fetch_pages(run)
+
+    def _fetch_pages(self, run: _SyncRun) -> Iterator[list[dict]]:
         url: Optional[str] = f"{self._config.webhooks.base_url}/all_cards"
         while url is not None:
-            response = self._config.webhooks.session.get(url)
-            response.raise_for_status()
-            data = response.json()
+            with run.timings.phase("page_fetch"):
+                response = self._config.webhooks.session.get(url)
+                response.raise_for_status()
+            with run.timings.phase("json_decode"):
+                data = response.json()
 
-            for person_data in data["data"]:
-                customer_id = person_data["id"]
+            next_url = data.get("next_page_url")
+            run.pages.append(RosterPage(
+                url=url,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                digest=CardSnapshot.digest(response.content),
+                next_url=next_url,
+            ))
 
-                if self._config.udf_key_can_open_house in person_data.get("extra", []):
-                    can_open_house_ids.add(customer_id)
+            url = next_url
+            yield data["data"]
 
-                for card_data in person_data["cards"]:
-                    access = card_data["access"]
-                    all_settings.append(CardSetting(
-                        card=int(card_data["card_num"]),
-                        first_name=person_data["first_name"],
-                        last_name=person_data["last_name"],
-                        company=person_data["company"],
-                        customer_id=customer_id,
-                        enable_denhac=self._config.denhac_access in access,
-                        enable_server_room=self._config.server_room_access in access,
-                    ))
+    def _page_settings(self, run: _SyncRun) -> Iterator[list[CardSetting]]:
+        for page in self._pages(run):
+            yield list(self._settings(page, run.can_open_house_ids))
 
-            url = data.get("next_page_url")
+    def _settings(self, people: Iterable[dict], can_open_house_ids: set[int]) -> Iterator[CardSetting]:
+        for person_data in people:
+            customer_id = person_data["id"]
 
-        self._card_update_helper.handle(*all_settings)
-        self._update_can_open_house(can_open_house_ids)
+            if self._config.udf_key_can_open_house in person_data.get("extra", []):
+                can_open_house_ids.add(customer_id)
+
+            for card_data in person_data["cards"]:
+                access = card_data["access"]
+                yield CardSetting(
+                    card=int(card_data["card_num"]),
+                    first_name=person_data["first_name"],
+                    last_name=person_data["last_name"],
+                    company=person_data["company"],
+                    customer_id=customer_id,
+                    enable_denhac=self._config.denhac_access in access,
+                    enable_server_room=self._config.server_room_access in access,
+                )
+
+    def _chunks(self,
+                pages: Iterable[list[CardSetting]],
+                fingerprints: dict[int, int],
+                full_sync: bool) -> Iterator[list[CardSetting]]:
+        """
+        Chunks of the settings that changed since the snapshot. A card listed for more than one customer is skipped
+        everywhere, the same as the helper does within one handle call. To make that call, whole pages are held back
+        until they add up to at least a chunk of changes. Only when the card's first listing was already handed on in
+        an earlier chunk does that listing stand, with every later one skipped. Skipped cards get no fingerprint, so the
+        next run looks at them again.
+        """
+        handed: dict[int, int] = {}
+        skipped: set[int] = set()
+        # Every card since the last chunk: its customer, fingerprint and, only if it changed, its setting
+        window: dict[int, tuple[int, int, Optional[CardSetting]]] = {}
+        changed = 0
+        for page in pages:
+            for setting in page:
+                card = setting.card
+                if card in handed:
+                    self._logger.error(
+                        f"Card number {card} for customer {setting.customer_id} was already handled for customer "
+                        f"{handed[card]} in this sync, skipping"
+                    )
+                    continue
+
+                if card in skipped:
+                    continue
+
+                if card in window:
+                    earlier_customer_id, _, earlier_setting = window.pop(card)
+                    changed -= earlier_setting is not None
+                    skipped.add(card)
+                    self._logger.error(
+                        f"Card number {card} is listed for customers {earlier_customer_id} and "
+                        f"{setting.customer_id}, skipping"
+                    )
+                    continue
+
+                fingerprint = CardSnapshot.fingerprint(setting)
+                is_changed = full_sync or self._snapshot.get(card) != fingerprint
+                window[card] = (setting.customer_id, fingerprint, setting if is_changed else None)
+                changed += is_changed
+
+            if changed >= self._chunk_size:
+                yield from self._close_window(window, handed, fingerprints)
+                changed = 0
+
+        yield from self._close_window(window, handed, fingerprints)
+
+    def _close_window(self,
+                      window: dict[int, tuple[int, int, Optional[CardSetting]]],
+                      handed: dict[int, int],
+                      fingerprints: dict[int, int]) -> Iterator[list[CardSetting]]:
+        chunk: list[CardSetting] = []
+        for card, (customer_id, fingerprint, setting) in window.items():
+            handed[card] = customer_id
+            fingerprints[card] = fingerprint
+            if setting is not None:
+                chunk.append(setting)
+
+        window.clear()
+        for start in range(0, len(chunk), self._chunk_size):
+            yield chunk[start:start + self._chunk_size]
+
+    def _handled_elsewhere(self, setting: CardSetting) -> None:
+        # Only a sharded run lets other handle calls in between its chunks, and those come in holding the mutex
+        run = self._run
+        if run is None or self._handling_chunk:
+            return
+
+        run.handled_elsewhere.add(setting.card)
+        # The person index can't know about anyone created outside this run, so it's loaded again
+        if run.person_by_uuid is not None and denhac_ids.encode(setting.customer_id) not in run.person_by_uuid:
+            run.person_by_uuid = None
 
     def card_data_pushed(self, access_card: AccessCard) -> None:
         self._card_update_helper.card_updated(access_card)
 
-    def _update_can_open_house(self, can_open_house_ids: set[int]) -> None:
-        should_have_uuids = {
-            str(uuid.uuid5(uuid.NAMESPACE_OID, str(cid)))
-            for cid in can_open_house_ids
-        }
+    def _update_can_open_house(self,
+                               can_open_house_ids: set[int],
+                               person_by_uuid: dict[str, Person],
+                               timings: PhaseTimings = NULL_TIMINGS) -> None:
+        should_have_uuids = {denhac_ids.encode(cid) for cid in can_open_house_ids}
+
+        # One query no matter how many members hold the flag, on top of the run's index of every denhac person
+        with timings.phase("udf_lookup"):
+            people_with_udf = self._person_lookup.by_udf(self._config.udf_key_can_open_house).find()
 
-        for cid in can_open_house_ids:
-            cid_uuid = str(uuid.uuid5(uuid.NAMESPACE_OID, str(cid)))
-            people = self._person_lookup.by_udf(self._config.udf_key_denhac_id, cid_uuid).find()
-            if not people:
+        for denhac_uuid, person in person_by_uuid.items():
+            if denhac_uuid not in should_have_uuids:
                 continue
-            person = people[0]
+
             if person.user_defined_fields.get(self._config.udf_key_can_open_house) != "True":
                 person.user_defined_fields[self._config.udf_key_can_open_house] = "True"
-                person.write()
-                self._config.slack.emit(
-                    f"Allowing {person.first_name} {person.last_name} to initiate open house mode"
-                )
+                with timings.phase("person_write"):
+                    person.write()
+                with timings.phase("slack_post"):
+                    self._config.slack.emit(
+                        f"Allowing {person.first_name} {person.last_name} to initiate open house mode"
+                    )
 
-        people_with_udf = self._person_lookup.by_udf(self._config.udf_key_can_open_house).find()
         for person in people_with_udf:
             denhac_uuid = person.user_defined_fields.get(self._config.udf_key_denhac_id)
             if denhac_uuid not in should_have_uuids:
                 del person.user_defined_fields[self._config.udf_key_can_open_house]
-                person.write()
-                self._config.slack.emit(
-                    f"Removing ability for {person.first_name} {person.last_name} to issue open house mode"
-                )
+                with timings.phase("person_write"):
+                    person.write()
+                with timings.phase("slack_post"):
+                    self._config.slack.emit(
+                        f"Removing ability for {person.first_name} {person.last_name} to issue open house mode"
+                    )
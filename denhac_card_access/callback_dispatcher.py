@@ -0,0 +1,93 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable, Optional
+
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.metrics import TimingStat
+
+Callback = Callable[[CardSetting], None]
+
+
+class CallbackDispatcher:
+    """
+    Runs card update callbacks on a single worker thread, so a slow callback doesn't hold up whichever thread delivered
+    the card push. With one worker, callbacks for the same card always run in the order they were dispatched.
+
+    When the queue is full the callbacks run inline instead and are counted in `overflowed`. If that card still has
+    callbacks queued, dispatch waits for room instead, so the card's callbacks stay in order. A queue size of 0 always
+    runs callbacks inline.
+    """
+
+    def __init__(self, logger: logging.Logger, queue_size: int):
+        self._logger = logger
+        self._queue: Optional[queue.Queue] = queue.Queue(maxsize=queue_size) if queue_size > 0 else None
+        self._lock = threading.Lock()
+        self._queued_cards: Counter[int] = Counter()
+        self._thread: Optional[threading.Thread] = None
+        # From dispatch until the last callback for that setting finished
+        self.latency = TimingStat()
+        self.overflowed = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def dispatch(self, callbacks: Iterable[Callback], setting: CardSetting) -> None:
+        item = (time.monotonic(), tuple(callbacks), setting)
+        if self._queue is None:
+            self._run(*item)
+            return
+
+        self._ensure_worker()
+        with self._lock:
+            card_queued = self._queued_cards[setting.card] > 0
+            self._queued_cards[setting.card] += 1
+
+        try:
+            self._queue.put(item, block=card_queued)
+        except queue.Full:
+            self._done(setting)
+            with self._lock:
+                self.overflowed += 1
+            self._logger.warning(f"Callback queue is full, running callbacks for card {setting.card} inline")
+            self._run(*item)
+
+    def join(self) -> None:
+        """Wait until every queued callback has run"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._work, name="card-update-callbacks", daemon=True)
+            self._thread.start()
+
+    def _work(self) -> None:
+        while True:
+            enqueued_at, callbacks, setting = self._queue.get()
+            try:
+                self._run(enqueued_at, callbacks, setting)
+            except Exception:
+                self._logger.exception(f"Card update callback failed for card {setting.card}")
+            finally:
+                self._done(setting)
+                self._queue.task_done()
+
+    def _done(self, setting: CardSetting) -> None:
+        with self._lock:
+            self._queued_cards[setting.card] -= 1
+            if self._queued_cards[setting.card] <= 0:
+                del self._queued_cards[setting.card]
+
+    def _run(self, enqueued_at: float, callbacks: tuple[Callback, ...], setting: CardSetting) -> None:
+        try:
+            for cb in callbacks:
+                cb(setting)
+        finally:
+            self.latency.record(time.monotonic() - enqueued_at)
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+import time
+from typing import Iterable, Optional
+
+from card_automation_server.windsx.lookup.access_card import AccessCardLookup, AccessCard
+from card_automation_server.windsx.lookup.person import PersonLookup, Person
+
+from denhac_card_access.config import Config
+
+
+class CardMirror:
+    """
+    In-process copy of the denhac cards and people in WinDSX, so lookups for cards we already know about don't have to
+    go back to the database.
+
+    Every denhac person is loaded in one query on first use. Cards are added as they are read from or written to the
+    database and as the card server pushes them. `verify` compares the mirror against the database a chunk at a time
+    and replaces anything that has drifted.
+    """
+
+    def __init__(self,
+                 config: Config,
+                 person_lookup: PersonLookup,
+                 access_card_lookup: AccessCardLookup,
+                 verify_interval_seconds: float,
+                 chunk_size: int = 500):
+        self._config = config
+        self._person_lookup = person_lookup
+        self._access_card_lookup = access_card_lookup
+        self._verify_interval = verify_interval_seconds
+        self._chunk_size = chunk_size
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._verified_at = time.monotonic()
+        self._cards: dict[int, AccessCard] = {}
+        self._person_by_uuid: dict[str, Person] = {}
+        self.hits = 0
+        self.misses = 0
+        self.drifted = 0
+
+    def __len__(self):
+        return len(self._cards)
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+
+            for person in self._person_lookup.by_udf(self._config.udf_key_denhac_id).find():
+                self.add_person(person)
+            self._loaded = True
+
+    def card(self, card_number: int) -> Optional[AccessCard]:
+        with self._lock:
+            return self._cards.get(card_number)
+
+    def cards(self, card_numbers: Iterable[int]) -> tuple[dict[int, AccessCard], list[int]]:
+        """The mirrored cards by card number, and the card numbers that have to be read from the database"""
+        found: dict[int, AccessCard] = {}
+        missing: list[int] = []
+        with self._lock:
+            for card_number in card_numbers:
+                card = self._cards.get(card_number)
+                if card is None:
+                    missing.append(card_number)
+                else:
+                    found[card_number] = card
+
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def person(self, denhac_uuid: str) -> Optional[Person]:
+        with self._lock:
+            return self._person_by_uuid.get(denhac_uuid)
+
+    def add_person(self, person: Person) -> None:
+        denhac_uuid = person.user_defined_fields.get(self._config.udf_key_denhac_id)
+        if denhac_uuid is None:
+            return
+
+        with self._lock:
+            self._person_by_uuid[denhac_uuid] = person
+
+    def add_card(self, card: AccessCard) -> None:
+        """Mirror a card read, written or pushed. Only cards owned by a denhac person are kept."""
+        with self._lock:
+            if card.person is None or self._config.udf_key_denhac_id not in card.person.user_defined_fields:
+                self._cards.pop(card.card_number, None)
+                return
+
+            self._cards[card.card_number] = card
+            self.add_person(card.person)
+
+    def discard_card(self, card_number: int) -> None:
+        with self._lock:
+            self._cards.pop(card_number, None)
+
+    def verify_due(self) -> bool:
+        return time.monotonic() - self._verified_at >= self._verify_interval
+
+    def verify(self) -> int:
+        """Compare the mirror against the database and refresh whatever differs. Returns how many entries drifted."""
+        self._verified_at = time.monotonic()
+
+        with self._lock:
+            card_numbers = sorted(self._cards)
+
+        drifted = 0
+        for start in range(0, len(card_numbers), self._chunk_size):
+            chunk = card_numbers[start:start + self._chunk_size]
+            drifted += self._verify_cards(chunk)
+
+        drifted += self._verify_people()
+        self.drifted += drifted
+        return drifted
+
+    def _verify_cards(self, card_numbers: list[int]) -> int:
+        db_cards = {
+            card.card_number: card
+            for card in self._access_card_lookup.with_people().by_card_numbers(*card_numbers)
+        }
+
+        with self._lock:
+            mirrored = {number: self._cards[number] for number in card_numbers if number in self._cards}
+            if self._checksum(map(self._card_key, mirrored.values())) == \
+                    self._checksum(map(self._card_key, db_cards.values())):
+                return 0
+
+            drifted = 0
+            for card_number, card in mirrored.items():
+                db_card = db_cards.get(card_number)
+                if db_card is not None and self._card_key(db_card) == self._card_key(card):
+                    continue
+
+                drifted += 1
+                if db_card is None:
+                    del self._cards[card_number]
+                else:
+                    self.add_card(db_card)
+
+            return drifted
+
+    def _verify_people(self) -> int:
+        db_people = {
+            person.user_defined_fields.get(self._config.udf_key_denhac_id): person
+            for person in self._person_lookup.by_udf(self._config.udf_key_denhac_id).find()
+        }
+
+        with self._lock:
+            if self._checksum(map(self._person_key, self._person_by_uuid.values())) == \
+                    self._checksum(map(self._person_key, db_people.values())):
+                return 0
+
+            drifted = sum(
+                1 for denhac_uuid in self._person_by_uuid.keys() | db_people.keys()
+                if denhac_uuid not in self._person_by_uuid or denhac_uuid not in db_people
+                or self._person_key(self._person_by_uuid[denhac_uuid]) != self._person_key(db_people[denhac_uuid])
+            )
+            self._person_by_uuid = db_people
+            return drifted
+
+    @staticmethod
+    def _card_key(card: AccessCard) -> tuple:
+        return card.card_number, card.name_id, tuple(sorted(card.access))
+
+    def _person_key(self, person: Person) -> tuple:
+        return (
+            person.id,
+            person.first_name,
+            person.last_name,
+            person.user_defined_fields.get(self._config.udf_key_denhac_id),
+        )
+
+    @staticmethod
+    def _checksum(keys: Iterable[tuple]) -> str:
+        return hashlib.blake2b(repr(sorted(keys)).encode(), digest_size=16).hexdigest()
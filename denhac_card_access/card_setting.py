@@ -0,0 +1,12 @@
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True, slots=True)
+class CardSetting:
+    card: int
+    first_name: str
+    last_name: str
+    company: str
+    customer_id: int
+    enable_denhac: bool = field(default=False)
+    enable_server_room: bool = field(default=False)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional, TypedDict
+
+from denhac_card_access.card_setting import CardSetting
+
+
+class RosterPage(TypedDict):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: str
+    next_url: Optional[str]
+
+
+class CardSnapshot:
+    """
+    Fingerprints of the last CardSetting applied for every card number, optionally persisted to a JSON file so that
+    bulk syncs can skip cards that have not changed since the previous run. The /all_cards pages that produced them are
+    kept alongside so an unchanged roster can be detected without reconciling it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self.full_sync_at: Optional[datetime] = None
+        self.pages: list[RosterPage] = []
+        self._fingerprints: dict[int, int] = {}
+
+        if self._path is not None and os.path.exists(self._path):
+            self._load()
+
+    @staticmethod
+    def fingerprint(setting: CardSetting) -> int:
+        key = (
+            setting.card,
+            setting.customer_id,
+            setting.first_name,
+            setting.last_name,
+            setting.company,
+            setting.enable_denhac,
+            setting.enable_server_room,
+        )
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, card: int) -> bool:
+        return card in self._fingerprints
+
+    def get(self, card: int) -> Optional[int]:
+        return self._fingerprints.get(card)
+
+    def full_sync_due(self, now: datetime, interval: timedelta) -> bool:
+        return self.full_sync_at is None or now - self.full_sync_at >= interval
+
+    def replace(self,
+                fingerprints: dict[int, int],
+                pages: list[RosterPage],
+                full_sync_at: Optional[datetime] = None) -> None:
+        self._fingerprints = fingerprints
+        self.pages = pages
+        if full_sync_at is not None:
+            self.full_sync_at = full_sync_at
+
+        if self._path is not None:
+            self._save()
+
+    def _load(self) -> None:
+        with open(self._path) as f:
+            data = json.load(f)
+
+        full_sync_at = data.get("full_sync_at")
+        self.full_sync_at = datetime.fromisoformat(full_sync_at) if full_sync_at is not None else None
+        self.pages = data.get("pages", [])
+        self._fingerprints = {int(card): fp for card, fp in data.get("cards", {}).items()}
+
+    def _save(self) -> None:
+        data = {
+            "full_sync_at": self.full_sync_at.isoformat() if self.full_sync_at is not None else None,
+            "pages": self.pages,
+            "cards": self._fingerprints,
+        }
+
+        # Write then rename so a crash mid-write never leaves a truncated snapshot behind
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self._path)
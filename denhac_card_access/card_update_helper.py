@@ -1,29 +1,30 @@
-import uuid
-from collections import Counter
-from dataclasses import dataclass, field
-from typing import Callable
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from card_automation_server.windsx.lookup.access_card import AccessCardLookup, AccessCard
 from card_automation_server.windsx.lookup.person import PersonLookup, Person
 
+from denhac_card_access.callback_dispatcher import Callback, CallbackDispatcher
+from denhac_card_access.card_mirror import CardMirror
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.card_update_plan import CardUpdatePlanner, ChangeSet, SettingsByCustomer, group_by_customer
 from denhac_card_access.config import Config
-
-
-@dataclass(frozen=True)
-class CardSetting:
-    card: int
-    first_name: str
-    last_name: str
-    company: str
-    customer_id: int
-    enable_denhac: bool = field(default=False)
-    enable_server_room: bool = field(default=False)
-
-
-Callback = Callable[[CardSetting], None]
+from denhac_card_access.denhac_id import denhac_ids
+from denhac_card_access.metrics import PhaseTimings, NULL_TIMINGS
+from denhac_card_access.write_batch import WriteBatch
 
 
 class CardUpdateHelper:
+    _default_batch_lookup_threshold: int = 10
+    _default_write_batch_size: int = 100
+    _default_pending_ttl_seconds: int = 60 * 60
+    _default_pending_max: int = 10000
+    _default_mirror_verify_seconds: int = 60 * 60
+    _default_callback_queue_size: int = 1000
+
     def __init__(self,
                  config: Config,
                  person_lookup: PersonLookup,
@@ -35,146 +36,363 @@ class CardUpdateHelper:
 
         self._person_lookup = person_lookup
         self._access_card_lookup = access_card_lookup
+        self._planner = CardUpdatePlanner(config)
+        # With at least this many customers to find by DENHAC_ID, load every denhac person in one query instead of
+        # querying each UUID on its own
+        batch_lookup_threshold = self._config.card_updates.batch_lookup_threshold
+        self._batch_lookup_threshold = self._default_batch_lookup_threshold if batch_lookup_threshold is None \
+            else batch_lookup_threshold
+        write_batch_size = self._config.card_updates.write_batch_size
+        self._write_batch_size = self._default_write_batch_size if write_batch_size is None else write_batch_size
+        # Optional parallel apply, off unless more than one worker is configured
+        write_workers = self._config.card_updates.write_workers or 1
+        self._write_executor = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix="card-write") \
+            if write_workers > 1 else None
+        # Throughput of the most recent handle call that wrote anything, for tuning write_workers
+        self.writes_per_second = 0.0
+
+        # Optional in-memory copy of the denhac cards and people, so reads skip the database for cards already seen
+        mirror_verify_seconds = self._config.card_updates.mirror_verify_seconds
+        self.mirror = CardMirror(
+            config,
+            person_lookup,
+            access_card_lookup,
+            self._default_mirror_verify_seconds if mirror_verify_seconds is None else mirror_verify_seconds,
+        ) if self._config.card_updates.mirror else None
 
         self._callbacks: set[Callback] = set()
-        self._pending_settings: set[CardSetting] = set()
+        # Callbacks can block on HTTP, so they run on their own thread rather than the one delivering the card push
+        callback_queue_size = self._config.card_updates.callback_queue_size
+        self.callbacks = CallbackDispatcher(
+            self._logger,
+            self._default_callback_queue_size if callback_queue_size is None else callback_queue_size,
+        )
+        self._eviction_callbacks: set[Callback] = set()
+        self._handled_callbacks: set[Callback] = set()
+        # Pending settings are added from the plugin thread and completed from the push thread
+        self._pending_lock = threading.Lock()
+        # Settings waiting on a card_data_pushed for their card, oldest first
+        self._pending_settings: dict[int, list[CardSetting]] = {}
+        # When each pending setting was added, in the order they were added, so the oldest can be evicted. Pushes
+        # never arrive for some cards, and this has to run for months.
+        self._pending_added_at: OrderedDict[CardSetting, float] = OrderedDict()
+        pending_ttl_seconds = self._config.card_updates.pending_ttl_seconds
+        self._pending_ttl = self._default_pending_ttl_seconds if pending_ttl_seconds is None else pending_ttl_seconds
+        pending_max = self._config.card_updates.pending_max
+        self._pending_max = self._default_pending_max if pending_max is None else pending_max
+        self.evicted = 0
 
     def register(self, cb: Callback) -> None:
         self._callbacks.add(cb)
 
-    def handle(self, *settings: CardSetting) -> None:
-        card_counts = Counter(s.card for s in settings)
-        duplicate_cards = {card for card, count in card_counts.items() if count > 1}
+    def register_eviction(self, cb: Callback) -> None:
+        """`cb` is called with every pending setting dropped because no push arrived for its card in time"""
+        self._eviction_callbacks.add(cb)
+
+    def register_handled(self, cb: Callback) -> None:
+        """`cb` is called with every setting passed to `handle`, on the calling thread and before anything is written"""
+        self._handled_callbacks.add(cb)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending_added_at)
+
+    @property
+    def oldest_pending_age(self) -> float:
+        with self._pending_lock:
+            if not self._pending_added_at:
+                return 0.0
+
+            oldest_added_at = next(iter(self._pending_added_at.values()))
+        return time.monotonic() - oldest_added_at
+
+    def handle(self,
+               *settings: CardSetting,
+               timings: PhaseTimings = NULL_TIMINGS,
+               person_by_uuid: Optional[dict[str, Person]] = None) -> set[int]:
+        """
+        Apply `settings` to WinDSX, returning the card numbers whose write failed. `person_by_uuid` is every denhac
+        person by DENHAC_ID, for callers handling many batches that can load it once up front. Customers missing from
+        it are created without being looked up, and the people created are added to it.
+        """
+        for cb in self._handled_callbacks:
+            for setting in settings:
+                cb(setting)
+
+        return self._apply(*self._plan(settings, timings, person_by_uuid), timings, person_by_uuid)
+
+    def plan(self, *settings: CardSetting) -> ChangeSet:
+        """Work out what `handle` would change for these settings without writing anything"""
+        change_set, _, _ = self._plan(settings, NULL_TIMINGS, None)
+        return change_set
+
+    def _plan(self,
+              settings: tuple[CardSetting, ...],
+              timings: PhaseTimings,
+              person_by_uuid: Optional[dict[str, Person]]
+              ) -> tuple[ChangeSet, dict[int, AccessCard], dict[int, Person]]:
+        settings_by_customer, duplicate_cards = group_by_customer(settings)
         for card_num in duplicate_cards:
             self._logger.error(
                 f"Card number {card_num} appears more than once in the same handle call, skipping"
             )
 
-        valid_settings = [s for s in settings if s.card not in duplicate_cards]
-
-        if not valid_settings:
-            return
+        if not settings_by_customer:
+            return ChangeSet(), {}, {}
+
+        existing_cards, person_by_customer_id = self._read(settings_by_customer, timings, person_by_uuid)
+        person_id_by_customer_id = {cid: person.id for cid, person in person_by_customer_id.items()}
+        change_set = self._planner.plan(settings_by_customer, existing_cards, person_id_by_customer_id)
+
+        return change_set, existing_cards, person_by_customer_id
+
+    def _read(self,
+              settings_by_customer: SettingsByCustomer,
+              timings: PhaseTimings,
+              person_by_uuid: Optional[dict[str, Person]]) -> tuple[dict[int, AccessCard], dict[int, Person]]:
+        card_numbers = [s.card for settings in settings_by_customer.values() for s in settings]
+        if self.mirror is not None:
+            with timings.phase("mirror_load"):
+                self.mirror.load()
+            existing_cards, card_numbers = self.mirror.cards(card_numbers)
+        else:
+            existing_cards: dict[int, AccessCard] = {}
+
+        if card_numbers:
+            with timings.phase("card_lookup"):
+                for card in self._access_card_lookup.with_people().by_card_numbers(*card_numbers):
+                    existing_cards[card.card_number] = card
+                    if self.mirror is not None:
+                        self.mirror.add_card(card)
+
+        # Encoding makes each customer's DENHAC_ID decodable, then existing cards are grouped by the customer their
+        # eager-loaded person belongs to
+        for customer_id in settings_by_customer:
+            denhac_ids.encode(customer_id)
+
+        cards_by_customer: dict[int, list[AccessCard]] = {}
+        for card in existing_cards.values():
+            udf_value = card.person.user_defined_fields.get(self._config.udf_key_denhac_id)
+            customer_id = denhac_ids.decode(udf_value)
+            if customer_id in settings_by_customer:
+                cards_by_customer.setdefault(customer_id, []).append(card)
 
-        unique_customer_ids = {s.customer_id for s in valid_settings}
-        uuid_by_customer_id = {
-            cid: str(uuid.uuid5(uuid.NAMESPACE_OID, str(cid)))
-            for cid in unique_customer_ids
+        person_by_customer_id: dict[int, Person] = {
+            customer_id: cards[0].person for customer_id, cards in cards_by_customer.items()
         }
-        uuid_to_customer_id = {v: k for k, v in uuid_by_customer_id.items()}
 
-        card_numbers = [s.card for s in valid_settings]
-        existing_cards: dict[int, AccessCard] = {
-            card.card_number: card
-            for card in self._access_card_lookup.with_people().by_card_numbers(*card_numbers)
-        }
+        if self.mirror is not None:
+            for customer_id in settings_by_customer:
+                if customer_id not in person_by_customer_id:
+                    person = self.mirror.person(denhac_ids.encode(customer_id))
+                    if person is not None:
+                        person_by_customer_id[customer_id] = person
 
-        # Build person map from eager-loaded card people where possible
-        person_by_customer_id: dict[int, Person] = {}
-        for card in existing_cards.values():
-            udf_value = card.person.user_defined_fields.get(self._config.udf_key_denhac_id)
-            if udf_value not in uuid_to_customer_id:
-                continue
+        # UDF lookup only for customer_ids not found via eager load
+        missing_customer_ids = [cid for cid in settings_by_customer if cid not in person_by_customer_id]
+        if person_by_uuid is not None:
+            found = {}
+            for customer_id in missing_customer_ids:
+                person = person_by_uuid.get(denhac_ids.encode(customer_id))
+                if person is not None:
+                    found[customer_id] = person
+        elif len(missing_customer_ids) >= self._batch_lookup_threshold:
+            found = self._find_people_batched(missing_customer_ids, timings)
+        else:
+            found = self._find_people(missing_customer_ids, timings)
+
+        for customer_id, person in found.items():
+            self._logger.info(f"Found person {person.id}: {person.first_name} {person.last_name}")
+            person_by_customer_id[customer_id] = person
+            if self.mirror is not None:
+                self.mirror.add_person(person)
 
-            customer_id = uuid_to_customer_id[udf_value]
-            if customer_id not in person_by_customer_id:
-                person_by_customer_id[customer_id] = card.person
+        return existing_cards, person_by_customer_id
 
-        # UDF lookup only for customer_ids not found via eager load
-        for customer_id in unique_customer_ids:
-            if customer_id in person_by_customer_id:
-                continue
+    def _find_people(self, customer_ids: list[int], timings: PhaseTimings) -> dict[int, Person]:
+        person_by_customer_id: dict[int, Person] = {}
+        for customer_id in customer_ids:
+            customer_uuid = denhac_ids.encode(customer_id)
+            with timings.phase("udf_lookup"):
+                people = self._person_lookup.by_udf(self._config.udf_key_denhac_id, customer_uuid).find()
 
-            customer_uuid = uuid_by_customer_id[customer_id]
-            setting_for_person = next(s for s in valid_settings if s.customer_id == customer_id)
-            people = self._person_lookup.by_udf(self._config.udf_key_denhac_id, customer_uuid).find()
-
-            if len(people) == 0:
-                person = self._person_lookup.new()
-                person.first_name = setting_for_person.first_name
-                person.last_name = setting_for_person.last_name
-                person.company_id = self._config.company_id
-                person.user_defined_fields[self._config.udf_key_denhac_id] = customer_uuid
-                person.write()
-                self._logger.info(f"Created person {person.id}: {person.first_name} {person.last_name}")
-            else:
-                person = people[0]
-                self._logger.info(f"Found person {person.id}: {person.first_name} {person.last_name}")
+            if len(people) > 0:
+                person_by_customer_id[customer_id] = people[0]
 
-            person_by_customer_id[customer_id] = person
+        return person_by_customer_id
 
-        for setting in valid_settings:
-            person = person_by_customer_id[setting.customer_id]
-            card_number = setting.card
+    def _find_people_batched(self, customer_ids: list[int], timings: PhaseTimings) -> dict[int, Person]:
+        wanted = {denhac_ids.encode(cid): cid for cid in customer_ids}
 
-            updates: set[str] = set()
+        person_by_customer_id: dict[int, Person] = {}
+        with timings.phase("udf_lookup"):
+            people = self._person_lookup.by_udf(self._config.udf_key_denhac_id).find()
+
+        for person in people:
+            customer_id = wanted.get(person.user_defined_fields.get(self._config.udf_key_denhac_id))
+            if customer_id is not None and customer_id not in person_by_customer_id:
+                person_by_customer_id[customer_id] = person
+
+        return person_by_customer_id
+
+    def _apply(self,
+               change_set: ChangeSet,
+               existing_cards: dict[int, AccessCard],
+               person_by_customer_id: dict[int, Person],
+               timings: PhaseTimings,
+               person_by_uuid: Optional[dict[str, Person]]) -> set[int]:
+        batch = WriteBatch(self._write_batch_size, self._logger, timings, self._write_executor)
+
+        new_people: list[Person] = []
+        for create in change_set.persons_to_create:
+            person = self._person_lookup.new()
+            person.first_name = create.first_name
+            person.last_name = create.last_name
+            person.company_id = self._config.company_id
+            person.user_defined_fields[self._config.udf_key_denhac_id] = create.denhac_uuid
+            person_by_customer_id[create.customer_id] = person
+            new_people.append(person)
+            batch.add_person(person)
+
+        cards_to_write: list[AccessCard] = []
+        for change in change_set.card_changes:
+            setting = change.setting
+            card = self._access_card_lookup.new(setting.card) if change.create else existing_cards[setting.card]
+            card.person = person_by_customer_id[setting.customer_id]
+
+            for access in change.access_adds:
+                self._logger.info(f"Adding `{access}` access level to {setting.card}")
+                card.with_access(access)
+
+            for access in change.access_removes:
+                self._logger.info(f"Removing `{access}` from {setting.card}")
+                card.without_access(access)
+
+            self._add_pending(setting)
+            cards_to_write.append(card)
+            batch.add_card(card)
+
+        batch.flush()
+        if batch.flush_seconds:
+            self.writes_per_second = batch.writes_per_second
+            self._logger.info(f"Wrote {batch.people_written} people and {batch.cards_written} cards in "
+                              f"{batch.flush_seconds:.3f}s ({self.writes_per_second:.1f} writes/s)")
+
+        for person in new_people:
+            if not batch.failed(person):
+                self._logger.info(f"Created person {person.id}: {person.first_name} {person.last_name}")
+                if self.mirror is not None:
+                    self.mirror.add_person(person)
+                if person_by_uuid is not None:
+                    person_by_uuid[person.user_defined_fields[self._config.udf_key_denhac_id]] = person
+
+        failed_cards: set[int] = set()
+        for change, card in zip(change_set.card_changes, cards_to_write):
+            # No push will ever arrive for a card that failed to write
+            if batch.failed(card):
+                failed_cards.add(change.setting.card)
+                self._discard_pending(change.setting)
+                # The card object was changed in memory but not in WinDSX, so the mirror can't trust it any more
+                if self.mirror is not None:
+                    self.mirror.discard_card(card.card_number)
+                continue
 
-            if card_number in existing_cards:
-                card = existing_cards[card_number]
-                if card.name_id != person.id:
-                    updates.add("Changing owner")
-            else:
-                card = self._access_card_lookup.new(card_number)
+            if self.mirror is not None:
+                self.mirror.add_card(card)
 
-            card.person = person
+            with timings.phase("slack_post"):
+                self._config.slack.emit(change.notification)
 
-            if self._update_access(card, self._config.denhac_access, setting.enable_denhac):
-                updates.add(("Adding" if setting.enable_denhac else "Removing") + " denhac")
+        for setting in change_set.unchanged:
+            card = existing_cards.get(setting.card) or self._access_card_lookup.new(setting.card)
+            card.person = person_by_customer_id[setting.customer_id]
+            self._add_pending(setting)
+            self.card_updated(card, send_notice=False)
 
-            if self._update_access(card, self._config.server_room_access, setting.enable_server_room):
-                updates.add(("Adding" if setting.enable_server_room else "Removing") + " server room")
+        return failed_cards
 
-            # denhac cards should not also get main building access
-            if self._update_access(card, self._config.main_building_access, False):
-                updates.add("Removing extra MBD")
+    def _add_pending(self, setting: CardSetting) -> None:
+        with self._pending_lock:
+            expired = self._expire_pending_locked()
 
-            self._pending_settings.add(setting)
+            pending = self._pending_settings.setdefault(setting.card, [])
+            if setting not in pending:
+                pending.append(setting)
+            self._pending_added_at[setting] = time.monotonic()
+            self._pending_added_at.move_to_end(setting)
 
-            if len(updates):
-                update_msg = self._join_with_and(list(updates))
-                self._config.slack.emit(
-                    f"Updating card {setting.card} for {setting.first_name} {setting.last_name}: {update_msg}"
-                )
-                self._logger.info(f"Writing Card {setting.card}")
-                card.write()
-            else:
-                self.card_updated(card, send_notice=False)
+            over_cap = []
+            while len(self._pending_added_at) > self._pending_max:
+                oldest = next(iter(self._pending_added_at))
+                self._discard_pending_locked(oldest)
+                over_cap.append(oldest)
 
-    def _update_access(self, card: AccessCard, access: str, should_be_active: bool) -> bool:
-        has_access = access in card.access
-        if should_be_active and not has_access:
-            self._logger.info(f"Adding `{access}` access level to {card.card_number}")
-            card.with_access(access)
-            return True
+        self._evicted(expired, f"No push after {self._pending_ttl}s")
+        self._evicted(over_cap, "Too many pending card updates")
 
-        if not should_be_active and has_access:
-            self._logger.info(f"Removing `{access}` from {card.card_number}")
-            card.without_access(access)
-            return True
+    def _discard_pending(self, setting: CardSetting) -> None:
+        with self._pending_lock:
+            self._discard_pending_locked(setting)
 
-        return False
+    def _discard_pending_locked(self, setting: CardSetting) -> None:
+        pending = self._pending_settings.get(setting.card)
+        if pending is None or setting not in pending:
+            return
 
-    @staticmethod
-    def _join_with_and(items):
-        if len(items) <= 1:
-            return "".join(items)
-        return ", ".join(items[:-1]) + " and " + items[-1]
+        pending.remove(setting)
+        if not pending:
+            del self._pending_settings[setting.card]
+        del self._pending_added_at[setting]
+
+    def _expire_pending_locked(self) -> list[CardSetting]:
+        expire_before = time.monotonic() - self._pending_ttl
+        expired = []
+        while self._pending_added_at:
+            oldest, added_at = next(iter(self._pending_added_at.items()))
+            if added_at > expire_before:
+                break
+
+            self._discard_pending_locked(oldest)
+            expired.append(oldest)
+
+        return expired
+
+    def _evicted(self, settings: list[CardSetting], reason: str) -> None:
+        # Called outside the lock, each setting only by the thread that removed it, so callbacks fire once
+        for setting in settings:
+            self._logger.warning(f"{reason}, dropping card {setting.card}")
+            with self._pending_lock:
+                self.evicted += 1
+            for cb in self._eviction_callbacks:
+                cb(setting)
+
+    def verify_mirror(self) -> None:
+        """Refresh anything in the mirror that has drifted from WinDSX, at most once per verify interval"""
+        if self.mirror is None or not self.mirror.verify_due():
+            return
+
+        drifted = self.mirror.verify()
+        if drifted:
+            self._logger.warning(f"Card mirror had drifted from WinDSX on {drifted} entries, refreshed them")
 
     def card_updated(self, access_card: AccessCard, send_notice: bool = True) -> None:
         person = access_card.person
-        known_settings = [
-            s for s in self._pending_settings
-            if s.card == access_card.card_number
-        ]
-        if len(known_settings) == 0:
+        if self.mirror is not None:
+            self.mirror.add_card(access_card)
+        with self._pending_lock:
+            expired = self._expire_pending_locked()
+            pending = self._pending_settings.get(access_card.card_number)
+            setting = pending[0] if pending else None
+            if setting is not None:
+                self._discard_pending_locked(setting)
+
+        self._evicted(expired, f"No push after {self._pending_ttl}s")
+        if setting is None:
             return
 
-        setting = known_settings.pop()
-        self._pending_settings.discard(setting)
-
         if send_notice:
             self._config.slack.emit(
                 f"Card {access_card.card_number} updated for {person.first_name} {person.last_name}"
             )
 
-        for cb in self._callbacks:
-            cb(setting)
+        self.callbacks.dispatch(self._callbacks, setting)
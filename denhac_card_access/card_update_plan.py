@@ -0,0 +1,157 @@
+from dataclasses import dataclass, field
+from typing import Iterable, Mapping, Optional, Sequence
+
+from card_automation_server.windsx.lookup.access_card import AccessCard
+
+from denhac_card_access.access_levels import AccessLevelRegistry
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.config import Config
+from denhac_card_access.denhac_id import denhac_ids
+
+
+SettingsByCustomer = dict[int, list[CardSetting]]
+
+
+def group_by_customer(settings: Iterable[CardSetting]) -> tuple[SettingsByCustomer, set[int]]:
+    """
+    Group settings by customer id in a single pass, keeping the order they were given in. Any card number that appears
+    more than once is dropped from the groups and returned as a duplicate.
+    """
+    settings_by_customer: SettingsByCustomer = {}
+    seen_cards: set[int] = set()
+    duplicate_cards: set[int] = set()
+    for setting in settings:
+        if setting.card in seen_cards:
+            duplicate_cards.add(setting.card)
+        seen_cards.add(setting.card)
+        settings_by_customer.setdefault(setting.customer_id, []).append(setting)
+
+    if duplicate_cards:
+        for customer_id in list(settings_by_customer):
+            group = [s for s in settings_by_customer[customer_id] if s.card not in duplicate_cards]
+            if group:
+                settings_by_customer[customer_id] = group
+            else:
+                del settings_by_customer[customer_id]
+
+    return settings_by_customer, duplicate_cards
+
+
+@dataclass(frozen=True)
+class PersonCreate:
+    customer_id: int
+    first_name: str
+    last_name: str
+    denhac_uuid: str
+
+
+@dataclass(frozen=True)
+class CardChange:
+    setting: CardSetting
+    create: bool
+    owner_change: bool
+    access_adds: tuple[str, ...]
+    access_removes: tuple[str, ...]
+    notification: str
+
+
+@dataclass
+class ChangeSet:
+    persons_to_create: list[PersonCreate] = field(default_factory=list)
+    card_changes: list[CardChange] = field(default_factory=list)
+    # Settings whose card already matches, no write needed
+    unchanged: list[CardSetting] = field(default_factory=list)
+
+    @property
+    def cards_to_create(self) -> list[int]:
+        return [c.setting.card for c in self.card_changes if c.create]
+
+    @property
+    def owner_changes(self) -> list[int]:
+        return [c.setting.card for c in self.card_changes if c.owner_change]
+
+    @property
+    def access_adds(self) -> list[tuple[int, str]]:
+        return [(c.setting.card, access) for c in self.card_changes for access in c.access_adds]
+
+    @property
+    def access_removes(self) -> list[tuple[int, str]]:
+        return [(c.setting.card, access) for c in self.card_changes for access in c.access_removes]
+
+    @property
+    def notifications(self) -> list[str]:
+        return [c.notification for c in self.card_changes]
+
+    def __len__(self):
+        return len(self.persons_to_create) + len(self.card_changes)
+
+
+class CardUpdatePlanner:
+    """
+    Decides what has to change in WinDSX for a set of card settings. Planning works purely on data that has already
+    been read, so it never touches the database and can be run as a dry run.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._access_levels = AccessLevelRegistry.from_config(config)
+
+    def plan(self,
+             settings_by_customer: Mapping[int, Sequence[CardSetting]],
+             existing_cards: Mapping[int, AccessCard],
+             person_id_by_customer_id: Mapping[int, int]) -> ChangeSet:
+        """
+        `existing_cards` are the cards already in WinDSX by card number, and `person_id_by_customer_id` the people
+        already in WinDSX. Any customer without a person gets one created.
+        """
+        change_set = ChangeSet()
+
+        for customer_id, settings in settings_by_customer.items():
+            person_id: Optional[int] = person_id_by_customer_id.get(customer_id)
+            if person_id is None:
+                first_setting = settings[0]
+                change_set.persons_to_create.append(PersonCreate(
+                    customer_id=customer_id,
+                    first_name=first_setting.first_name,
+                    last_name=first_setting.last_name,
+                    denhac_uuid=denhac_ids.encode(customer_id),
+                ))
+
+            for setting in settings:
+                self._plan_card(change_set, setting, existing_cards.get(setting.card), person_id)
+
+        return change_set
+
+    def _plan_card(self,
+                   change_set: ChangeSet,
+                   setting: CardSetting,
+                   card: Optional[AccessCard],
+                   person_id: Optional[int]) -> None:
+        create = card is None
+        owner_change = not create and (person_id is None or card.name_id != person_id)
+        current = 0 if create else self._access_levels.mask(card.access)
+        adds, removes = self._access_levels.diff(current, self._access_levels.desired(setting))
+
+        if not owner_change and not adds and not removes:
+            change_set.unchanged.append(setting)
+            return
+
+        updates = ["Changing owner"] if owner_change else []
+        for level in self._access_levels.levels(adds | removes):
+            updates.append(f"{'Adding' if adds & self._access_levels.bit(level.name) else 'Removing'} {level.label}")
+
+        change_set.card_changes.append(CardChange(
+            setting=setting,
+            create=create,
+            owner_change=owner_change,
+            access_adds=self._access_levels.names(adds),
+            access_removes=self._access_levels.names(removes),
+            notification=f"Updating card {setting.card} for {setting.first_name} {setting.last_name}: "
+                         f"{self._join_with_and(updates)}",
+        ))
+
+    @staticmethod
+    def _join_with_and(items):
+        if len(items) <= 1:
+            return "".join(items)
+        return ", ".join(items[:-1]) + " and " + items[-1]
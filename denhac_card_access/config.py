@@ -6,9 +6,9 @@ from typing import Optional
 import requests
 import tomlkit
 from card_automation_server.plugins.config import BaseConfig, ConfigHolder, ConfigProperty, TomlConfigType
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib3 import Retry
+
+from denhac_card_access.slack_notifier import SlackNotifier, slack_notifier
+from denhac_card_access.webhook_session import RetryBudget, WebhookSession, webhook_session
 
 
 # Enum values match weekday() from datetime.weekday()
@@ -69,23 +69,103 @@ class _SentryConfig(ConfigHolder):
 class _WebhookConfig(ConfigHolder):
     base_url: ConfigProperty[str]
     api_key: ConfigProperty[str]
+    # Hosts kept in the pool, and connections kept open to each of them
+    pool_connections: ConfigProperty[int]
+    pool_maxsize: ConfigProperty[int]
+    # Time budget for one call including retries, and the timeouts for each attempt
+    budget_seconds: ConfigProperty[float]
+    connect_timeout_seconds: ConfigProperty[float]
+    read_timeout_seconds: ConfigProperty[float]
+    # Card scans are submitted as they happen, so they get a much tighter budget
+    scan_budget_seconds: ConfigProperty[float]
+    breaker_failures: ConfigProperty[int]
+    breaker_cooldown_seconds: ConfigProperty[float]
+
+    _default_pool_connections = 4
+    _default_pool_maxsize = 10
+    _default_budget_seconds = 60
+    _default_connect_timeout_seconds = 5
+    _default_read_timeout_seconds = 30
+    _default_scan_budget_seconds = 3
+    _default_breaker_failures = 5
+    _default_breaker_cooldown_seconds = 30
 
     @property
-    def session(self) -> Session:
+    def session(self) -> WebhookSession:
         if self.api_key is None:
             raise Exception("Webhooks api key cannot be None")
 
-        session = requests.Session()
-        session.headers["Authorization"] = f"Bearer {self.api_key}"
-        session.headers["Accept"] = "application/json"
+        pool_connections = self.pool_connections
+        pool_maxsize = self.pool_maxsize
+        breaker_failures = self.breaker_failures
+        breaker_cooldown_seconds = self.breaker_cooldown_seconds
+        return webhook_session(
+            self.api_key,
+            self._default_pool_connections if pool_connections is None else pool_connections,
+            self._default_pool_maxsize if pool_maxsize is None else pool_maxsize,
+            self.default_budget,
+            self._default_breaker_failures if breaker_failures is None else breaker_failures,
+            self._default_breaker_cooldown_seconds if breaker_cooldown_seconds is None else breaker_cooldown_seconds,
+        )
+
+    @property
+    def default_budget(self) -> RetryBudget:
+        budget_seconds = self.budget_seconds
+        return RetryBudget(
+            total_seconds=self._default_budget_seconds if budget_seconds is None else budget_seconds,
+            connect_timeout=self._connect_timeout,
+            read_timeout=self._read_timeout,
+        )
+
+    @property
+    def scan_budget(self) -> RetryBudget:
+        scan_budget_seconds = self.scan_budget_seconds
+        if scan_budget_seconds is None:
+            scan_budget_seconds = self._default_scan_budget_seconds
+
+        return RetryBudget(
+            total_seconds=scan_budget_seconds,
+            connect_timeout=min(self._connect_timeout, scan_budget_seconds),
+            read_timeout=min(self._read_timeout, scan_budget_seconds),
+        )
+
+    @property
+    def _connect_timeout(self) -> float:
+        connect_timeout_seconds = self.connect_timeout_seconds
+        return self._default_connect_timeout_seconds if connect_timeout_seconds is None else connect_timeout_seconds
+
+    @property
+    def _read_timeout(self) -> float:
+        read_timeout_seconds = self.read_timeout_seconds
+        return self._default_read_timeout_seconds if read_timeout_seconds is None else read_timeout_seconds
+
+
+class _BulkSyncConfig(ConfigHolder):
+    chunk_size: ConfigProperty[int]
+    prefetch_depth: ConfigProperty[int]
+    snapshot_path: ConfigProperty[str]
+    full_sync_hours: ConfigProperty[int]
+    max_skipped_runs: ConfigProperty[int]
+    sharded: ConfigProperty[bool]
+    shard_interval_seconds: ConfigProperty[int]
+    instrument: ConfigProperty[bool]
+    run_history_size: ConfigProperty[int]
 
-        retries = Retry(total=50,
-                        backoff_factor=0.1,
-                        status_forcelist=[500, 502, 503, 504])
 
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+class _CardUpdatesConfig(ConfigHolder):
+    batch_lookup_threshold: ConfigProperty[int]
+    write_batch_size: ConfigProperty[int]
+    pending_ttl_seconds: ConfigProperty[int]
+    pending_max: ConfigProperty[int]
+    write_workers: ConfigProperty[int]
+    mirror: ConfigProperty[bool]
+    mirror_verify_seconds: ConfigProperty[int]
+    callback_queue_size: ConfigProperty[int]
 
-        return session
+
+class _ScanLogConfig(ConfigHolder):
+    history_size: ConfigProperty[int]
+    verbose_interval_seconds: ConfigProperty[float]
 
 
 class _SlackConfig(ConfigHolder):
@@ -93,24 +173,31 @@ class _SlackConfig(ConfigHolder):
     team_id: ConfigProperty[str]
     admin_token: ConfigProperty[str]
     management_token: ConfigProperty[str]
+    notify_window_seconds: ConfigProperty[float]
+    notify_queue_size: ConfigProperty[int]
 
-    def emit(self, message: str) -> None:
+    _default_notify_window_seconds = 1.0
+    _default_notify_queue_size = 1000
+
+    @property
+    def notifier(self) -> SlackNotifier:
         if self.webhook_url is None:
             raise Exception("Slack webhook url cannot be None")
 
-        payload = {
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"{message}"
-                    }
-                }
-            ]
-        }
+        notify_window_seconds = self.notify_window_seconds
+        notify_queue_size = self.notify_queue_size
+        return slack_notifier(
+            self.webhook_url,
+            self._default_notify_window_seconds if notify_window_seconds is None else notify_window_seconds,
+            self._default_notify_queue_size if notify_queue_size is None else notify_queue_size,
+        )
+
+    def emit(self, message: str) -> None:
+        """Queue a message for the webhook, it is sent in the background"""
+        self.notifier.emit(message)
 
-        requests.post(self.webhook_url, json=payload)
+    def flush(self) -> None:
+        self.notifier.flush()
 
     def user_id_by_email(self, email: str) -> Optional[str]:
         if self.management_token is None:
@@ -179,6 +266,9 @@ class Config(BaseConfig):
     webhooks: _WebhookConfig
     open_houses: _OpenHouseConfigs
     slack: _SlackConfig
+    bulk_sync: _BulkSyncConfig
+    card_updates: _CardUpdatesConfig
+    scan_log: _ScanLogConfig
 
     @property
     def udf_key_can_open_house(self) -> str:
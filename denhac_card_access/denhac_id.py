@@ -0,0 +1,73 @@
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class DenhacIdCacheInfo:
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class DenhacIdCodec:
+    """
+    Maps customer ids to the DENHAC_ID UUID stored as a user defined field on WinDSX people, and back again.
+
+    The UUID is a uuid5 of the customer id, so it can't be reversed directly. Every id that has been encoded is kept
+    in a bounded LRU cache and can be decoded until it is evicted.
+    """
+
+    def __init__(self, maxsize: int = 32768):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._uuid_by_customer_id: OrderedDict[int, str] = OrderedDict()
+        self._customer_id_by_uuid: dict[str, int] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def encode(self, customer_id: int) -> str:
+        with self._lock:
+            denhac_uuid = self._uuid_by_customer_id.get(customer_id)
+            if denhac_uuid is not None:
+                self._uuid_by_customer_id.move_to_end(customer_id)
+                self._hits += 1
+                return denhac_uuid
+
+            self._misses += 1
+            denhac_uuid = str(uuid.uuid5(uuid.NAMESPACE_OID, str(customer_id)))
+            self._uuid_by_customer_id[customer_id] = denhac_uuid
+            self._customer_id_by_uuid[denhac_uuid] = customer_id
+
+            if len(self._uuid_by_customer_id) > self._maxsize:
+                _, evicted_uuid = self._uuid_by_customer_id.popitem(last=False)
+                del self._customer_id_by_uuid[evicted_uuid]
+
+            return denhac_uuid
+
+    def decode(self, denhac_uuid: Optional[str]) -> Optional[int]:
+        with self._lock:
+            customer_id = self._customer_id_by_uuid.get(denhac_uuid)
+            if customer_id is None:
+                self._misses += 1
+                return None
+
+            self._uuid_by_customer_id.move_to_end(customer_id)
+            self._hits += 1
+            return customer_id
+
+    def cache_info(self) -> DenhacIdCacheInfo:
+        with self._lock:
+            return DenhacIdCacheInfo(
+                hits=self._hits,
+                misses=self._misses,
+                maxsize=self._maxsize,
+                currsize=len(self._uuid_by_customer_id),
+            )
+
+
+# Shared by every plugin so the bulk sync and piecemeal updates hash each customer id once
+denhac_ids = DenhacIdCodec()
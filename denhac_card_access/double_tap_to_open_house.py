@@ -1,3 +1,5 @@
+import logging
+from collections import deque
 from datetime import timedelta, datetime
 from typing import Optional
 
@@ -6,7 +8,13 @@ from card_automation_server.plugins.types import CardScan, CommServerEventType
 from card_automation_server.windsx.lookup.door_lookup import DoorLookup, Door
 from card_automation_server.windsx.lookup.person import PersonLookup, Person
 
-from denhac_card_access.config import Config, OpenHouseConfig
+from denhac_card_access.config import Config
+from denhac_card_access.open_house_schedule import OpenHouseSchedule, OpenHouseWindow
+from denhac_card_access.scan_log import ScanLog
+
+
+# name_id, device, location_id. Only scans with the same key can make a double tap.
+ScanKey = tuple[int, int, int]
 
 
 class DoubleTapToOpenHouse(PluginCardScanned, PluginLoop):
@@ -23,26 +31,89 @@ class DoubleTapToOpenHouse(PluginCardScanned, PluginLoop):
         self._person_lookup = person_lookup
 
         self._logger = config.logger
+        self.scan_log = ScanLog.from_config(config)
+
+        # Recent scans per key, oldest first, plus every key in the order it was scanned so expiry can stop at the first
+        # scan still inside the window instead of walking everything
+        self._card_scans: dict[ScanKey, deque[CardScan]] = {}
+        self._scan_order: deque[tuple[datetime, ScanKey]] = deque()
+        self._scan_count = 0
+
+        self._current_open_house: Optional[OpenHouseWindow] = None
+
+        # Compiled on first use, and again from loop() whenever the open house config changes
+        self._schedule: Optional[OpenHouseSchedule] = None
+        self._schedule_signature: Optional[str] = None
+
+    def _open_house_schedule(self) -> OpenHouseSchedule:
+        if self._schedule is None:
+            self._schedule_signature = repr(self._config.open_houses)
+            self._schedule = OpenHouseSchedule.compile(self._config.open_houses.items(), self._logger)
+
+        return self._schedule
+
+    def _refresh_schedule(self) -> None:
+        if self._schedule is not None and repr(self._config.open_houses) != self._schedule_signature:
+            self._logger.info("Open house config changed, recompiling the schedule")
+            self._schedule = None
+
+    def _expire_scans(self, before: datetime) -> None:
+        while self._scan_order and self._scan_order[0][0] < before:
+            _, key = self._scan_order.popleft()
+            scans = self._card_scans.get(key)
+            if scans is None:
+                continue  # Already cleared by a double tap
+
+            while scans and scans[0].scan_time < before:
+                scans.popleft()
+                self._scan_count -= 1
+
+            if not scans:
+                del self._card_scans[key]
+
+    def _take_matching_scans(self, key: ScanKey, card_scan: CardScan) -> list[CardScan]:
+        """Removes and returns the scans for `key` within `_scan_within` before `card_scan`"""
+        scans = self._card_scans.get(key)
+        if scans is None:
+            return []
+
+        after = card_scan.scan_time - self._scan_within
+        matching = [x for x in scans if after <= x.scan_time <= card_scan.scan_time]
+        if matching:
+            kept = [x for x in scans if x.scan_time > card_scan.scan_time]
+            self._scan_count -= len(scans) - len(kept)
+            if kept:
+                self._card_scans[key] = deque(kept)
+            else:
+                del self._card_scans[key]
+
+        return matching
 
-        self._card_scans: list[CardScan] = []
+    def _add_scan(self, key: ScanKey, card_scan: CardScan) -> None:
+        scans = self._card_scans.get(key)
+        if scans is None:
+            scans = self._card_scans[key] = deque()
 
-        self._current_open_house: Optional[OpenHouseConfig] = None
+        scans.append(card_scan)
+        self._scan_order.append((card_scan.scan_time, key))
+        self._scan_count += 1
 
     def loop(self) -> int:
-        # Every minute, clear out all the card scans older than `_scan_within` time before now.
-        before = datetime.now() - self._scan_within
-        self._card_scans = [x for x in self._card_scans if x.scan_time >= before]
+        # Scans are expired as new ones come in, this catches the ones left behind once the door goes quiet
+        self._expire_scans(datetime.now() - self._scan_within)
+
+        self._refresh_schedule()
 
         if self._current_open_house is not None:
             now = datetime.now()
-            end_time = datetime.combine(now, self._current_open_house.end_time)
+            end_time = datetime.combine(now, self._current_open_house.end)
             if now > end_time:
                 self._current_open_house = None
 
         return int(self._scan_within.total_seconds())
 
     def card_scanned(self, card_scan: CardScan) -> None:
-        self._logger.info(f"Card scan: {card_scan}")
+        self.scan_log.record(card_scan)
 
         # Access was not allowed
         if card_scan.event_type != CommServerEventType.ACCESS_GRANTED:
@@ -57,31 +128,20 @@ class DoubleTapToOpenHouse(PluginCardScanned, PluginLoop):
         if door is None:
             return
 
-        self._logger.info(f"# Card scans: {len(self._card_scans)}")
-        for cs in self._card_scans:
-            self._logger.info(f"Card Scans: {cs}")
+        self._expire_scans(card_scan.scan_time - self._scan_within)
 
-        matching_scans = [
-            x for x in self._card_scans
-            if x.name_id == card_scan.name_id
-               and x.device == card_scan.device
-               and x.location_id == card_scan.location_id
-               and x.scan_time <= card_scan.scan_time
-        ]
+        key: ScanKey = (card_scan.name_id, card_scan.device, card_scan.location_id)
+        self.scan_log.verbose(logging.INFO, "# Card scans: %d", self._scan_count)
 
-        self._card_scans.append(card_scan)
+        # Taking the matching scans removes them so 3 taps isn't open and then immediately close. The current scan that
+        # triggered this is never added in that case.
+        matching_scans = self._take_matching_scans(key, card_scan)
 
         if len(matching_scans) == 0:
-            self._logger.info("No matching scans")
+            self._add_scan(key, card_scan)
+            self.scan_log.verbose(logging.INFO, "No matching scans")
             return  # Nothing more to do, we didn't get a matching scan within the last `_scan_within`
 
-        # Remove the card scans so 3 taps isn't open and then immediately close
-        for scan in matching_scans:
-            self._card_scans.remove(scan)
-
-        # Also remove the current scan that happened to trigger this
-        self._card_scans.remove(card_scan)
-
         person: Person = self._person_lookup.by_id(card_scan.name_id)
         if person is None:
             return
@@ -100,21 +160,15 @@ class DoubleTapToOpenHouse(PluginCardScanned, PluginLoop):
 
         now = datetime.now()
 
-        valid_open_houses = {
-            name: oh for (name, oh) in self._config.open_houses.items()
-            if oh.day_of_week == now.weekday()
-               and oh.scan_after_time <= now.time() < oh.end_time
-        }
+        open_house = self._open_house_schedule().active(now.weekday(), now.time())
 
-        if len(valid_open_houses) == 0:
+        if open_house is None:
             self._logger.info("No valid open houses available right now")
             return  # It's a bad time to try and open house
 
-        # We shouldn't have multiple overlapping open houses, but if we do, we pick the one with the closest end time
-        open_house_name = sorted(valid_open_houses.items(), key=lambda x: x[1].end_time)[0][0]
-        open_house: OpenHouseConfig = valid_open_houses[open_house_name]
+        open_house_name = open_house.name
 
-        time_difference: timedelta = datetime.combine(datetime.today(), open_house.end_time) - now
+        time_difference: timedelta = datetime.combine(datetime.today(), open_house.end) - now
 
         # Are we initiating or closing open house mode?
         initiating = self._current_open_house is None
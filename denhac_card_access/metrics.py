@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Iterator, Optional
+
+
+class TimingStat:
+    """Count, mean and max of a repeatedly measured duration, in seconds. Safe to record from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(time.monotonic() - started)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> float:
+        with self._lock:
+            return self._total / self._count if self._count else 0.0
+
+    @property
+    def max(self) -> float:
+        return self._max
+
+    def __repr__(self):
+        return f"TimingStat(count={self.count}, mean={self.mean:.3f}s, max={self.max:.3f}s)"
+
+
+class PhaseTimings:
+    """Wall time and count of each named phase of one run, summarised as a single key=value line"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.elapsed: Optional[float] = None
+        self._lock = threading.Lock()
+        self._phases: dict[str, list] = {}
+
+    def add(self, phase: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            totals = self._phases.setdefault(phase, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += count
+
+    @contextmanager
+    def phase(self, phase: str, count: int = 1) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, time.monotonic() - started, count)
+
+    def seconds(self, phase: str) -> float:
+        return self._phases.get(phase, [0.0, 0])[0]
+
+    def count(self, phase: str) -> int:
+        return self._phases.get(phase, [0.0, 0])[1]
+
+    def finish(self) -> None:
+        self.elapsed = time.monotonic() - self._started
+
+    def summary(self) -> str:
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self._started
+        with self._lock:
+            phases = " ".join(
+                f"{phase}={seconds:.3f}s/{count}" for phase, (seconds, count) in self._phases.items()
+            )
+        return f"run={self.name} total={elapsed:.3f}s {phases}".rstrip()
+
+
+class _NullPhaseTimings(PhaseTimings):
+    """Records nothing, for when instrumentation is turned off"""
+
+    def __init__(self):
+        super().__init__("disabled")
+        self._null_phase = nullcontext()
+
+    def add(self, phase: str, seconds: float, count: int = 1) -> None:
+        pass
+
+    def phase(self, phase: str, count: int = 1):
+        return self._null_phase
+
+
+NULL_TIMINGS: PhaseTimings = _NullPhaseTimings()
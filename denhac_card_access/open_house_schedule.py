@@ -0,0 +1,71 @@
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import time
+from typing import Iterable, Optional
+
+from denhac_card_access.config import OpenHouseConfig
+
+
+@dataclass(frozen=True)
+class OpenHouseWindow:
+    name: str
+    # Double taps from this time on start (or stop) the open house
+    start: time
+    end: time
+    door_ids: tuple[int, ...]
+
+
+class OpenHouseSchedule:
+    """
+    The configured open houses compiled into an immutable index. Each weekday has its windows sorted by end time, so
+    the window that applies at a given time is found with a bisect rather than reading every entry from the config.
+    """
+    _required = ("day_of_week", "scan_after_time", "end_time", "door_ids")
+
+    def __init__(self, windows_by_weekday: dict[int, list[OpenHouseWindow]]):
+        self._windows: dict[int, tuple[tuple[OpenHouseWindow, ...], tuple[time, ...]]] = {}
+        for weekday, windows in windows_by_weekday.items():
+            # sorted() is stable, so windows ending together keep their config order
+            ordered = tuple(sorted(windows, key=lambda w: w.end))
+            self._windows[weekday] = ordered, tuple(w.end for w in ordered)
+
+    @classmethod
+    def compile(cls,
+                open_houses: Iterable[tuple[str, OpenHouseConfig]],
+                logger: logging.Logger) -> "OpenHouseSchedule":
+        windows_by_weekday: dict[int, list[OpenHouseWindow]] = {}
+        for name, open_house in open_houses:
+            missing = [key for key in cls._required if getattr(open_house, key) is None]
+            if missing:
+                logger.warning(f"Open house `{name}` is missing {', '.join(missing)}, skipping it")
+                continue
+
+            windows_by_weekday.setdefault(int(open_house.day_of_week), []).append(OpenHouseWindow(
+                name=name,
+                start=open_house.scan_after_time,
+                end=open_house.end_time,
+                door_ids=tuple(open_house.door_ids),
+            ))
+
+        return cls(windows_by_weekday)
+
+    def __len__(self):
+        return sum(len(windows) for windows, _ in self._windows.values())
+
+    def active(self, weekday: int, at: time) -> Optional[OpenHouseWindow]:
+        """
+        The window on `weekday` with `start <= at < end`. We shouldn't have overlapping open houses, but if we do the
+        one with the closest end time wins.
+        """
+        entry = self._windows.get(weekday)
+        if entry is None:
+            return None
+
+        windows, ends = entry
+        # Everything from here on ends after `at`, the first that has already started is the one we want
+        for i in range(bisect_right(ends, at), len(windows)):
+            if windows[i].start <= at:
+                return windows[i]
+
+        return None
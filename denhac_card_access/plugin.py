@@ -5,6 +5,7 @@ from card_automation_server.plugins.error_handling import ErrorHandler, SentryEr
 from card_automation_server.plugins.setup import AutoDiscoverPlugins, HasErrorHandler
 from ioc import Resolver
 
+from denhac_card_access.card_update_helper import CardUpdateHelper
 from denhac_card_access.config import Config
 
 CardSyncMutex = Annotated[threading.Lock, "card_sync"]
@@ -18,6 +19,8 @@ class LoadDenhacPlugin(HasErrorHandler, AutoDiscoverPlugins):
 
         # The plugin loader doesn't need the result, but we must make sure it's a singleton for it to work.
         self._resolver.singleton(CardSyncMutex)
+        # Shared so bulk sync sees the cards piecemeal updates handle between its shards
+        self._resolver.singleton(CardUpdateHelper)
 
     def error_handler(self) -> ErrorHandler:
         if self._config.sentry.dsn is None:
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from typing import TypedDict, Literal, Optional, Tuple
 
@@ -6,6 +7,7 @@ from card_automation_server.windsx.lookup.access_card import AccessCard
 
 from denhac_card_access.card_update_helper import CardUpdateHelper, CardSetting
 from denhac_card_access.config import Config
+from denhac_card_access.metrics import TimingStat
 from denhac_card_access.plugin import CardSyncMutex
 
 
@@ -38,22 +40,26 @@ class ProcessPiecemealUpdate(PluginLoop, PluginCardDataPushed):
 
         self._card_update_helper = card_update_helper
         self._card_update_helper.register(self._mark_complete)
+        self._card_update_helper.register_eviction(self._retry_evicted)
 
         self._known_requests: set[int] = set()
         self._name_card_to_request: dict[Tuple[int, int], int] = {}
 
+        # How long each loop waited on the card sync mutex, usually behind a bulk sync
+        self.lock_wait = TimingStat()
+
     def loop(self) -> Optional[int]:
+        waiting_since = time.monotonic()
         with self._card_sync_mutex:
+            self.lock_wait.record(time.monotonic() - waiting_since)
             self._loop_locked()
+            self._card_update_helper.verify_mirror()
 
         return int(timedelta(minutes=1).total_seconds())
 
     def _loop_locked(self):
         for command in self._get_commands():
-            try:
-                self._maybe_handle_request(command)
-            finally:
-                self._known_requests.add(command["id"])
+            self._maybe_handle_request(command)
 
     def _get_commands(self) -> list[_CardCommand]:
         response = self._config.webhooks.session.get(f"{self._api_base}/card_updates")
@@ -71,6 +77,7 @@ class ProcessPiecemealUpdate(PluginLoop, PluginCardDataPushed):
         if update_id in self._known_requests:
             return
 
+        self._known_requests.add(update_id)
         self._logger.info(f"Processing update {update_id}")
 
         setting = CardSetting(
@@ -85,22 +92,39 @@ class ProcessPiecemealUpdate(PluginLoop, PluginCardDataPushed):
         item = int(setting.customer_id), int(setting.card)
         self._name_card_to_request[item] = update_id
 
-        self._card_update_helper.handle(setting)
+        if setting.card in self._card_update_helper.handle(setting):
+            # Forgetting the request lets the next loop try it again
+            self._known_requests.discard(update_id)
+            del self._name_card_to_request[item]
+            raise Exception(f"Failed to write card {setting.card} for update {update_id}")
 
     def card_data_pushed(self, access_card: AccessCard) -> None:
         self._card_update_helper.card_updated(access_card)
 
     def _mark_complete(self, setting: CardSetting) -> None:
         item = int(setting.customer_id), int(setting.card)
-        update_id = self._name_card_to_request[item]
+        # The helper is shared with bulk sync, so completions come in for its settings too
+        update_id = self._name_card_to_request.pop(item, None)
+        if update_id is None:
+            return
 
         self._logger.info(f"Processed update {update_id}")
-        del self._name_card_to_request[item]
         if update_id in self._known_requests:
             self._known_requests.remove(update_id)
 
         self._submit_status(update_id, "success")
 
+    def _retry_evicted(self, setting: CardSetting) -> None:
+        item = int(setting.customer_id), int(setting.card)
+        update_id = self._name_card_to_request.pop(item, None)
+        if update_id is None:
+            return
+
+        # Forgetting the request lets the next loop handle it again, which either completes it straight away if the
+        # card is already correct or writes it again
+        self._logger.warning(f"No card push for update {update_id}, retrying it")
+        self._known_requests.discard(update_id)
+
     def _submit_status(self, update_id: int, status: str):
         url = f"{self._api_base}/card_updates/{update_id}/status"
         response = self._config.webhooks.session.post(url, json={
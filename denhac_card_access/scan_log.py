@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from card_automation_server.plugins.types import CardScan
+
+from denhac_card_access.config import Config
+
+
+class ScanLog:
+    """
+    Logging for the card scan path, where every call happens once per scan. Messages take %-style args so nothing is
+    formatted unless the level is enabled. Verbose messages are rate limited to one per `verbose_interval_seconds` for
+    each message, with a count of the ones skipped. Instead of logging each scan, the last `history_size` scans are kept
+    in a ring buffer and only formatted when someone asks for them with `dump`.
+    """
+    _default_history_size: int = 256
+    _default_verbose_interval_seconds: float = 1.0
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 history_size: int = _default_history_size,
+                 verbose_interval_seconds: float = _default_verbose_interval_seconds):
+        self._logger = logger
+        self._recent: deque[CardScan] = deque(maxlen=history_size)
+        self._verbose_interval = verbose_interval_seconds
+        self._lock = threading.Lock()
+        # Per message: when it may next be logged, and how many were skipped since it last was
+        self._verbose: dict[str, list] = {}
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ScanLog":
+        history_size = config.scan_log.history_size
+        verbose_interval_seconds = config.scan_log.verbose_interval_seconds
+        return cls(
+            config.logger,
+            cls._default_history_size if history_size is None else history_size,
+            cls._default_verbose_interval_seconds if verbose_interval_seconds is None else verbose_interval_seconds,
+        )
+
+    def record(self, card_scan: CardScan) -> None:
+        self._recent.append(card_scan)
+
+    def recent(self) -> list[CardScan]:
+        """The buffered scans, oldest first"""
+        return list(self._recent)
+
+    def dump(self, level: int = logging.INFO) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+
+        recent = self.recent()
+        self._logger.log(level, "Last %d card scans:", len(recent))
+        for card_scan in recent:
+            self._logger.log(level, "Card scan: %s", card_scan)
+
+    def log(self, level: int, msg: str, *args: Any) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, *args)
+
+    def verbose(self, level: int, msg: str, *args: Any) -> None:
+        """Like `log`, but each `msg` at most once per `verbose_interval_seconds`"""
+        if not self._logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            state = self._verbose.setdefault(msg, [0.0, 0])
+            if now < state[0]:
+                state[1] += 1
+                self.suppressed += 1
+                return
+
+            suppressed = state[1]
+            state[0] = now + self._verbose_interval
+            state[1] = 0
+
+        if suppressed:
+            self._logger.log(level, "%d more `%s` messages suppressed", suppressed, msg)
+        self._logger.log(level, msg, *args)
@@ -0,0 +1,121 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from denhac_card_access.metrics import TimingStat
+
+_logger = logging.getLogger(__name__)
+
+
+class SlackNotifier:
+    """
+    Posts messages to a Slack webhook from a background thread so callers never wait on Slack. Messages that arrive
+    within `window_seconds` of each other are sent together as one payload with a section block per message, up to
+    Slack's limit of 50 blocks. When the queue is full, new messages are dropped and counted. Anything still queued is
+    sent when the process exits.
+    """
+    max_blocks = 50
+
+    def __init__(self, webhook_url: str, window_seconds: float = 1.0, queue_size: int = 1000):
+        self._webhook_url = webhook_url
+        self._window = window_seconds
+        self._queue: queue.Queue[tuple[float, str]] = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # From emit until the payload carrying the message was posted
+        self.send_latency = TimingStat()
+        self.dropped = 0
+        self.failed = 0
+        self.sent = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def emit(self, message: str) -> None:
+        self._ensure_sender()
+        try:
+            self._queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            _logger.warning(f"Slack queue is full, dropping message: {message}")
+
+    def flush(self) -> None:
+        """Wait until every message emitted so far has been sent"""
+        self._queue.join()
+
+    def _ensure_sender(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._send_forever, name="slack-notifier", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _send_forever(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self.max_blocks:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                self._send(batch)
+            except Exception:
+                with self._lock:
+                    self.failed += len(batch)
+                _logger.exception(f"Failed to send {len(batch)} Slack messages")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send(self, batch: list[tuple[float, str]]) -> None:
+        payload = {
+            "blocks": [
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": f"{message}"
+                    }
+                }
+                for _, message in batch
+            ]
+        }
+
+        response = requests.post(self._webhook_url, json=payload, timeout=10)
+        # Slack answers rate limits with 429 and bad payloads with 400
+        if not response.ok:
+            with self._lock:
+                self.failed += len(batch)
+            _logger.error(f"Slack rejected {len(batch)} messages with {response.status_code}: {response.text}")
+            return
+
+        sent_at = time.monotonic()
+        with self._lock:
+            self.sent += len(batch)
+        for emitted_at, _ in batch:
+            self.send_latency.record(sent_at - emitted_at)
+
+
+_notifiers: dict[str, SlackNotifier] = {}
+_notifiers_lock = threading.Lock()
+
+
+def slack_notifier(webhook_url: str, window_seconds: float, queue_size: int) -> SlackNotifier:
+    """The shared notifier for a webhook url, so every config access queues onto the same sender"""
+    with _notifiers_lock:
+        notifier = _notifiers.get(webhook_url)
+        if notifier is None:
+            notifier = _notifiers[webhook_url] = SlackNotifier(webhook_url, window_seconds, queue_size)
+        return notifier
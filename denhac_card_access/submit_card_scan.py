@@ -1,3 +1,4 @@
+import logging
 from typing import Optional
 
 from card_automation_server.plugins.interfaces import PluginCardScanned
@@ -6,6 +7,7 @@ from card_automation_server.windsx.lookup.door_lookup import DoorLookup, Door
 from card_automation_server.windsx.lookup.person import Person, PersonLookup
 
 from denhac_card_access.config import Config
+from denhac_card_access.scan_log import ScanLog
 
 
 class SubmitCardScan(PluginCardScanned):
@@ -16,11 +18,13 @@ class SubmitCardScan(PluginCardScanned):
                  ):
         self._config = config
         self._logger = config.logger
+        self.scan_log = ScanLog.from_config(config)
 
         if self._config.webhooks.base_url is None:
             raise Exception("Webhooks base url cannot be None")
         self._api_base = self._config.webhooks.base_url
-        self._session = self._config.webhooks.session
+        # A scan is reported while the card server waits, so retries are cut short rather than holding it up
+        self._session = self._config.webhooks.session.with_budget(self._config.webhooks.scan_budget)
 
         self._door_lookup = door_lookup
         self._person_lookup = person_lookup
@@ -41,13 +45,16 @@ class SubmitCardScan(PluginCardScanned):
         if self._config.udf_key_denhac_id not in person.user_defined_fields:
             return  # Not a denhac member
 
-        if access_granted:
-            self._logger.info(f"ACCESS GRANTED Loc={door.location_id} Door={door.device_id} Name=`{door.name}`")
-        else:
-            self._logger.info(f"ACCESS DENIED Loc={door.location_id} Door={door.device_id} Name=`{door.name}`")
+        self.scan_log.record(card_scan)
+        self.scan_log.log(logging.INFO,
+                          "ACCESS %s Loc=%s Door=%s Name=`%s`",
+                          "GRANTED" if access_granted else "DENIED",
+                          door.location_id,
+                          door.device_id,
+                          door.name)
 
         url = f"{self._api_base}/events/card_scanned"
-        self._logger.info(url)
+        self.scan_log.log(logging.DEBUG, "%s", url)
         response = self._session.post(url, json={
             "first_name": person.first_name,
             "last_name": person.last_name,
@@ -0,0 +1,242 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+
+@dataclass(frozen=True)
+class ConnectionStats:
+    # TCP connections opened and requests sent over them, across every pooled host
+    connections: int
+    requests: int
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.connections
+
+
+@dataclass(frozen=True)
+class RetryBudget:
+    # Total time one call may take, retries and backoff included
+    total_seconds: float
+    connect_timeout: float
+    read_timeout: float
+    backoff_seconds: float = 0.1
+    max_backoff_seconds: float = 5.0
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` failures in a row, so calls fail straight away instead of waiting on a sick API.
+    After `cooldown_seconds` one call is let through as a probe. If it succeeds the breaker closes, otherwise it opens
+    again for another cooldown.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probing else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self._cooldown:
+                return False
+
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing:
+                self._opened_at = time.monotonic()
+                self._probing = False
+            elif self._opened_at is None and self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
+                self.trips += 1
+
+
+class WebhookSession(Session):
+    """
+    A session for the denhac webhook API whose connection pool is kept alive and shared between plugins.
+
+    Every call has a RetryBudget: connection errors, timeouts and 5xx responses are retried with jittered exponential
+    backoff only while the budget has time left, so a sick API can't hold the card sync mutex for minutes. Methods that
+    aren't idempotent, like POST, are only retried when the connection couldn't be made. All calls share one circuit
+    breaker.
+    """
+    retry_statuses = frozenset({500, 502, 503, 504})
+    # Same as urllib3's Retry.DEFAULT_ALLOWED_METHODS. Anything else is only retried if it was never sent.
+    idempotent_methods = frozenset({"DELETE", "GET", "HEAD", "OPTIONS", "PUT", "TRACE"})
+
+    def __init__(self,
+                 api_key: str,
+                 pool_connections: int,
+                 pool_maxsize: int,
+                 default_budget: RetryBudget,
+                 breaker: CircuitBreaker):
+        super().__init__()
+        self.headers["Authorization"] = f"Bearer {api_key}"
+        self.headers["Accept"] = "application/json"
+        self.default_budget = default_budget
+        self.breaker = breaker
+
+        # Retries are done in request() against the budget, not by urllib3
+        self._adapter = HTTPAdapter(max_retries=0,
+                                    pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize)
+        self.mount('https://', self._adapter)
+
+    def with_budget(self, budget: RetryBudget) -> "BudgetedSession":
+        """A view of this session, sharing its pool and breaker, whose calls use `budget` by default"""
+        return BudgetedSession(self, budget)
+
+    def request(self, method, url, *args, budget: Optional[RetryBudget] = None, **kwargs) -> Response:
+        budget = budget or self.default_budget
+        deadline = time.monotonic() + budget.total_seconds
+        idempotent = method.upper() in self.idempotent_methods
+        attempt = 0
+        error: Optional[requests.RequestException] = None
+        response: Optional[Response] = None
+        while True:
+            if not self.breaker.allow():
+                # Opened while this call was retrying, so give back what the last attempt got
+                if response is not None:
+                    return response
+                raise error or CircuitOpenError(f"Webhook API circuit breaker is open, not calling {url}")
+
+            remaining = max(deadline - time.monotonic(), 0.001)
+            kwargs["timeout"] = (min(budget.connect_timeout, remaining), min(budget.read_timeout, remaining))
+            error = None
+            response = None
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except BaseException:
+                # Anything else still has to settle the breaker, or a failed probe would leave it half open for good
+                self.breaker.record_failure()
+                raise
+
+            if response is not None and response.status_code not in self.retry_statuses:
+                self.breaker.record_success()
+                return response
+
+            self.breaker.record_failure()
+            # A POST may have reached the API even though it failed, so it's only sent again if it never connected
+            if not idempotent and not self._not_sent(error):
+                if response is not None:
+                    return response
+                raise error
+
+            attempt += 1
+            delay = random.uniform(0, min(budget.max_backoff_seconds, budget.backoff_seconds * 2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise error
+
+            time.sleep(delay)
+
+    @staticmethod
+    def _not_sent(error: Optional[requests.RequestException]) -> bool:
+        """Whether `error` means the connection was never made, so the request can't have been seen"""
+        if error is None:
+            return False
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+
+        # requests wraps urllib3's MaxRetryError, whose reason is the underlying error. NewConnectionError, which
+        # covers refused connections and failed DNS lookups, is a ConnectTimeoutError too.
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, ConnectTimeoutError)
+
+    @property
+    def connection_stats(self) -> ConnectionStats:
+        pools = self._adapter.poolmanager.pools
+        connections = 0
+        sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            sent += pool.num_requests
+
+        return ConnectionStats(connections=connections, requests=sent)
+
+
+class BudgetedSession:
+    def __init__(self, session: WebhookSession, budget: RetryBudget):
+        self._session = session
+        self.budget = budget
+
+    def request(self, method, url, **kwargs) -> Response:
+        kwargs.setdefault("budget", self.budget)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs) -> Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> Response:
+        return self.request("POST", url, **kwargs)
+
+
+_sessions: dict[tuple, WebhookSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def webhook_session(api_key: str,
+                    pool_connections: int,
+                    pool_maxsize: int,
+                    default_budget: RetryBudget,
+                    breaker_failures: int,
+                    breaker_cooldown_seconds: float) -> WebhookSession:
+    """
+    The shared session for these settings. Config holders are only views onto the toml document, so the session is
+    cached here and replaced, closing the old one, when the config it was built from changes.
+    """
+    key = (api_key, pool_connections, pool_maxsize, default_budget, breaker_failures, breaker_cooldown_seconds)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            for stale in _sessions.values():
+                stale.close()
+            _sessions.clear()
+            session = _sessions[key] = WebhookSession(
+                api_key,
+                pool_connections,
+                pool_maxsize,
+                default_budget,
+                CircuitBreaker(breaker_failures, breaker_cooldown_seconds),
+            )
+        return session
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Optional
+
+from card_automation_server.windsx.lookup.access_card import AccessCard
+from card_automation_server.windsx.lookup.person import Person
+
+from denhac_card_access.metrics import PhaseTimings, NULL_TIMINGS
+
+
+class WriteBatch:
+    """
+    Collects dirty people and cards during a reconcile and writes them whenever `batch_size` are waiting, people
+    before cards so every card's owner already has an id. Each object is written once no matter how often it was
+    added. A write that fails is logged and only fails that object, plus any cards owned by a person that could not be
+    written.
+    """
+
+    def __init__(self,
+                 batch_size: int,
+                 logger: logging.Logger,
+                 timings: PhaseTimings = NULL_TIMINGS,
+                 executor: Optional[Executor] = None):
+        self._batch_size = max(batch_size, 1)
+        self._logger = logger
+        self._timings = timings
+        # With an executor each person and their cards are written as one task, so different people are written
+        # concurrently while a person is always written before their cards, and their cards in the order added
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._people: dict[int, Person] = {}
+        self._cards: dict[int, AccessCard] = {}
+        self._failed_people: set[int] = set()
+        self._failed_cards: set[int] = set()
+        self.people_written = 0
+        self.cards_written = 0
+        self.flush_seconds = 0.0
+
+    def __len__(self):
+        return len(self._people) + len(self._cards)
+
+    @property
+    def writes_per_second(self) -> float:
+        writes = self.people_written + self.cards_written
+        return writes / self.flush_seconds if self.flush_seconds else 0.0
+
+    def add_person(self, person: Person) -> None:
+        self._people[id(person)] = person
+        self._flush_if_full()
+
+    def add_card(self, card: AccessCard) -> None:
+        self._cards[id(card)] = card
+        self._flush_if_full()
+
+    def failed(self, item) -> bool:
+        return id(item) in self._failed_people or id(item) in self._failed_cards
+
+    def _flush_if_full(self) -> None:
+        if len(self) >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        people, self._people = list(self._people.values()), {}
+        cards, self._cards = list(self._cards.values()), {}
+
+        started = time.monotonic()
+        if self._executor is None:
+            self._flush_serial(people, cards)
+        else:
+            self._flush_parallel(people, cards)
+        self.flush_seconds += time.monotonic() - started
+
+    def _flush_serial(self, people: list[Person], cards: list[AccessCard]) -> None:
+        if people:
+            with self._timings.phase("person_write", count=len(people)):
+                for person in people:
+                    self._write_person(person)
+
+        if cards:
+            with self._timings.phase("card_write", count=len(cards)):
+                for card in cards:
+                    self._write_card(card)
+
+    def _flush_parallel(self, people: list[Person], cards: list[AccessCard]) -> None:
+        groups: dict[int, tuple[Optional[Person], list[AccessCard]]] = {
+            id(person): (person, []) for person in people
+        }
+        for card in cards:
+            groups.setdefault(id(card.person), (None, []))[1].append(card)
+
+        futures = [self._executor.submit(self._write_group, person, group) for person, group in groups.values()]
+        for future in futures:
+            future.result()
+
+    def _write_group(self, person: Optional[Person], cards: list[AccessCard]) -> None:
+        if person is not None:
+            with self._timings.phase("person_write"):
+                self._write_person(person)
+
+        for card in cards:
+            with self._timings.phase("card_write"):
+                self._write_card(card)
+
+    def _write_person(self, person: Person) -> None:
+        if self._write(person, f"person {person.first_name} {person.last_name}"):
+            with self._lock:
+                self.people_written += 1
+        else:
+            self._failed_people.add(id(person))
+
+    def _write_card(self, card: AccessCard) -> None:
+        if id(card.person) in self._failed_people:
+            self._logger.error(f"Not writing card {card.card_number}, its person could not be written")
+            self._failed_cards.add(id(card))
+            return
+
+        self._logger.info(f"Writing Card {card.card_number}")
+        if self._write(card, f"card {card.card_number}"):
+            with self._lock:
+                self.cards_written += 1
+        else:
+            self._failed_cards.add(id(card))
+
+    def _write(self, item, description: str) -> bool:
+        try:
+            item.write()
+            return True
+        except Exception:
+            self._logger.exception(f"Failed to write {description}")
+            return False
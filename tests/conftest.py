@@ -5,7 +5,10 @@ import pytest
 
 @pytest.fixture
 def mock_webhook_session() -> Mock:
-    return Mock()
+    session = Mock()
+    # Budgeted views share the session, so tests see every call in one place
+    session.with_budget.return_value = session
+    return session
 
 
 @pytest.fixture
@@ -21,4 +24,24 @@ def mock_config(mock_webhook_session: Mock) -> MagicMock:
     config.server_room_access = 'Server Room'
     config.main_building_access = 'MBD Access'
     config.company_id = 14
+    config.bulk_sync.chunk_size = None
+    config.bulk_sync.prefetch_depth = None
+    config.bulk_sync.snapshot_path = None
+    config.bulk_sync.full_sync_hours = None
+    config.bulk_sync.max_skipped_runs = None
+    config.bulk_sync.sharded = None
+    config.bulk_sync.shard_interval_seconds = None
+    config.bulk_sync.instrument = None
+    config.bulk_sync.run_history_size = None
+    config.card_updates.batch_lookup_threshold = None
+    config.card_updates.write_batch_size = None
+    config.card_updates.pending_ttl_seconds = None
+    config.card_updates.pending_max = None
+    config.card_updates.write_workers = None
+    config.card_updates.mirror = None
+    config.card_updates.mirror_verify_seconds = None
+    # Run card update callbacks inline so tests see them straight away
+    config.card_updates.callback_queue_size = 0
+    config.scan_log.history_size = None
+    config.scan_log.verbose_interval_seconds = None
     return config
@@ -0,0 +1,52 @@
+import pytest
+
+from denhac_card_access.access_levels import AccessLevelRegistry, ManagedAccess
+from denhac_card_access.card_setting import CardSetting
+
+
+def make_setting(enable_denhac=False, enable_server_room=False):
+    return CardSetting(card=1, first_name="John", last_name="Doe", company="denhac", customer_id=100,
+                       enable_denhac=enable_denhac, enable_server_room=enable_server_room)
+
+
+@pytest.fixture
+def registry(mock_config):
+    return AccessLevelRegistry.from_config(mock_config)
+
+
+class TestMask:
+    def test_each_level_has_its_own_bit(self, registry, mock_config):
+        bits = {registry.bit(mock_config.denhac_access),
+                registry.bit(mock_config.server_room_access),
+                registry.bit(mock_config.main_building_access)}
+        assert bits == {1, 2, 4}
+
+    def test_unmanaged_levels_ignored(self, registry, mock_config):
+        assert registry.mask(["Somebody Else's Door", mock_config.denhac_access]) == \
+            registry.bit(mock_config.denhac_access)
+
+    def test_desired_follows_setting_flags(self, registry, mock_config):
+        assert registry.desired(make_setting()) == 0
+        assert registry.desired(make_setting(enable_denhac=True, enable_server_room=True)) == \
+            registry.bit(mock_config.denhac_access) | registry.bit(mock_config.server_room_access)
+
+
+class TestDiff:
+    def test_adds_and_removes(self, registry, mock_config):
+        current = registry.mask([mock_config.main_building_access, mock_config.server_room_access])
+        desired = registry.desired(make_setting(enable_denhac=True, enable_server_room=True))
+        adds, removes = registry.diff(current, desired)
+        assert registry.names(adds) == (mock_config.denhac_access,)
+        assert registry.names(removes) == (mock_config.main_building_access,)
+
+    def test_no_change(self, registry, mock_config):
+        current = registry.mask([mock_config.denhac_access])
+        assert registry.diff(current, registry.desired(make_setting(enable_denhac=True))) == (0, 0)
+
+    def test_levels_in_registration_order(self):
+        registry = AccessLevelRegistry([ManagedAccess(name, name) for name in "abcde"])
+        assert registry.names(registry.mask("eca")) == ("a", "c", "e")
+
+    def test_more_levels_than_a_byte(self):
+        registry = AccessLevelRegistry([ManagedAccess(f"level {n}", f"level {n}") for n in range(70)])
+        assert registry.names(registry.mask(["level 69", "level 3"])) == ("level 3", "level 69")
@@ -1,16 +1,21 @@
-import uuid
-from unittest.mock import Mock
+import json
+import re
+import threading
+import time
+from unittest.mock import DEFAULT, Mock, call
 
 import pytest
 
 from denhac_card_access.bulk_card_sync import BulkCardSync
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.denhac_id import denhac_ids
 
 UDF_KEY = 'DENHAC_ID'
 CAN_OPEN_HOUSE_KEY = 'dh_can_open_house'
 
 
 def customer_uuid(customer_id: int) -> str:
-    return str(uuid.uuid5(uuid.NAMESPACE_OID, str(customer_id)))
+    return denhac_ids.encode(customer_id)
 
 
 def make_api_person(customer_id=100, first_name="John", last_name="Doe",
@@ -29,10 +34,21 @@ def make_api_card(card_num="12345", access=None):
     return {"card_num": card_num, "access": access if access is not None else []}
 
 
-def make_api_response(data, next_page_url=None):
+def make_api_response(data, next_page_url=None, headers=None):
+    body = {"data": data, "next_page_url": next_page_url}
     response = Mock()
+    response.status_code = 200
+    response.headers = headers if headers is not None else {}
+    response.content = json.dumps(body).encode()
+    response.raise_for_status = Mock()
+    response.json.return_value = body
+    return response
+
+
+def make_not_modified_response():
+    response = Mock()
+    response.status_code = 304
     response.raise_for_status = Mock()
-    response.json.return_value = {"data": data, "next_page_url": next_page_url}
     return response
 
 
@@ -54,7 +70,9 @@ def make_mock_person(customer_id=100, has_can_open_house=False, first_name="John
 
 @pytest.fixture
 def mock_card_update_helper():
-    return Mock()
+    helper = Mock()
+    helper.handle.return_value = set()
+    return helper
 
 
 @pytest.fixture
@@ -66,7 +84,7 @@ def mock_person_lookup():
 
 @pytest.fixture
 def bulk_sync(mock_config, mock_card_update_helper, mock_person_lookup):
-    return BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup)
+    return BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
 
 
 class TestPagination:
@@ -102,7 +120,464 @@ class TestPagination:
         ]
         bulk_sync.loop()
         mock_card_update_helper.handle.assert_called_once()
-        assert len(mock_card_update_helper.handle.call_args[0]) == 2
+        assert len(mock_card_update_helper.handle.call_args.args) == 2
+
+
+class TestStreaming:
+    def test_settings_handled_in_chunks(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session):
+        mock_config.bulk_sync.chunk_size = 2
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        person = make_api_person(cards=[make_api_card("111"), make_api_card("222"), make_api_card("333")])
+        mock_webhook_session.get.return_value = make_api_response([person])
+        bulk_sync.loop()
+        chunks = [[s.card for s in c.args] for c in mock_card_update_helper.handle.call_args_list]
+        assert chunks == [[111, 222], [333]]
+
+    def test_first_chunk_handled_before_last_page_fetched(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session):
+        mock_config.bulk_sync.chunk_size = 1
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        events = []
+        pages = [
+            make_api_response([make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                              next_page_url='https://api.example.com/all_cards?page=2'),
+            make_api_response([make_api_person(customer_id=101, cards=[make_api_card("222")])]),
+        ]
+
+        def get(url):
+            events.append("get")
+            return pages.pop(0)
+
+        mock_webhook_session.get.side_effect = get
+        mock_card_update_helper.handle.side_effect = lambda *settings, **kwargs: events.append("handle") or DEFAULT
+        bulk_sync.loop()
+        assert events == ["get", "handle", "get", "handle"]
+
+    def test_duplicate_card_across_pages_skipped(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session):
+        mock_config.bulk_sync.chunk_size = 1
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        mock_webhook_session.get.side_effect = [
+            make_api_response([make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                              next_page_url='https://api.example.com/all_cards?page=2'),
+            make_api_response([make_api_person(customer_id=101, cards=[make_api_card("111")])]),
+        ]
+        bulk_sync.loop()
+        mock_card_update_helper.handle.assert_called_once()
+        assert mock_card_update_helper.handle.call_args.args[0].customer_id == 100
+        mock_config.logger.error.assert_called_once()
+
+    def test_duplicate_card_on_same_page_skipped_for_both(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session):
+        mock_config.bulk_sync.chunk_size = 1
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        mock_webhook_session.get.return_value = make_api_response([
+            make_api_person(customer_id=100, cards=[make_api_card("111")]),
+            make_api_person(customer_id=101, cards=[make_api_card("111"), make_api_card("222")]),
+        ])
+        bulk_sync.loop()
+        assert [[s.card for s in c.args] for c in mock_card_update_helper.handle.call_args_list] == [[222]]
+        mock_config.logger.error.assert_called_once()
+
+    def test_duplicate_card_in_same_chunk_across_pages_skipped_for_both(
+            self, bulk_sync, mock_config, mock_card_update_helper, mock_webhook_session):
+        mock_webhook_session.get.side_effect = [
+            make_api_response([make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                              next_page_url='https://api.example.com/all_cards?page=2'),
+            make_api_response([make_api_person(customer_id=101, cards=[make_api_card("111")])]),
+        ]
+        bulk_sync.loop()
+        mock_card_update_helper.handle.assert_not_called()
+        mock_config.logger.error.assert_called_once()
+
+    def test_duplicate_card_not_recorded_in_snapshot(
+            self, bulk_sync, mock_card_update_helper, mock_webhook_session):
+        mock_webhook_session.get.return_value = make_api_response([
+            make_api_person(customer_id=100, cards=[make_api_card("111"), make_api_card("222")]),
+            make_api_person(customer_id=101, cards=[make_api_card("111")]),
+        ])
+        bulk_sync.loop()
+        assert bulk_sync._snapshot.get(111) is None
+        assert bulk_sync._snapshot.get(222) is not None
+
+
+class TestPrefetch:
+    @pytest.fixture
+    def prefetch_sync(self, mock_config, mock_card_update_helper, mock_person_lookup):
+        mock_config.bulk_sync.chunk_size = 1
+        mock_config.bulk_sync.prefetch_depth = 1
+        return BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+
+    def test_next_page_fetched_while_current_page_handled(
+            self, prefetch_sync, mock_webhook_session, mock_card_update_helper):
+        second_page_requested = threading.Event()
+        pages = [
+            make_api_response([make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                              next_page_url='https://api.example.com/all_cards?page=2'),
+            make_api_response([make_api_person(customer_id=101, cards=[make_api_card("222")])]),
+        ]
+
+        def get(url):
+            if url.endswith("page=2"):
+                second_page_requested.set()
+            return pages.pop(0)
+
+        overlapped = []
+        mock_webhook_session.get.side_effect = get
+        mock_card_update_helper.handle.side_effect = \
+            lambda *settings, **kwargs: overlapped.append(second_page_requested.wait(timeout=5)) or DEFAULT
+        prefetch_sync.loop()
+        assert overlapped == [True, True]
+
+    def test_pages_handled_in_order(self, prefetch_sync, mock_webhook_session, mock_card_update_helper):
+        mock_webhook_session.get.side_effect = [
+            make_api_response([make_api_person(customer_id=100 + i, cards=[make_api_card(str(i))])],
+                              next_page_url=f'https://api.example.com/all_cards?page={i + 2}')
+            for i in range(4)
+        ] + [make_api_response([])]
+        prefetch_sync.loop()
+        cards = [c.args[0].card for c in mock_card_update_helper.handle.call_args_list]
+        assert cards == [0, 1, 2, 3]
+
+    def test_fetch_error_raised_to_loop(self, prefetch_sync, mock_webhook_session, mock_card_update_helper):
+        mock_webhook_session.get.side_effect = [
+            make_api_response([make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                              next_page_url='https://api.example.com/all_cards?page=2'),
+            RuntimeError("API down"),
+        ]
+        with pytest.raises(RuntimeError):
+            prefetch_sync.loop()
+
+
+class TestDeltaSync:
+    def test_unchanged_cards_skipped_on_second_run(
+            self, bulk_sync, mock_webhook_session, mock_card_update_helper, mock_person_lookup):
+        extra = []
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: make_api_response(
+            [make_api_person(cards=[make_api_card("111")], extra=extra)]
+        )
+        bulk_sync.loop()
+        mock_card_update_helper.handle.reset_mock()
+        mock_person_lookup.by_udf.reset_mock()
+        # The page changed, so the run isn't skipped, but the card itself didn't
+        extra = [CAN_OPEN_HOUSE_KEY]
+        bulk_sync.loop()
+        mock_card_update_helper.handle.assert_not_called()
+        mock_person_lookup.by_udf.assert_called()
+
+    def test_changed_card_sent_on_second_run(
+            self, bulk_sync, mock_webhook_session, mock_card_update_helper, mock_config):
+        mock_webhook_session.get.return_value = make_api_response(
+            [make_api_person(cards=[make_api_card("111"), make_api_card("222")])]
+        )
+        bulk_sync.loop()
+        mock_card_update_helper.handle.reset_mock()
+        mock_webhook_session.get.return_value = make_api_response(
+            [make_api_person(cards=[make_api_card("111"), make_api_card("222", access=[mock_config.denhac_access])])]
+        )
+        bulk_sync.loop()
+        assert [s.card for s in mock_card_update_helper.handle.call_args.args] == [222]
+
+    def test_failed_card_sent_again_on_next_run(
+            self, bulk_sync, mock_webhook_session, mock_card_update_helper, mock_config):
+        mock_webhook_session.get.return_value = make_api_response(
+            [make_api_person(cards=[make_api_card("111"), make_api_card("222")])]
+        )
+        mock_card_update_helper.handle.return_value = {111}
+        with pytest.raises(Exception, match="failed to write 1 cards"):
+            bulk_sync.loop()
+        assert bulk_sync._snapshot.get(111) is None
+
+        mock_card_update_helper.handle.return_value = set()
+        mock_card_update_helper.handle.reset_mock()
+        bulk_sync.loop()
+        assert [s.card for s in mock_card_update_helper.handle.call_args.args] == [111]
+
+    def test_removed_card_sent_again_when_it_returns(
+            self, bulk_sync, mock_webhook_session, mock_card_update_helper):
+        roster = [make_api_card("111")]
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: make_api_response(
+            [make_api_person(cards=roster)]
+        )
+        bulk_sync.loop()
+        roster = []
+        bulk_sync.loop()
+        roster = [make_api_card("111")]
+        mock_card_update_helper.handle.reset_mock()
+        bulk_sync.loop()
+        mock_card_update_helper.handle.assert_called_once()
+
+    def test_every_card_sent_when_full_sync_due(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session):
+        mock_config.bulk_sync.full_sync_hours = 0
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        mock_webhook_session.get.side_effect = lambda url: make_api_response(
+            [make_api_person(cards=[make_api_card("111")])]
+        )
+        bulk_sync.loop()
+        bulk_sync.loop()
+        assert mock_card_update_helper.handle.call_count == 2
+
+    def test_snapshot_not_updated_when_handle_fails(
+            self, bulk_sync, mock_webhook_session, mock_card_update_helper):
+        mock_webhook_session.get.side_effect = lambda url: make_api_response(
+            [make_api_person(cards=[make_api_card("111")])]
+        )
+        mock_card_update_helper.handle.side_effect = RuntimeError("WinDSX unavailable")
+        with pytest.raises(RuntimeError):
+            bulk_sync.loop()
+        mock_card_update_helper.handle.side_effect = None
+        mock_card_update_helper.handle.reset_mock()
+        bulk_sync.loop()
+        mock_card_update_helper.handle.assert_called_once()
+
+    def test_snapshot_persisted_between_instances(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, mock_webhook_session, tmp_path):
+        mock_config.bulk_sync.snapshot_path = str(tmp_path / "snapshot.json")
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: make_api_response(
+            [make_api_person(cards=[make_api_card("111")])]
+        )
+        BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock()).loop()
+        mock_card_update_helper.handle.reset_mock()
+        BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock()).loop()
+        mock_card_update_helper.handle.assert_not_called()
+
+
+class TestUnchangedRoster:
+    @pytest.fixture
+    def roster(self, mock_webhook_session):
+        pages = {
+            'https://api.example.com/all_cards': make_api_response(
+                [make_api_person(customer_id=100, cards=[make_api_card("111")])],
+                next_page_url='https://api.example.com/all_cards?page=2'
+            ),
+            'https://api.example.com/all_cards?page=2': make_api_response(
+                [make_api_person(customer_id=101, cards=[make_api_card("222")], extra=[CAN_OPEN_HOUSE_KEY])]
+            ),
+        }
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: pages[url]
+        return pages
+
+    def test_reconcile_skipped_when_roster_unchanged(
+            self, bulk_sync, roster, mock_card_update_helper, mock_person_lookup, mock_config):
+        bulk_sync.loop()
+        mock_card_update_helper.handle.reset_mock()
+        mock_person_lookup.by_udf.reset_mock()
+
+        bulk_sync.loop()
+
+        mock_card_update_helper.handle.assert_not_called()
+        mock_person_lookup.by_udf.assert_not_called()
+        assert "Skipping bulk sync" in mock_config.logger.info.call_args[0][0]
+
+    def test_reconcile_runs_when_a_page_changed(
+            self, bulk_sync, roster, mock_card_update_helper, mock_person_lookup):
+        bulk_sync.loop()
+        mock_person_lookup.by_udf.reset_mock()
+        roster['https://api.example.com/all_cards?page=2'] = make_api_response(
+            [make_api_person(customer_id=101, cards=[make_api_card("222")])]
+        )
+
+        bulk_sync.loop()
+
+        mock_person_lookup.by_udf.assert_called()
+
+    def test_validators_sent_on_conditional_fetch(self, bulk_sync, mock_webhook_session, mock_card_update_helper):
+        first_page = make_api_response([make_api_person(cards=[make_api_card("111")])],
+                                       headers={"ETag": '"v1"', "Last-Modified": "Wed, 03 Jan 2024 18:30:00 GMT"})
+        mock_webhook_session.get.side_effect = [first_page, make_not_modified_response()]
+        bulk_sync.loop()
+        mock_card_update_helper.handle.reset_mock()
+
+        bulk_sync.loop()
+
+        mock_webhook_session.get.assert_called_with('https://api.example.com/all_cards', headers={
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Wed, 03 Jan 2024 18:30:00 GMT",
+        })
+        mock_card_update_helper.handle.assert_not_called()
+
+    def test_full_sync_forced_after_max_skipped_runs(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, roster):
+        mock_config.bulk_sync.max_skipped_runs = 2
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        for _ in range(4):
+            bulk_sync.loop()
+
+        # First run and the run after two skips each reconcile every card
+        assert mock_card_update_helper.handle.call_count == 2
+
+    def test_no_probe_when_full_sync_due(
+            self, mock_config, mock_card_update_helper, mock_person_lookup, roster, mock_webhook_session):
+        mock_config.bulk_sync.full_sync_hours = 0
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        bulk_sync.loop()
+        bulk_sync.loop()
+        assert mock_card_update_helper.handle.call_count == 2
+        for call in mock_webhook_session.get.call_args_list:
+            assert "headers" not in call.kwargs
+
+
+class TestSharded:
+    @pytest.fixture
+    def sharded_sync(self, mock_config, mock_card_update_helper, mock_person_lookup):
+        mock_config.bulk_sync.sharded = True
+        mock_config.bulk_sync.chunk_size = 1
+        return BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+
+    @pytest.fixture
+    def roster(self, mock_webhook_session):
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: make_api_response([
+            make_api_person(customer_id=100, cards=[make_api_card("111"), make_api_card("222")]),
+            make_api_person(customer_id=101, cards=[make_api_card("333")]),
+        ])
+
+    def test_one_chunk_per_tick(self, sharded_sync, roster, mock_card_update_helper):
+        intervals = [sharded_sync.loop() for _ in range(3)]
+        assert mock_card_update_helper.handle.call_count == 3
+        assert intervals == [1, 1, 1]
+
+    def test_pass_finishes_on_tick_after_last_chunk(
+            self, sharded_sync, roster, mock_card_update_helper, mock_person_lookup):
+        for _ in range(3):
+            sharded_sync.loop()
+        assert call(CAN_OPEN_HOUSE_KEY) not in mock_person_lookup.by_udf.call_args_list
+
+        interval = sharded_sync.loop()
+
+        mock_person_lookup.by_udf.assert_any_call(CAN_OPEN_HOUSE_KEY)
+        assert interval == 6 * 60 * 60
+
+    def test_person_index_loaded_once_per_pass(self, sharded_sync, roster, mock_card_update_helper, mock_person_lookup):
+        alice = make_mock_person(customer_id=100)
+        mock_person_lookup.by_udf.side_effect = lambda key: make_search_builder([alice] if key == UDF_KEY else [])
+        for _ in range(4):
+            sharded_sync.loop()
+
+        assert mock_person_lookup.by_udf.call_args_list.count(call(UDF_KEY)) == 1
+        for c in mock_card_update_helper.handle.call_args_list:
+            assert c.kwargs["person_by_uuid"] == {customer_uuid(100): alice}
+
+    def test_person_index_reloaded_after_piecemeal_for_unknown_customer(
+            self, sharded_sync, roster, mock_card_update_helper, mock_person_lookup):
+        handled_elsewhere = mock_card_update_helper.register_handled.call_args[0][0]
+        sharded_sync.loop()
+        handled_elsewhere(CardSetting(card=444, first_name="New", last_name="Member", company="", customer_id=102))
+        for _ in range(3):
+            sharded_sync.loop()
+
+        assert mock_person_lookup.by_udf.call_args_list.count(call(UDF_KEY)) == 2
+
+    def test_mutex_released_between_shards(self, mock_config, mock_card_update_helper, mock_person_lookup, roster):
+        mock_config.bulk_sync.sharded = True
+        mock_config.bulk_sync.chunk_size = 1
+        mutex = threading.Lock()
+        sharded_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, mutex)
+        mock_card_update_helper.handle.side_effect = lambda *settings, **kwargs: held.append(mutex.locked()) or DEFAULT
+
+        held = []
+        sharded_sync.loop()
+        assert held == [True]
+        assert not mutex.locked()
+
+    def test_failed_shard_restarts_pass(self, sharded_sync, roster, mock_card_update_helper, mock_webhook_session):
+        sharded_sync.loop()
+        mock_card_update_helper.handle.side_effect = RuntimeError("WinDSX unavailable")
+        with pytest.raises(RuntimeError):
+            sharded_sync.loop()
+        mock_card_update_helper.handle.side_effect = None
+        mock_card_update_helper.handle.reset_mock()
+
+        sharded_sync.loop()
+
+        assert mock_card_update_helper.handle.call_args.args[0].card == 111
+
+    def test_lock_hold_recorded_per_shard(self, sharded_sync, roster):
+        for _ in range(4):
+            sharded_sync.loop()
+        assert sharded_sync.lock_hold.count == 4
+
+    def test_piecemeal_update_between_shards_not_undone(self, sharded_sync, roster, mock_card_update_helper):
+        handled_elsewhere = mock_card_update_helper.register_handled.call_args[0][0]
+        sharded_sync.loop()
+        handled_elsewhere(CardSetting(card=222, first_name="John", last_name="Doe", company="", customer_id=100))
+        for _ in range(3):
+            sharded_sync.loop()
+
+        cards = [[s.card for s in c.args] for c in mock_card_update_helper.handle.call_args_list]
+        assert cards == [[111], [], [333]]
+        assert sharded_sync._snapshot.get(111) is not None
+        assert sharded_sync._snapshot.get(222) is None
+
+    def test_own_chunks_not_treated_as_piecemeal(self, sharded_sync, roster, mock_card_update_helper):
+        handled_elsewhere = mock_card_update_helper.register_handled.call_args[0][0]
+
+        def handle(*settings, **kwargs):
+            for setting in settings:
+                handled_elsewhere(setting)
+            return DEFAULT
+
+        mock_card_update_helper.handle.side_effect = handle
+        for _ in range(4):
+            sharded_sync.loop()
+
+        assert all(sharded_sync._snapshot.get(card) is not None for card in (111, 222, 333))
+
+
+class TestInstrumentation:
+    @pytest.fixture
+    def roster(self, mock_webhook_session):
+        mock_webhook_session.get.side_effect = lambda url, **kwargs: make_api_response(
+            [make_api_person(cards=[make_api_card("111")], extra=[CAN_OPEN_HOUSE_KEY])]
+        )
+
+    def test_run_recorded_with_phase_counts(self, bulk_sync, roster):
+        bulk_sync.loop()
+        [run] = bulk_sync.runs
+        assert run.name == "full"
+        assert run.count("page_fetch") == 1
+        assert run.count("json_decode") == 1
+        assert run.count("udf_lookup") == 2
+        assert run.elapsed is not None
+
+    def test_timings_passed_to_helper(self, bulk_sync, roster, mock_card_update_helper):
+        bulk_sync.loop()
+        assert mock_card_update_helper.handle.call_args.kwargs["timings"] is bulk_sync.runs[-1]
+
+    def test_single_summary_line_per_run(self, bulk_sync, roster, mock_config):
+        bulk_sync.loop()
+        summaries = [c for c in mock_config.logger.info.call_args_list if "Bulk sync finished" in c.args[0]]
+        assert len(summaries) == 1
+        assert "page_fetch=" in summaries[0].args[0]
+
+    def test_max_lock_hold_is_per_run(self, mock_config, mock_card_update_helper, mock_person_lookup, roster):
+        mock_config.bulk_sync.full_sync_hours = 0
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        mock_card_update_helper.handle.side_effect = lambda *settings, **kwargs: time.sleep(0.2) or DEFAULT
+        bulk_sync.loop()
+        mock_card_update_helper.handle.side_effect = None
+        bulk_sync.loop()
+
+        summaries = [c.args[0] for c in mock_config.logger.info.call_args_list if "Bulk sync finished" in c.args[0]]
+        max_holds = [float(re.search(r"max_lock_hold=([0-9.]+)s", summary).group(1)) for summary in summaries]
+        assert max_holds[0] >= 0.2
+        assert max_holds[1] < 0.2
+        assert bulk_sync.lock_hold.max >= 0.2
+
+    def test_run_history_bounded(self, mock_config, mock_card_update_helper, mock_person_lookup, roster):
+        mock_config.bulk_sync.run_history_size = 2
+        mock_config.bulk_sync.full_sync_hours = 0
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        for _ in range(3):
+            bulk_sync.loop()
+        assert len(bulk_sync.runs) == 2
+
+    def test_nothing_recorded_when_disabled(self, mock_config, mock_card_update_helper, mock_person_lookup, roster):
+        mock_config.bulk_sync.instrument = False
+        bulk_sync = BulkCardSync(mock_config, mock_card_update_helper, mock_person_lookup, threading.Lock())
+        bulk_sync.loop()
+        assert len(bulk_sync.runs) == 0
 
 
 class TestCardSettingBuilding:
@@ -113,7 +588,7 @@ class TestCardSettingBuilding:
         )
         mock_webhook_session.get.return_value = make_api_response([person])
         bulk_sync.loop()
-        setting = mock_card_update_helper.handle.call_args[0][0]
+        setting = mock_card_update_helper.handle.call_args.args[0]
         assert setting.card == 12345
         assert setting.first_name == "Alice"
         assert setting.last_name == "Smith"
@@ -125,34 +600,34 @@ class TestCardSettingBuilding:
         person = make_api_person(cards=[make_api_card(access=[mock_config.denhac_access])])
         mock_webhook_session.get.return_value = make_api_response([person])
         bulk_sync.loop()
-        assert mock_card_update_helper.handle.call_args[0][0].enable_denhac is True
+        assert mock_card_update_helper.handle.call_args.args[0].enable_denhac is True
 
     def test_enable_denhac_false_when_not_in_access(
             self, bulk_sync, mock_webhook_session, mock_card_update_helper):
         person = make_api_person(cards=[make_api_card(access=[])])
         mock_webhook_session.get.return_value = make_api_response([person])
         bulk_sync.loop()
-        assert mock_card_update_helper.handle.call_args[0][0].enable_denhac is False
+        assert mock_card_update_helper.handle.call_args.args[0].enable_denhac is False
 
     def test_enable_server_room_true_when_in_access(
             self, bulk_sync, mock_webhook_session, mock_card_update_helper, mock_config):
         person = make_api_person(cards=[make_api_card(access=[mock_config.server_room_access])])
         mock_webhook_session.get.return_value = make_api_response([person])
         bulk_sync.loop()
-        assert mock_card_update_helper.handle.call_args[0][0].enable_server_room is True
+        assert mock_card_update_helper.handle.call_args.args[0].enable_server_room is True
 
     def test_multiple_cards_produce_multiple_settings(
             self, bulk_sync, mock_webhook_session, mock_card_update_helper):
         person = make_api_person(cards=[make_api_card("111"), make_api_card("222")])
         mock_webhook_session.get.return_value = make_api_response([person])
         bulk_sync.loop()
-        assert len(mock_card_update_helper.handle.call_args[0]) == 2
+        assert len(mock_card_update_helper.handle.call_args.args) == 2
 
     def test_person_with_no_cards_produces_no_settings(
             self, bulk_sync, mock_webhook_session, mock_card_update_helper):
         mock_webhook_session.get.return_value = make_api_response([make_api_person(cards=[])])
         bulk_sync.loop()
-        assert len(mock_card_update_helper.handle.call_args[0]) == 0
+        mock_card_update_helper.handle.assert_not_called()
 
 
 class TestCanOpenHouse:
@@ -163,7 +638,7 @@ class TestCanOpenHouse:
         mock_person = make_mock_person(customer_id=100, first_name="Alice", last_name="Smith")
 
         def by_udf_side_effect(key, value=None):
-            if key == UDF_KEY and value == customer_uuid(100):
+            if key == UDF_KEY and value is None:
                 return make_search_builder([mock_person])
             return make_search_builder([])
 
@@ -220,3 +695,37 @@ class TestCanOpenHouse:
         assert CAN_OPEN_HOUSE_KEY in mock_person.user_defined_fields
         mock_person.write.assert_not_called()
         mock_config.slack.emit.assert_not_called()
+
+    def test_only_people_whose_flag_changes_are_written(
+            self, bulk_sync, mock_webhook_session, mock_config, mock_person_lookup):
+        mock_webhook_session.get.return_value = make_api_response([
+            make_api_person(customer_id=100, extra=[CAN_OPEN_HOUSE_KEY]),
+            make_api_person(customer_id=101, extra=[CAN_OPEN_HOUSE_KEY]),
+            make_api_person(customer_id=102),
+        ])
+        already_allowed = make_mock_person(customer_id=100, has_can_open_house=True)
+        to_grant = make_mock_person(customer_id=101)
+        untouched = make_mock_person(customer_id=102)
+        to_revoke = make_mock_person(customer_id=103, has_can_open_house=True)
+
+        def by_udf_side_effect(key, value=None):
+            if key == UDF_KEY:
+                return make_search_builder([already_allowed, to_grant, untouched, to_revoke])
+            return make_search_builder([already_allowed, to_revoke])
+
+        mock_person_lookup.by_udf.side_effect = by_udf_side_effect
+        bulk_sync.loop()
+        already_allowed.write.assert_not_called()
+        untouched.write.assert_not_called()
+        to_grant.write.assert_called_once()
+        to_revoke.write.assert_called_once()
+        assert to_grant.user_defined_fields[CAN_OPEN_HOUSE_KEY] == "True"
+        assert CAN_OPEN_HOUSE_KEY not in to_revoke.user_defined_fields
+
+    def test_query_count_independent_of_flag_holders(
+            self, bulk_sync, mock_webhook_session, mock_person_lookup):
+        mock_webhook_session.get.return_value = make_api_response([
+            make_api_person(customer_id=cid, extra=[CAN_OPEN_HOUSE_KEY]) for cid in range(100, 150)
+        ])
+        bulk_sync.loop()
+        assert mock_person_lookup.by_udf.call_count == 2
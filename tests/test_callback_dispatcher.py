@@ -0,0 +1,96 @@
+import logging
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from denhac_card_access.callback_dispatcher import CallbackDispatcher
+from denhac_card_access.card_setting import CardSetting
+
+
+def make_setting(card=1):
+    return CardSetting(card=card, first_name="John", last_name="Doe", company="denhac", customer_id=100)
+
+
+@pytest.fixture
+def dispatcher():
+    return CallbackDispatcher(logging.getLogger("test"), queue_size=10)
+
+
+class TestInline:
+    def test_zero_queue_size_runs_inline(self):
+        dispatcher = CallbackDispatcher(logging.getLogger("test"), queue_size=0)
+        callback = Mock()
+        dispatcher.dispatch([callback], make_setting())
+        callback.assert_called_once_with(make_setting())
+        assert dispatcher.latency.count == 1
+
+
+class TestQueued:
+    def test_callbacks_run_on_worker_thread(self, dispatcher):
+        threads = []
+        dispatcher.dispatch([lambda setting: threads.append(threading.current_thread())], make_setting())
+        dispatcher.join()
+        assert threads[0] is not threading.current_thread()
+
+    def test_callbacks_for_a_card_run_in_order(self, dispatcher):
+        seen = []
+        for n in range(5):
+            dispatcher.dispatch([lambda setting, n=n: seen.append(n)], make_setting(card=1))
+        dispatcher.join()
+        assert seen == [0, 1, 2, 3, 4]
+
+    def test_failing_callback_does_not_stop_worker(self, dispatcher):
+        after = Mock()
+        dispatcher.dispatch([Mock(side_effect=RuntimeError("boom"))], make_setting(card=1))
+        dispatcher.dispatch([after], make_setting(card=2))
+        dispatcher.join()
+        after.assert_called_once()
+
+    def test_latency_recorded(self, dispatcher):
+        dispatcher.dispatch([Mock()], make_setting())
+        dispatcher.join()
+        assert dispatcher.latency.count == 1
+
+
+class TestOverflow:
+    @pytest.fixture
+    def blocked(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block(setting):
+            started.set()
+            release.wait(timeout=5)
+
+        yield block, started, release
+        release.set()
+
+    def test_full_queue_runs_inline_and_counts(self, blocked):
+        block, started, release = blocked
+        dispatcher = CallbackDispatcher(logging.getLogger("test"), queue_size=1)
+        dispatcher.dispatch([block], make_setting(card=1))
+        started.wait(timeout=5)
+        dispatcher.dispatch([Mock()], make_setting(card=2))
+
+        inline = Mock()
+        dispatcher.dispatch([inline], make_setting(card=3))
+
+        inline.assert_called_once()
+        assert dispatcher.overflowed == 1
+        assert dispatcher.depth == 1
+
+    def test_card_with_queued_callbacks_waits_instead_of_running_inline(self, blocked):
+        block, started, release = blocked
+        dispatcher = CallbackDispatcher(logging.getLogger("test"), queue_size=1)
+        seen = []
+        dispatcher.dispatch([block], make_setting(card=1))
+        started.wait(timeout=5)
+        dispatcher.dispatch([lambda setting: seen.append("first")], make_setting(card=2))
+
+        threading.Timer(0.05, release.set).start()
+        dispatcher.dispatch([lambda setting: seen.append("second")], make_setting(card=2))
+        dispatcher.join()
+
+        assert seen == ["first", "second"]
+        assert dispatcher.overflowed == 0
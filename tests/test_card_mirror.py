@@ -0,0 +1,135 @@
+from unittest.mock import Mock
+
+import pytest
+
+from denhac_card_access.card_mirror import CardMirror
+
+UDF_KEY = 'DENHAC_ID'  # Must match mock_config.udf_key_denhac_id
+
+
+def make_person(name_id=1, denhac_uuid="uuid-1", first_name="John", last_name="Doe"):
+    person = Mock()
+    person.id = name_id
+    person.first_name = first_name
+    person.last_name = last_name
+    person.user_defined_fields = {UDF_KEY: denhac_uuid} if denhac_uuid is not None else {}
+    return person
+
+
+def make_card(card_number=12345, person=None, access=None):
+    card = Mock()
+    card.card_number = card_number
+    card.person = person
+    card.name_id = person.id if person is not None else None
+    card.access = frozenset(access or [])
+    return card
+
+
+@pytest.fixture
+def mock_person_lookup():
+    lookup = Mock()
+    lookup.by_udf.return_value.find.return_value = []
+    return lookup
+
+
+@pytest.fixture
+def mock_access_card_lookup():
+    lookup = Mock()
+    lookup.with_people.return_value = lookup
+    lookup.by_card_numbers.return_value = []
+    return lookup
+
+
+@pytest.fixture
+def mirror(mock_config, mock_person_lookup, mock_access_card_lookup):
+    return CardMirror(mock_config, mock_person_lookup, mock_access_card_lookup, verify_interval_seconds=60)
+
+
+class TestLoad:
+    def test_people_loaded_once(self, mirror, mock_person_lookup):
+        person = make_person()
+        mock_person_lookup.by_udf.return_value.find.return_value = [person]
+        mirror.load()
+        mirror.load()
+        mock_person_lookup.by_udf.assert_called_once_with(UDF_KEY)
+        assert mirror.person("uuid-1") is person
+
+
+class TestCards:
+    def test_unknown_cards_reported_missing(self, mirror):
+        card = make_card(1, person=make_person())
+        mirror.add_card(card)
+        found, missing = mirror.cards([1, 2])
+        assert found == {1: card}
+        assert missing == [2]
+
+    def test_card_without_denhac_person_not_kept(self, mirror):
+        mirror.add_card(make_card(1, person=make_person(denhac_uuid=None)))
+        assert mirror.card(1) is None
+
+    def test_card_moved_off_denhac_person_dropped(self, mirror):
+        mirror.add_card(make_card(1, person=make_person()))
+        mirror.add_card(make_card(1, person=make_person(denhac_uuid=None)))
+        assert len(mirror) == 0
+
+    def test_card_owner_mirrored(self, mirror):
+        person = make_person(denhac_uuid="uuid-9")
+        mirror.add_card(make_card(1, person=person))
+        assert mirror.person("uuid-9") is person
+
+    def test_hits_and_misses_counted(self, mirror):
+        mirror.add_card(make_card(1, person=make_person()))
+        mirror.cards([1, 2, 3])
+        assert mirror.hits == 1
+        assert mirror.misses == 2
+
+
+class TestVerify:
+    def test_nothing_drifted_when_database_matches(self, mirror, mock_access_card_lookup, mock_person_lookup):
+        person = make_person()
+        card = make_card(1, person=person, access=["denhac"])
+        mirror.add_card(card)
+        mock_access_card_lookup.by_card_numbers.return_value = [make_card(1, person=person, access=["denhac"])]
+        mock_person_lookup.by_udf.return_value.find.return_value = [person]
+        assert mirror.verify() == 0
+        assert mirror.card(1) is card
+
+    def test_changed_card_replaced(self, mirror, mock_access_card_lookup, mock_person_lookup):
+        person = make_person()
+        mirror.add_card(make_card(1, person=person, access=["denhac"]))
+        db_card = make_card(1, person=person)
+        mock_access_card_lookup.by_card_numbers.return_value = [db_card]
+        mock_person_lookup.by_udf.return_value.find.return_value = [person]
+        assert mirror.verify() == 1
+        assert mirror.card(1) is db_card
+
+    def test_deleted_card_dropped(self, mirror, mock_person_lookup):
+        person = make_person()
+        mirror.add_card(make_card(1, person=person))
+        mock_person_lookup.by_udf.return_value.find.return_value = [person]
+        assert mirror.verify() == 1
+        assert mirror.card(1) is None
+
+    def test_changed_person_replaced(self, mirror, mock_person_lookup):
+        mock_person_lookup.by_udf.return_value.find.return_value = [make_person(first_name="Old")]
+        mirror.load()
+        renamed = make_person(first_name="New")
+        mock_person_lookup.by_udf.return_value.find.return_value = [renamed]
+        assert mirror.verify() == 1
+        assert mirror.person("uuid-1") is renamed
+
+    def test_cards_checked_in_chunks(self, mock_config, mock_person_lookup, mock_access_card_lookup):
+        mirror = CardMirror(mock_config, mock_person_lookup, mock_access_card_lookup,
+                            verify_interval_seconds=60, chunk_size=2)
+        for number in range(5):
+            mirror.add_card(make_card(number, person=make_person()))
+        mirror.verify()
+        assert mock_access_card_lookup.by_card_numbers.call_count == 3
+
+    def test_verify_due_after_interval(self, mirror, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("denhac_card_access.card_mirror.time.monotonic", lambda: now[0])
+        mirror.verify()
+        assert not mirror.verify_due()
+        now[0] += 61
+        assert mirror.verify_due()
@@ -0,0 +1,13 @@
+from denhac_card_access.card_setting import CardSetting
+
+
+def make_setting(card=1, customer_id=100, first_name="John", last_name="Doe", company="denhac",
+                 enable_denhac=False, enable_server_room=False):
+    return CardSetting(card=card, first_name=first_name, last_name=last_name, company=company,
+                       customer_id=customer_id, enable_denhac=enable_denhac, enable_server_room=enable_server_room)
+
+
+class TestCardSetting:
+    def test_has_no_instance_dict(self):
+        assert not hasattr(make_setting(), "__dict__")
+
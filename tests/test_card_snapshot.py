@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+from denhac_card_access.card_snapshot import CardSnapshot, RosterPage
+from denhac_card_access.card_update_helper import CardSetting
+
+PAGE = RosterPage(
+    url="https://api.example.com/all_cards",
+    etag='"abc"',
+    last_modified=None,
+    digest=CardSnapshot.digest(b"{}"),
+    next_url=None,
+)
+
+
+def make_setting(card=12345, customer_id=100, first_name="John", last_name="Doe",
+                 company="denhac", enable_denhac=True, enable_server_room=False):
+    return CardSetting(
+        card=card,
+        first_name=first_name,
+        last_name=last_name,
+        company=company,
+        customer_id=customer_id,
+        enable_denhac=enable_denhac,
+        enable_server_room=enable_server_room,
+    )
+
+
+class TestFingerprint:
+    def test_same_setting_same_fingerprint(self):
+        assert CardSnapshot.fingerprint(make_setting()) == CardSnapshot.fingerprint(make_setting())
+
+    def test_access_change_changes_fingerprint(self):
+        enabled = CardSnapshot.fingerprint(make_setting(enable_denhac=True))
+        disabled = CardSnapshot.fingerprint(make_setting(enable_denhac=False))
+        assert enabled != disabled
+
+    def test_owner_change_changes_fingerprint(self):
+        assert CardSnapshot.fingerprint(make_setting(customer_id=100)) != \
+               CardSnapshot.fingerprint(make_setting(customer_id=101))
+
+
+class TestFullSyncDue:
+    def test_due_when_never_synced(self):
+        assert CardSnapshot().full_sync_due(datetime.now(), timedelta(hours=24))
+
+    def test_not_due_within_interval(self):
+        snapshot = CardSnapshot()
+        now = datetime.now()
+        snapshot.replace({}, [], now)
+        assert not snapshot.full_sync_due(now + timedelta(hours=6), timedelta(hours=24))
+
+    def test_due_after_interval(self):
+        snapshot = CardSnapshot()
+        now = datetime.now()
+        snapshot.replace({}, [], now)
+        assert snapshot.full_sync_due(now + timedelta(hours=24), timedelta(hours=24))
+
+
+class TestPersistence:
+    def test_round_trips_through_file(self, tmp_path):
+        path = str(tmp_path / "snapshot.json")
+        now = datetime(2024, 1, 3, 18, 30)
+        CardSnapshot(path).replace({12345: 42, 67890: 7}, [PAGE], now)
+
+        loaded = CardSnapshot(path)
+
+        assert loaded.get(12345) == 42
+        assert loaded.get(67890) == 7
+        assert loaded.full_sync_at == now
+        assert loaded.pages == [PAGE]
+
+    def test_missing_file_starts_empty(self, tmp_path):
+        snapshot = CardSnapshot(str(tmp_path / "snapshot.json"))
+        assert len(snapshot) == 0
+        assert snapshot.full_sync_at is None
+
+    def test_replace_without_full_sync_keeps_full_sync_time(self, tmp_path):
+        path = str(tmp_path / "snapshot.json")
+        now = datetime(2024, 1, 3, 18, 30)
+        snapshot = CardSnapshot(path)
+        snapshot.replace({12345: 42}, [], now)
+        snapshot.replace({12345: 43}, [])
+
+        assert CardSnapshot(path).full_sync_at == now
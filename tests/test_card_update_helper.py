@@ -1,15 +1,17 @@
-import uuid
+import threading
 from unittest.mock import Mock
 
 import pytest
 
 from denhac_card_access.card_update_helper import CardSetting, CardUpdateHelper
+from denhac_card_access.denhac_id import denhac_ids
+from denhac_card_access.metrics import PhaseTimings
 
 UDF_KEY = 'DENHAC_ID'  # Must match mock_config.udf_key_denhac_id
 
 
 def customer_uuid(customer_id: int) -> str:
-    return str(uuid.uuid5(uuid.NAMESPACE_OID, str(customer_id)))
+    return denhac_ids.encode(customer_id)
 
 
 def make_setting(card=12345, customer_id=100, first_name="John", last_name="Doe",
@@ -171,6 +173,72 @@ class TestPersonLookup:
         mock_person_lookup.by_udf.assert_not_called()
 
 
+class TestBatchedPersonLookup:
+    @pytest.fixture(autouse=True)
+    def low_threshold(self, mock_config):
+        mock_config.card_updates.batch_lookup_threshold = 2
+
+    def test_single_key_only_lookup_at_threshold(self, helper, mock_person_lookup):
+        helper.handle(make_setting(card=1, customer_id=100), make_setting(card=2, customer_id=200))
+        mock_person_lookup.by_udf.assert_called_once_with(UDF_KEY)
+
+    def test_per_uuid_lookup_below_threshold(self, helper, mock_person_lookup):
+        helper.handle(make_setting(card=1, customer_id=100))
+        mock_person_lookup.by_udf.assert_called_once_with(UDF_KEY, customer_uuid(100))
+
+    def test_people_matched_by_uuid(self, helper, mock_person_lookup, mock_access_card_lookup):
+        alice = make_mock_person(name_id=1, customer_id=100)
+        bob = make_mock_person(name_id=2, customer_id=200)
+        stranger = make_mock_person(name_id=3, customer_id=300)
+        mock_person_lookup.by_udf.return_value.find.return_value = [stranger, bob, alice]
+        cards = {100: Mock(), 200: Mock()}
+        mock_access_card_lookup.new.side_effect = lambda number: cards[number]
+        helper.handle(make_setting(card=100, customer_id=100), make_setting(card=200, customer_id=200))
+        assert cards[100].person == alice
+        assert cards[200].person == bob
+        mock_person_lookup.new.assert_not_called()
+
+    def test_only_unmatched_customers_created(self, helper, mock_person_lookup):
+        alice = make_mock_person(name_id=1, customer_id=100)
+        mock_person_lookup.by_udf.return_value.find.return_value = [alice]
+        helper.handle(make_setting(card=1, customer_id=100), make_setting(card=2, customer_id=200))
+        mock_person_lookup.new.assert_called_once()
+
+    def test_people_created_before_any_written(self, helper, mock_person_lookup):
+        calls = []
+        people = []
+
+        def new_person():
+            person = Mock()
+            person.user_defined_fields = {}
+            person.write.side_effect = lambda: calls.append("write")
+            calls.append("new")
+            people.append(person)
+            return person
+
+        mock_person_lookup.new.side_effect = new_person
+        helper.handle(make_setting(card=1, customer_id=100), make_setting(card=2, customer_id=200))
+        assert calls == ["new", "new", "write", "write"]
+
+
+class TestPersonIndex:
+    def test_people_found_in_index_without_lookup(self, helper, mock_person_lookup, mock_access_card_lookup):
+        alice = make_mock_person(name_id=1, customer_id=100)
+        helper.handle(make_setting(card=1, customer_id=100), person_by_uuid={customer_uuid(100): alice})
+        mock_person_lookup.by_udf.assert_not_called()
+        mock_person_lookup.new.assert_not_called()
+        assert mock_access_card_lookup.new.return_value.person == alice
+
+    def test_created_people_added_to_index(self, helper, mock_person_lookup):
+        person = Mock()
+        person.user_defined_fields = {}
+        mock_person_lookup.new.return_value = person
+        person_by_uuid = {}
+        helper.handle(make_setting(card=1, customer_id=100), person_by_uuid=person_by_uuid)
+        mock_person_lookup.by_udf.assert_not_called()
+        assert person_by_uuid == {customer_uuid(100): person}
+
+
 class TestCardHandling:
     def test_new_card_created_when_not_in_batch_results(self, helper, mock_access_card_lookup):
         helper.handle(make_setting(card=12345))
@@ -210,6 +278,19 @@ class TestCardHandling:
         helper.handle(make_setting(card=12345, customer_id=100, enable_denhac=True))
         card.write.assert_called_once()
 
+    def test_handled_callbacks_see_every_setting(self, helper):
+        handled = Mock()
+        helper.register_handled(handled)
+        first, second = make_setting(card=1), make_setting(card=2, customer_id=200)
+        helper.handle(first, second)
+        assert [c.args[0] for c in handled.call_args_list] == [first, second]
+
+    def test_handled_callbacks_not_called_for_plan(self, helper):
+        handled = Mock()
+        helper.register_handled(handled)
+        helper.plan(make_setting(card=1))
+        handled.assert_not_called()
+
 
 class TestAccessUpdates:
     def test_denhac_access_added_when_enable_denhac_true(self, helper, mock_access_card_lookup, mock_config):
@@ -289,6 +370,38 @@ class TestAccessUpdates:
         mock_config.slack.emit.assert_not_called()
 
 
+class TestWriteFailures:
+    def test_failed_card_does_not_stop_other_cards(self, helper, mock_access_card_lookup):
+        cards = {1: Mock(), 2: Mock()}
+        cards[1].write.side_effect = RuntimeError("boom")
+        mock_access_card_lookup.new.side_effect = lambda number: cards[number]
+        helper.handle(make_setting(card=1, customer_id=100), make_setting(card=2, customer_id=200))
+        cards[2].write.assert_called_once()
+
+    def test_failed_card_not_left_pending(self, helper, mock_access_card_lookup):
+        callback = Mock()
+        helper.register(callback)
+        mock_access_card_lookup.new.return_value.write.side_effect = RuntimeError("boom")
+        helper.handle(make_setting(card=1))
+        card = make_mock_card(card_number=1, person=make_mock_person())
+        helper.card_updated(card)
+        callback.assert_not_called()
+
+    def test_failed_card_has_no_slack_notice(self, helper, mock_access_card_lookup, mock_config):
+        mock_access_card_lookup.new.return_value.write.side_effect = RuntimeError("boom")
+        helper.handle(make_setting(card=1))
+        mock_config.slack.emit.assert_not_called()
+
+    def test_failed_cards_returned(self, helper, mock_access_card_lookup):
+        cards = {1: Mock(), 2: Mock()}
+        cards[1].write.side_effect = RuntimeError("boom")
+        mock_access_card_lookup.new.side_effect = lambda number: cards[number]
+        assert helper.handle(make_setting(card=1, customer_id=100), make_setting(card=2, customer_id=200)) == {1}
+
+    def test_nothing_returned_when_all_written(self, helper):
+        assert helper.handle(make_setting(card=1)) == set()
+
+
 class TestCardUpdated:
     def test_card_updated_sends_slack(self, helper, mock_access_card_lookup, mock_config):
         person = make_mock_person(name_id=42, customer_id=100)
@@ -322,3 +435,232 @@ class TestCardUpdated:
         helper.card_updated(card)
 
         callback.assert_called_once()
+
+    def test_each_pending_setting_for_a_card_completes_once(self, helper, mock_access_card_lookup):
+        person = make_mock_person(name_id=42, customer_id=100)
+        card = make_mock_card(card_number=12345, access=[], person=person)
+        callback = Mock()
+        helper.register(callback)
+        enable = make_setting(card=12345, enable_denhac=True)
+        disable = make_setting(card=12345, enable_denhac=False, enable_server_room=True)
+        helper.handle(enable)
+        helper.handle(disable)
+
+        helper.card_updated(card)
+        helper.card_updated(card)
+        helper.card_updated(card)
+
+        assert [c.args[0] for c in callback.call_args_list] == [enable, disable]
+
+    def test_card_updated_for_other_card_ignored(self, helper, mock_access_card_lookup):
+        person = make_mock_person(name_id=42, customer_id=100)
+        callback = Mock()
+        helper.register(callback)
+        helper.handle(make_setting(card=12345, enable_denhac=True))
+
+        helper.card_updated(make_mock_card(card_number=67890, person=person))
+
+        callback.assert_not_called()
+
+
+class TestParallelWrites:
+    def test_all_cards_written_with_workers(self, mock_config, mock_person_lookup, mock_access_card_lookup):
+        mock_config.card_updates.write_workers = 4
+        helper = CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+        cards = {n: Mock() for n in range(20)}
+        mock_access_card_lookup.new.side_effect = lambda number: cards[number]
+        helper.handle(*(make_setting(card=n, customer_id=n) for n in range(20)))
+        for card in cards.values():
+            card.write.assert_called_once()
+        assert helper.writes_per_second > 0
+
+
+class TestMirror:
+    @pytest.fixture
+    def helper(self, mock_config, mock_person_lookup, mock_access_card_lookup):
+        mock_config.card_updates.mirror = True
+        return CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+
+    def test_mirrored_card_not_queried_again(self, helper, mock_access_card_lookup):
+        person = make_mock_person(name_id=42, customer_id=100)
+        card = make_mock_card(card_number=12345, name_id=42, person=person)
+        mock_access_card_lookup.by_card_numbers.return_value = [card]
+        helper.handle(make_setting(card=12345, customer_id=100))
+        helper.handle(make_setting(card=12345, customer_id=100))
+        mock_access_card_lookup.by_card_numbers.assert_called_once()
+
+    def test_person_served_from_mirror(self, helper, mock_person_lookup):
+        person = make_mock_person(name_id=42, customer_id=100)
+        mock_person_lookup.by_udf.return_value.find.return_value = [person]
+        helper.handle(make_setting(card=1, customer_id=100))
+        helper.handle(make_setting(card=2, customer_id=100))
+        # Only the startup load, no per-customer lookups
+        mock_person_lookup.by_udf.assert_called_once_with(UDF_KEY)
+        mock_person_lookup.new.assert_not_called()
+
+    def test_written_card_mirrored(self, helper, mock_access_card_lookup):
+        new_card = mock_access_card_lookup.new.return_value
+        new_card.card_number = 12345
+        helper.handle(make_setting(card=12345, customer_id=100))
+        assert helper.mirror.card(12345) is new_card
+
+    def test_failed_card_not_mirrored(self, helper, mock_access_card_lookup):
+        person = make_mock_person(name_id=42, customer_id=100)
+        card = make_mock_card(card_number=12345, name_id=42, person=person)
+        card.write.side_effect = RuntimeError("boom")
+        mock_access_card_lookup.by_card_numbers.return_value = [card]
+        helper.handle(make_setting(card=12345, customer_id=100, enable_denhac=True))
+        assert helper.mirror.card(12345) is None
+
+    def test_pushed_card_mirrored(self, helper):
+        card = make_mock_card(card_number=12345, person=make_mock_person())
+        helper.card_updated(card)
+        assert helper.mirror.card(12345) is card
+
+    def test_no_mirror_by_default(self, mock_config, mock_person_lookup, mock_access_card_lookup):
+        assert CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup).mirror is None
+
+
+class TestPendingEviction:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("denhac_card_access.card_update_helper.time.monotonic", lambda: now[0])
+        return now
+
+    def test_gauges_track_pending(self, helper, clock):
+        helper.handle(make_setting(card=1))
+        clock[0] += 30
+        assert helper.pending_count == 1
+        assert helper.oldest_pending_age == 30
+
+    def test_expired_setting_evicted(self, mock_config, mock_person_lookup, mock_access_card_lookup, clock):
+        mock_config.card_updates.pending_ttl_seconds = 60
+        helper = CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+        evicted = Mock()
+        helper.register_eviction(evicted)
+        setting = make_setting(card=1)
+        helper.handle(setting)
+
+        clock[0] += 61
+        helper.card_updated(make_mock_card(card_number=2, person=make_mock_person()))
+
+        evicted.assert_called_once_with(setting)
+        assert helper.pending_count == 0
+        assert helper.evicted == 1
+
+    def test_expired_setting_does_not_complete(self, helper, clock):
+        callback = Mock()
+        helper.register(callback)
+        helper.handle(make_setting(card=1))
+
+        clock[0] += helper._default_pending_ttl_seconds + 1
+        helper.card_updated(make_mock_card(card_number=1, person=make_mock_person()))
+
+        callback.assert_not_called()
+
+    def test_oldest_evicted_over_size_cap(self, mock_config, mock_person_lookup, mock_access_card_lookup, clock):
+        mock_config.card_updates.pending_max = 2
+        helper = CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+        evicted = Mock()
+        helper.register_eviction(evicted)
+        first = make_setting(card=1, customer_id=1)
+        helper.handle(first)
+        helper.handle(make_setting(card=2, customer_id=2))
+        helper.handle(make_setting(card=3, customer_id=3))
+
+        evicted.assert_called_once_with(first)
+        assert helper.pending_count == 2
+
+    def test_zero_pending_max_keeps_nothing(self, mock_config, mock_person_lookup, mock_access_card_lookup, clock):
+        mock_config.card_updates.pending_max = 0
+        helper = CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+        evicted = Mock()
+        helper.register_eviction(evicted)
+        setting = make_setting(card=1)
+        helper.handle(setting)
+
+        evicted.assert_called_once_with(setting)
+        assert helper.pending_count == 0
+
+    def test_completed_setting_not_evicted(self, helper, clock):
+        evicted = Mock()
+        helper.register_eviction(evicted)
+        helper.handle(make_setting(card=1))
+        helper.card_updated(make_mock_card(card_number=1, person=make_mock_person()))
+
+        clock[0] += helper._default_pending_ttl_seconds + 1
+        helper.handle(make_setting(card=2))
+
+        evicted.assert_not_called()
+
+    def test_concurrent_expiry_evicts_each_setting_once(self, helper, clock):
+        evicted = []
+        helper.register_eviction(evicted.append)
+        settings = [make_setting(card=card, customer_id=card) for card in range(2000)]
+        for setting in settings:
+            helper._add_pending(setting)
+        clock[0] += helper._default_pending_ttl_seconds + 1
+
+        errors = []
+
+        def push(card_number):
+            try:
+                helper.card_updated(make_mock_card(card_number=card_number, person=make_mock_person()))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=push, args=(card,)) for card in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert sorted(s.card for s in evicted) == list(range(2000))
+        assert helper.evicted == 2000
+        assert helper.pending_count == 0
+
+
+class TestCallbackDispatch:
+    def test_callbacks_dispatched_off_thread(self, mock_config, mock_person_lookup, mock_access_card_lookup):
+        mock_config.card_updates.callback_queue_size = None
+        helper = CardUpdateHelper(mock_config, mock_person_lookup, mock_access_card_lookup)
+        callback = Mock()
+        helper.register(callback)
+        helper.handle(make_setting(card=12345))
+        helper.card_updated(make_mock_card(card_number=12345, person=make_mock_person()))
+        helper.callbacks.join()
+        callback.assert_called_once_with(make_setting(card=12345))
+
+
+class TestPlan:
+    def test_plan_does_not_write(self, helper, mock_person_lookup, mock_access_card_lookup, mock_config):
+        change_set = helper.plan(make_setting(card=12345, customer_id=100, enable_denhac=True))
+
+        assert len(change_set.persons_to_create) == 1
+        assert change_set.cards_to_create == [12345]
+        mock_person_lookup.new.assert_not_called()
+        mock_access_card_lookup.new.assert_not_called()
+        mock_config.slack.emit.assert_not_called()
+
+    def test_plan_does_not_leave_pending_settings(self, helper, mock_access_card_lookup):
+        callback = Mock()
+        helper.register(callback)
+        person = make_mock_person(name_id=42, customer_id=100)
+        helper.plan(make_setting(card=12345, enable_denhac=True))
+
+        helper.card_updated(make_mock_card(card_number=12345, person=person))
+
+        callback.assert_not_called()
+
+
+class TestTimings:
+    def test_phases_recorded(self, helper):
+        timings = PhaseTimings("test")
+        helper.handle(make_setting(card=12345, enable_denhac=True), timings=timings)
+        assert timings.count("card_lookup") == 1
+        assert timings.count("udf_lookup") == 1
+        assert timings.count("person_write") == 1
+        assert timings.count("card_write") == 1
+        assert timings.count("slack_post") == 1
@@ -0,0 +1,115 @@
+from unittest.mock import Mock
+
+import pytest
+
+from denhac_card_access.card_setting import CardSetting
+from denhac_card_access.card_update_plan import CardUpdatePlanner, group_by_customer
+from denhac_card_access.denhac_id import denhac_ids
+
+
+def make_setting(card=12345, customer_id=100, first_name="John", last_name="Doe",
+                 enable_denhac=True, enable_server_room=False):
+    return CardSetting(
+        card=card,
+        first_name=first_name,
+        last_name=last_name,
+        company="denhac",
+        customer_id=customer_id,
+        enable_denhac=enable_denhac,
+        enable_server_room=enable_server_room,
+    )
+
+
+def make_card(name_id=42, access=None):
+    card = Mock()
+    card.name_id = name_id
+    card.access = frozenset(access or [])
+    return card
+
+
+class Planner:
+    def __init__(self, config):
+        self._planner = CardUpdatePlanner(config)
+
+    def plan(self, settings, existing_cards, person_id_by_customer_id):
+        settings_by_customer, _ = group_by_customer(settings)
+        return self._planner.plan(settings_by_customer, existing_cards, person_id_by_customer_id)
+
+
+@pytest.fixture
+def planner(mock_config):
+    return Planner(mock_config)
+
+
+class TestGroupByCustomer:
+    def test_settings_grouped_in_order(self):
+        first, second, other = make_setting(card=1), make_setting(card=2), make_setting(card=3, customer_id=101)
+        settings_by_customer, duplicates = group_by_customer([first, other, second])
+        assert settings_by_customer == {100: [first, second], 101: [other]}
+        assert duplicates == set()
+
+    def test_duplicate_cards_dropped(self):
+        settings_by_customer, duplicates = group_by_customer([
+            make_setting(card=1, customer_id=100),
+            make_setting(card=1, customer_id=101),
+            make_setting(card=2, customer_id=101),
+        ])
+        assert duplicates == {1}
+        assert list(settings_by_customer) == [101]
+        assert [s.card for s in settings_by_customer[101]] == [2]
+
+
+class TestPersons:
+    def test_person_created_for_unknown_customer(self, planner):
+        change_set = planner.plan([make_setting(customer_id=100, first_name="Alice", last_name="Smith")], {}, {})
+        [create] = change_set.persons_to_create
+        assert create.customer_id == 100
+        assert create.first_name == "Alice"
+        assert create.last_name == "Smith"
+        assert create.denhac_uuid == denhac_ids.encode(100)
+
+    def test_one_person_created_per_customer(self, planner):
+        change_set = planner.plan([make_setting(card=1), make_setting(card=2)], {}, {})
+        assert len(change_set.persons_to_create) == 1
+
+    def test_no_person_created_for_known_customer(self, planner):
+        change_set = planner.plan([make_setting(customer_id=100)], {}, {100: 42})
+        assert change_set.persons_to_create == []
+
+
+class TestCards:
+    def test_new_card_created(self, planner):
+        change_set = planner.plan([make_setting(card=12345)], {}, {100: 42})
+        assert change_set.cards_to_create == [12345]
+        assert change_set.owner_changes == []
+
+    def test_owner_change_when_card_on_other_person(self, planner):
+        change_set = planner.plan([make_setting(card=12345)], {12345: make_card(name_id=99, access=["denhac"])},
+                                  {100: 42})
+        assert change_set.owner_changes == [12345]
+        assert change_set.notifications == ["Updating card 12345 for John Doe: Changing owner"]
+
+    def test_owner_change_when_person_must_be_created(self, planner):
+        change_set = planner.plan([make_setting(card=12345)], {12345: make_card(name_id=99, access=["denhac"])}, {})
+        assert change_set.owner_changes == [12345]
+
+    def test_unchanged_card_has_no_change(self, planner):
+        setting = make_setting(card=12345)
+        change_set = planner.plan([setting], {12345: make_card(access=["denhac"])}, {100: 42})
+        assert change_set.card_changes == []
+        assert change_set.unchanged == [setting]
+
+
+class TestAccess:
+    def test_access_added_and_removed(self, planner, mock_config):
+        card = make_card(access=[mock_config.server_room_access, mock_config.main_building_access])
+        change_set = planner.plan([make_setting(card=12345, enable_denhac=True, enable_server_room=False)],
+                                  {12345: card}, {100: 42})
+        assert change_set.access_adds == [(12345, mock_config.denhac_access)]
+        assert change_set.access_removes == [
+            (12345, mock_config.server_room_access),
+            (12345, mock_config.main_building_access),
+        ]
+        assert change_set.notifications == [
+            "Updating card 12345 for John Doe: Adding denhac, Removing server room and Removing extra MBD"
+        ]
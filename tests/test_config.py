@@ -31,6 +31,57 @@ class TestWebhookConfig:
 
         assert session.headers['Authorization'] == 'Bearer my-test-key'
 
+    def test_session_reused_across_accesses(self, webhook_table):
+        webhook_table['api_key'] = 'my-test-key'
+
+        assert _WebhookConfig(webhook_table).session is _WebhookConfig(webhook_table).session
+
+    def test_session_rebuilt_when_api_key_changes(self, webhook_table):
+        webhook_table['api_key'] = 'my-test-key'
+        config = _WebhookConfig(webhook_table)
+        session = config.session
+
+        webhook_table['api_key'] = 'my-other-key'
+
+        assert config.session is not session
+        assert config.session.headers['Authorization'] == 'Bearer my-other-key'
+
+    def test_session_pool_size_from_config(self, webhook_table):
+        webhook_table['api_key'] = 'my-test-key'
+        webhook_table['pool_maxsize'] = 3
+        config = _WebhookConfig(webhook_table)
+
+        adapter = config.session.get_adapter('https://api.example.com')
+
+        assert adapter._pool_maxsize == 3
+
+    def test_scan_budget_tighter_than_default(self, webhook_table):
+        config = _WebhookConfig(webhook_table)
+
+        assert config.scan_budget.total_seconds < config.default_budget.total_seconds
+        assert config.scan_budget.read_timeout <= config.scan_budget.total_seconds
+
+    def test_budgets_from_config(self, webhook_table):
+        webhook_table['budget_seconds'] = 20
+        webhook_table['scan_budget_seconds'] = 1
+        webhook_table['read_timeout_seconds'] = 10
+        config = _WebhookConfig(webhook_table)
+
+        assert config.default_budget.total_seconds == 20
+        assert config.default_budget.read_timeout == 10
+        assert config.scan_budget.total_seconds == 1
+        assert config.scan_budget.read_timeout == 1
+
+    def test_explicit_zero_not_replaced_by_default(self, webhook_table):
+        webhook_table['api_key'] = 'my-test-key'
+        webhook_table['breaker_failures'] = 0
+        config = _WebhookConfig(webhook_table)
+
+        with patch('denhac_card_access.config.webhook_session') as mock_webhook_session:
+            _ = config.session
+
+        assert mock_webhook_session.call_args.args[4] == 0
+
 
 class TestSlackConfig:
     def test_emit_raises_when_webhook_url_is_none(self, slack_table):
@@ -45,6 +96,7 @@ class TestSlackConfig:
 
         with patch('requests.post') as mock_post:
             config.emit("hello world")
+            config.flush()
 
         mock_post.assert_called_once()
         url = mock_post.call_args.args[0]
@@ -99,6 +151,16 @@ class TestSlackConfig:
             with pytest.raises(Exception):
                 config.user_id_by_email("test@example.com")
 
+    def test_notify_queue_size_zero_passed_through(self, slack_table):
+        slack_table['webhook_url'] = 'https://hooks.slack.com/test'
+        slack_table['notify_queue_size'] = 0
+        config = _SlackConfig(slack_table)
+
+        with patch('denhac_card_access.config.slack_notifier') as mock_slack_notifier:
+            _ = config.notifier
+
+        assert mock_slack_notifier.call_args.args[2] == 0
+
     def test_invite_user_raises_when_team_id_is_none(self, slack_table):
         slack_table['admin_token'] = 'xoxp-admin'
         config = _SlackConfig(slack_table)
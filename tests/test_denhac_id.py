@@ -0,0 +1,47 @@
+import uuid
+
+from denhac_card_access.denhac_id import DenhacIdCodec
+
+
+class TestEncode:
+    def test_matches_uuid5_of_customer_id(self):
+        assert DenhacIdCodec().encode(100) == str(uuid.uuid5(uuid.NAMESPACE_OID, "100"))
+
+    def test_repeat_encode_is_a_hit(self):
+        codec = DenhacIdCodec()
+        codec.encode(100)
+        codec.encode(100)
+        info = codec.cache_info()
+        assert info.hits == 1
+        assert info.misses == 1
+
+
+class TestDecode:
+    def test_decodes_encoded_customer_id(self):
+        codec = DenhacIdCodec()
+        assert codec.decode(codec.encode(100)) == 100
+
+    def test_unknown_uuid_is_a_miss(self):
+        codec = DenhacIdCodec()
+        assert codec.decode(str(uuid.uuid4())) is None
+        assert codec.cache_info().misses == 1
+
+    def test_none_decodes_to_none(self):
+        assert DenhacIdCodec().decode(None) is None
+
+
+class TestEviction:
+    def test_size_bounded(self):
+        codec = DenhacIdCodec(maxsize=2)
+        for cid in range(5):
+            codec.encode(cid)
+        assert codec.cache_info().currsize == 2
+
+    def test_least_recently_used_evicted_in_both_directions(self):
+        codec = DenhacIdCodec(maxsize=2)
+        first = codec.encode(1)
+        second = codec.encode(2)
+        codec.encode(1)
+        codec.encode(3)
+        assert codec.decode(first) == 1
+        assert codec.decode(second) is None
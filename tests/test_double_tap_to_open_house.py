@@ -244,3 +244,106 @@ class TestLoop:
 
         assert mock_door.open.call_count == 2
         mock_door.timezone.assert_not_called()
+
+
+class TestScheduleRecompile:
+    def test_config_read_once_across_double_taps(self, double_tap, mock_config, valid_open_house):
+        with at_time(NOW):
+            for _ in range(4):
+                double_tap.card_scanned(make_card_scan())
+        mock_config.open_houses.items.assert_called_once()
+
+    def test_schedule_recompiled_when_config_changes(self, double_tap, mock_config, mock_door, valid_open_house):
+        with at_time(NOW):
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+        assert mock_door.open.call_count == 1
+
+        # A fresh mock has a different repr, just like an edited open house table
+        mock_config.open_houses = Mock()
+        mock_config.open_houses.items.return_value = {}.items()
+        with at_time(NOW):
+            double_tap.loop()
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+        assert mock_door.open.call_count == 1
+
+    def test_incomplete_open_house_ignored(self, double_tap, mock_config, mock_door):
+        mock_config.open_houses.items.return_value = {
+            "New Open House": make_open_house_config(end_time=None),
+            "Wednesday Open House": make_open_house_config(),
+        }.items()
+        with at_time(NOW):
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+        mock_door.open.assert_called_once()
+
+    def test_schedule_kept_when_config_unchanged(self, double_tap, mock_config, valid_open_house):
+        with at_time(NOW):
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+            double_tap.loop()
+            double_tap.card_scanned(make_card_scan())
+            double_tap.card_scanned(make_card_scan())
+        mock_config.open_houses.items.assert_called_once()
+
+
+class TestScanWindow:
+    def test_scan_outside_window_does_not_match_before_loop_runs(self, double_tap, mock_person_lookup):
+        double_tap.card_scanned(make_card_scan(scan_time=NOW))
+        double_tap.card_scanned(make_card_scan(scan_time=NOW + timedelta(seconds=11)))
+        mock_person_lookup.by_id.assert_not_called()
+
+    def test_scan_at_window_edge_matches(self, double_tap, mock_person_lookup):
+        double_tap.card_scanned(make_card_scan(scan_time=NOW))
+        double_tap.card_scanned(make_card_scan(scan_time=NOW + timedelta(seconds=10)))
+        mock_person_lookup.by_id.assert_called_once_with(1)
+
+    def test_expired_scans_dropped_on_insert(self, double_tap):
+        for name_id in range(5):
+            double_tap.card_scanned(make_card_scan(name_id=name_id, scan_time=NOW))
+
+        double_tap.card_scanned(make_card_scan(name_id=99, scan_time=NOW + timedelta(seconds=11)))
+        assert double_tap._scan_count == 1
+        assert list(double_tap._card_scans) == [(99, 10, 1)]
+
+    def test_other_members_scans_kept_after_double_tap(self, double_tap, mock_person_lookup):
+        double_tap.card_scanned(make_card_scan(name_id=2))
+        double_tap.card_scanned(make_card_scan(name_id=1))
+        double_tap.card_scanned(make_card_scan(name_id=1))
+        assert double_tap._scan_count == 1
+
+        double_tap.card_scanned(make_card_scan(name_id=2))
+        assert [c.args for c in mock_person_lookup.by_id.call_args_list] == [(1,), (2,)]
+        assert double_tap._card_scans == {}
+
+    def test_later_scan_kept_when_earlier_scan_arrives_late(self, double_tap, mock_person_lookup):
+        double_tap.card_scanned(make_card_scan(scan_time=NOW + timedelta(seconds=5)))
+        double_tap.card_scanned(make_card_scan(scan_time=NOW))
+        mock_person_lookup.by_id.assert_not_called()
+
+        double_tap.card_scanned(make_card_scan(scan_time=NOW + timedelta(seconds=6)))
+        mock_person_lookup.by_id.assert_called_once_with(1)
+        assert double_tap._scan_count == 0
+
+    def test_loop_clears_every_expired_key(self, double_tap):
+        for name_id in range(5):
+            double_tap.card_scanned(make_card_scan(name_id=name_id, scan_time=NOW))
+
+        with at_time(NOW + timedelta(seconds=11)):
+            double_tap.loop()
+
+        assert double_tap._card_scans == {}
+        assert double_tap._scan_count == 0
+
+    def test_every_scan_recorded_in_scan_log(self, double_tap):
+        double_tap.card_scanned(make_card_scan(event_type=CommServerEventType.DENIED_WRONG_ACCESS_LEVEL))
+        double_tap.card_scanned(make_card_scan(name_id=2))
+        assert [s.name_id for s in double_tap.scan_log.recent()] == [1, 2]
+
+    def test_no_matching_scans_logged_alongside_scan_count(self, double_tap, mock_config):
+        double_tap.card_scanned(make_card_scan())
+        messages = [c.args[1] for c in mock_config.logger.log.call_args_list]
+        assert "No matching scans" in messages
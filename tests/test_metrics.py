@@ -0,0 +1,47 @@
+from denhac_card_access.metrics import TimingStat, PhaseTimings, NULL_TIMINGS
+
+
+class TestTimingStat:
+    def test_empty_stat_has_zero_mean(self):
+        assert TimingStat().mean == 0.0
+
+    def test_records_count_mean_and_max(self):
+        stat = TimingStat()
+        stat.record(1.0)
+        stat.record(3.0)
+        assert stat.count == 2
+        assert stat.mean == 2.0
+        assert stat.max == 3.0
+
+    def test_time_records_elapsed_duration(self):
+        stat = TimingStat()
+        with stat.time():
+            pass
+        assert stat.count == 1
+        assert stat.max >= 0.0
+
+
+class TestPhaseTimings:
+    def test_phase_adds_time_and_count(self):
+        timings = PhaseTimings("test")
+        with timings.phase("fetch"):
+            pass
+        with timings.phase("fetch", count=2):
+            pass
+        assert timings.count("fetch") == 3
+        assert timings.seconds("fetch") >= 0.0
+
+    def test_summary_is_key_value_line(self):
+        timings = PhaseTimings("test")
+        timings.add("fetch", 1.5, 3)
+        timings.finish()
+        summary = timings.summary()
+        assert summary.startswith("run=test total=")
+        assert "fetch=1.500s/3" in summary
+        assert "\n" not in summary
+
+    def test_null_timings_record_nothing(self):
+        with NULL_TIMINGS.phase("fetch"):
+            pass
+        NULL_TIMINGS.add("fetch", 1.0)
+        assert NULL_TIMINGS.count("fetch") == 0
@@ -0,0 +1,70 @@
+from datetime import time
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from denhac_card_access.open_house_schedule import OpenHouseSchedule
+
+
+def make_open_house(day_of_week=2, scan_after_time=time(18, 0), end_time=time(21, 0), door_ids=(1,)):
+    return SimpleNamespace(day_of_week=day_of_week, scan_after_time=scan_after_time, end_time=end_time,
+                           door_ids=list(door_ids))
+
+
+class TestOpenHouseSchedule:
+    def test_active_inside_window(self):
+        schedule = OpenHouseSchedule.compile([("Wednesday", make_open_house(door_ids=(1, 2)))], Mock())
+        window = schedule.active(2, time(18, 30))
+        assert window.name == "Wednesday"
+        assert window.door_ids == (1, 2)
+
+    def test_start_is_inclusive_and_end_exclusive(self):
+        schedule = OpenHouseSchedule.compile([("Wednesday", make_open_house())], Mock())
+        assert schedule.active(2, time(18, 0)) is not None
+        assert schedule.active(2, time(21, 0)) is None
+
+    def test_nothing_active_before_start(self):
+        schedule = OpenHouseSchedule.compile([("Wednesday", make_open_house())], Mock())
+        assert schedule.active(2, time(17, 59)) is None
+
+    def test_nothing_active_on_other_days(self):
+        schedule = OpenHouseSchedule.compile([("Wednesday", make_open_house())], Mock())
+        assert schedule.active(3, time(18, 30)) is None
+
+    def test_closest_end_time_wins_when_overlapping(self):
+        schedule = OpenHouseSchedule.compile([
+            ("Long", make_open_house(scan_after_time=time(12, 0), end_time=time(22, 0))),
+            ("Short", make_open_house(scan_after_time=time(18, 0), end_time=time(20, 0))),
+        ], Mock())
+        assert schedule.active(2, time(18, 30)).name == "Short"
+        assert schedule.active(2, time(20, 30)).name == "Long"
+
+    def test_window_ending_earlier_but_not_started_skipped(self):
+        schedule = OpenHouseSchedule.compile([
+            ("Evening", make_open_house(scan_after_time=time(17, 0), end_time=time(22, 0))),
+            ("Later", make_open_house(scan_after_time=time(19, 0), end_time=time(21, 0))),
+        ], Mock())
+        assert schedule.active(2, time(18, 0)).name == "Evening"
+
+    def test_same_end_time_keeps_config_order(self):
+        schedule = OpenHouseSchedule.compile([
+            ("First", make_open_house()),
+            ("Second", make_open_house()),
+        ], Mock())
+        assert schedule.active(2, time(18, 30)).name == "First"
+
+    def test_len(self):
+        schedule = OpenHouseSchedule.compile([("A", make_open_house(day_of_week=d)) for d in range(7)], Mock())
+        assert len(schedule) == 7
+
+    @pytest.mark.parametrize("missing", ["day_of_week", "scan_after_time", "end_time", "door_ids"])
+    def test_incomplete_entry_skipped(self, missing):
+        logger = Mock()
+        incomplete = make_open_house()
+        setattr(incomplete, missing, None)
+        schedule = OpenHouseSchedule.compile([("Broken", incomplete), ("Wednesday", make_open_house())], logger)
+
+        assert len(schedule) == 1
+        assert schedule.active(2, time(18, 30)).name == "Wednesday"
+        logger.warning.assert_called_once()
@@ -1,3 +1,4 @@
+import threading
 from unittest.mock import Mock
 
 import pytest
@@ -34,12 +35,14 @@ def make_status_response():
 
 @pytest.fixture
 def mock_card_update_helper():
-    return Mock()
+    helper = Mock()
+    helper.handle.return_value = set()
+    return helper
 
 
 @pytest.fixture
 def process_piecemeal_update(mock_config, mock_card_update_helper):
-    return ProcessPiecemealUpdate(mock_config, mock_card_update_helper)
+    return ProcessPiecemealUpdate(mock_config, mock_card_update_helper, threading.Lock())
 
 
 @pytest.fixture
@@ -51,12 +54,12 @@ class TestConstructor:
     def test_raises_if_slack_webhook_url_is_none(self, mock_config, mock_card_update_helper):
         mock_config.slack.webhook_url = None
         with pytest.raises(Exception):
-            ProcessPiecemealUpdate(mock_config, mock_card_update_helper)
+            ProcessPiecemealUpdate(mock_config, mock_card_update_helper, threading.Lock())
 
     def test_raises_if_base_url_is_none(self, mock_config, mock_card_update_helper):
         mock_config.webhooks.base_url = None
         with pytest.raises(Exception):
-            ProcessPiecemealUpdate(mock_config, mock_card_update_helper)
+            ProcessPiecemealUpdate(mock_config, mock_card_update_helper, threading.Lock())
 
     def test_registers_mark_complete_callback(self, mock_card_update_helper, process_piecemeal_update):
         mock_card_update_helper.register.assert_called_once()
@@ -115,6 +118,19 @@ class TestCommandHandling:
         process_piecemeal_update.loop()
         mock_card_update_helper.handle.assert_called_once()
 
+    def test_failed_write_raises_and_is_retried(self, process_piecemeal_update, mock_webhook_session,
+                                                mock_card_update_helper):
+        mock_webhook_session.get.return_value = make_commands_response([make_command(id=42, card=12345)])
+        mock_card_update_helper.handle.return_value = {12345}
+        with pytest.raises(Exception, match="update 42"):
+            process_piecemeal_update.loop()
+
+        mock_card_update_helper.handle.return_value = set()
+        process_piecemeal_update.loop()
+
+        assert mock_card_update_helper.handle.call_count == 2
+        mock_webhook_session.post.assert_not_called()
+
 
 class TestCardDataPushed:
     def test_delegates_to_card_update_helper(self, process_piecemeal_update, mock_card_update_helper):
@@ -137,3 +153,49 @@ class TestMarkComplete:
             "https://api.example.com/card_updates/7/status",
             json={"status": "success"},
         )
+
+    def test_setting_from_elsewhere_ignored(self, process_piecemeal_update, mock_webhook_session, mark_complete):
+        mark_complete(CardSetting(card=1, first_name="A", last_name="B", company="", customer_id=2))
+        mock_webhook_session.post.assert_not_called()
+
+
+class TestVerifyMirror:
+    def test_mirror_verified_each_loop(self, process_piecemeal_update, mock_webhook_session, mock_card_update_helper):
+        mock_webhook_session.get.return_value = make_commands_response([])
+        process_piecemeal_update.loop()
+        mock_card_update_helper.verify_mirror.assert_called_once()
+
+
+class TestRetryEvicted:
+    @pytest.fixture
+    def retry_evicted(self, mock_card_update_helper):
+        return mock_card_update_helper.register_eviction.call_args[0][0]
+
+    def test_evicted_request_handled_again(self, process_piecemeal_update, mock_webhook_session,
+                                           mock_card_update_helper, retry_evicted):
+        mock_webhook_session.get.return_value = make_commands_response([make_command(id=42)])
+        process_piecemeal_update.loop()
+
+        retry_evicted(mock_card_update_helper.handle.call_args[0][0])
+        process_piecemeal_update.loop()
+
+        assert mock_card_update_helper.handle.call_count == 2
+
+    def test_evicted_setting_from_elsewhere_ignored(self, process_piecemeal_update, mock_webhook_session,
+                                                    retry_evicted):
+        retry_evicted(CardSetting(card=1, first_name="A", last_name="B", company="", customer_id=2))
+        mock_webhook_session.post.assert_not_called()
+
+
+class TestLockWait:
+    def test_wait_for_card_sync_mutex_recorded(self, mock_config, mock_card_update_helper, mock_webhook_session):
+        mutex = threading.Lock()
+        piecemeal = ProcessPiecemealUpdate(mock_config, mock_card_update_helper, mutex)
+        mock_webhook_session.get.return_value = make_commands_response([])
+
+        mutex.acquire()
+        threading.Timer(0.05, mutex.release).start()
+        piecemeal.loop()
+
+        assert piecemeal.lock_wait.count == 1
+        assert piecemeal.lock_wait.mean >= 0.04
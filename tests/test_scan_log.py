@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+
+from card_automation_server.plugins.types import CardScan, CommServerEventType
+from denhac_card_access.scan_log import ScanLog
+
+
+def make_card_scan(card_number=12345):
+    return CardScan(
+        name_id=1,
+        card_number=card_number,
+        scan_time=datetime(2024, 1, 3, 18, 30, 0),
+        device=10,
+        event_type=CommServerEventType.ACCESS_GRANTED,
+        location_id=1,
+    )
+
+
+@pytest.fixture
+def logger():
+    logger = Mock(spec=logging.Logger)
+    logger.isEnabledFor.return_value = True
+    return logger
+
+
+@pytest.fixture
+def clock():
+    with patch("denhac_card_access.scan_log.time.monotonic") as monotonic:
+        monotonic.return_value = 100.0
+        yield monotonic
+
+
+class TestScanLog:
+    def test_nothing_logged_when_level_disabled(self, logger):
+        logger.isEnabledFor.return_value = False
+        scan_log = ScanLog(logger)
+        scan_log.log(logging.INFO, "Card scan: %s", make_card_scan())
+        scan_log.verbose(logging.INFO, "Card scan: %s", make_card_scan())
+        scan_log.dump()
+        logger.log.assert_not_called()
+        assert scan_log.suppressed == 0
+
+    def test_args_passed_unformatted(self, logger):
+        card_scan = make_card_scan()
+        ScanLog(logger).log(logging.DEBUG, "Card scan: %s", card_scan)
+        logger.log.assert_called_once_with(logging.DEBUG, "Card scan: %s", card_scan)
+
+    def test_verbose_rate_limited(self, logger, clock):
+        scan_log = ScanLog(logger, verbose_interval_seconds=1)
+        for n in range(3):
+            scan_log.verbose(logging.INFO, "# Card scans: %d", n)
+        assert logger.log.call_count == 1
+        assert scan_log.suppressed == 2
+
+        clock.return_value = 101.0
+        scan_log.verbose(logging.INFO, "# Card scans: %d", 3)
+        assert [c.args for c in logger.log.call_args_list[1:]] == [
+            (logging.INFO, "%d more `%s` messages suppressed", 2, "# Card scans: %d"),
+            (logging.INFO, "# Card scans: %d", 3),
+        ]
+
+    def test_each_message_has_its_own_limit(self, logger, clock):
+        scan_log = ScanLog(logger, verbose_interval_seconds=1)
+        scan_log.verbose(logging.INFO, "# Card scans: %d", 1)
+        scan_log.verbose(logging.INFO, "No matching scans")
+        assert [c.args[1] for c in logger.log.call_args_list] == ["# Card scans: %d", "No matching scans"]
+        assert scan_log.suppressed == 0
+
+    def test_zero_interval_never_suppresses(self, logger, clock):
+        scan_log = ScanLog(logger, verbose_interval_seconds=0)
+        for _ in range(3):
+            scan_log.verbose(logging.INFO, "No matching scans")
+        assert logger.log.call_count == 3
+
+    def test_from_config_keeps_explicit_zero(self, mock_config, logger, clock):
+        mock_config.logger = logger
+        mock_config.scan_log.history_size = 0
+        mock_config.scan_log.verbose_interval_seconds = 0
+        scan_log = ScanLog.from_config(mock_config)
+
+        scan_log.record(make_card_scan())
+        scan_log.verbose(logging.INFO, "No matching scans")
+        scan_log.verbose(logging.INFO, "No matching scans")
+        assert scan_log.recent() == []
+        assert logger.log.call_count == 2
+
+    def test_from_config_defaults(self, mock_config, logger):
+        mock_config.logger = logger
+        scan_log = ScanLog.from_config(mock_config)
+        for card_number in range(300):
+            scan_log.record(make_card_scan(card_number))
+        assert len(scan_log.recent()) == 256
+
+    def test_ring_buffer_keeps_latest_scans(self, logger):
+        scan_log = ScanLog(logger, history_size=3)
+        for card_number in range(5):
+            scan_log.record(make_card_scan(card_number))
+
+        assert [s.card_number for s in scan_log.recent()] == [2, 3, 4]
+        logger.log.assert_not_called()
+
+    def test_dump_logs_buffered_scans(self, logger):
+        scan_log = ScanLog(logger, history_size=3)
+        scans = [make_card_scan(card_number) for card_number in range(2)]
+        for card_scan in scans:
+            scan_log.record(card_scan)
+
+        scan_log.dump()
+        assert [c.args for c in logger.log.call_args_list] == [
+            (logging.INFO, "Last %d card scans:", 2),
+            (logging.INFO, "Card scan: %s", scans[0]),
+            (logging.INFO, "Card scan: %s", scans[1]),
+        ]
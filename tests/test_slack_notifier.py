@@ -0,0 +1,104 @@
+import threading
+from unittest.mock import DEFAULT, patch
+
+import pytest
+
+from denhac_card_access.slack_notifier import SlackNotifier, slack_notifier
+
+
+@pytest.fixture
+def mock_post():
+    with patch('requests.post') as mock_post:
+        yield mock_post
+
+
+def texts(call):
+    return [block['text']['text'] for block in call.kwargs['json']['blocks']]
+
+
+class TestSlackNotifier:
+    def test_emit_does_not_wait_for_slack(self, mock_post):
+        release = threading.Event()
+        mock_post.side_effect = lambda *args, **kwargs: release.wait(timeout=5) and DEFAULT
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0)
+
+        notifier.emit("first")
+        notifier.emit("second")
+
+        release.set()
+        notifier.flush()
+        assert notifier.sent == 2
+
+    def test_messages_in_window_sent_together(self, mock_post):
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0.2)
+        for n in range(3):
+            notifier.emit(f"message {n}")
+        notifier.flush()
+
+        mock_post.assert_called_once()
+        assert mock_post.call_args.args[0] == 'https://hooks.slack.com/test'
+        assert texts(mock_post.call_args) == ["message 0", "message 1", "message 2"]
+
+    def test_payload_limited_to_max_blocks(self, mock_post):
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0.2)
+        for n in range(SlackNotifier.max_blocks + 1):
+            notifier.emit(f"message {n}")
+        notifier.flush()
+
+        assert [len(texts(call)) for call in mock_post.call_args_list] == [SlackNotifier.max_blocks, 1]
+
+    def test_full_queue_drops_and_counts(self, mock_post):
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocked_post(*args, **kwargs):
+            started.set()
+            release.wait(timeout=5)
+            return DEFAULT
+
+        mock_post.side_effect = blocked_post
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0, queue_size=1)
+        notifier.emit("in flight")
+        started.wait(timeout=5)
+        notifier.emit("queued")
+        notifier.emit("dropped")
+
+        assert notifier.dropped == 1
+        assert notifier.depth == 1
+        release.set()
+        notifier.flush()
+
+    def test_failed_send_counted_and_sender_keeps_going(self, mock_post):
+        mock_post.side_effect = [RuntimeError("slack down"), DEFAULT]
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0)
+        notifier.emit("lost")
+        notifier.flush()
+        notifier.emit("sent")
+        notifier.flush()
+
+        assert notifier.failed == 1
+        assert notifier.sent == 1
+
+    def test_rejected_send_counted_as_failed(self, mock_post):
+        mock_post.return_value.ok = False
+        mock_post.return_value.status_code = 429
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0)
+        notifier.emit("rate limited")
+        notifier.flush()
+
+        assert notifier.failed == 1
+        assert notifier.sent == 0
+        assert notifier.send_latency.count == 0
+
+    def test_send_latency_recorded(self, mock_post):
+        notifier = SlackNotifier('https://hooks.slack.com/test', window_seconds=0)
+        notifier.emit("hello")
+        notifier.flush()
+        assert notifier.send_latency.count == 1
+
+
+class TestSharedNotifier:
+    def test_same_notifier_per_webhook_url(self):
+        first = slack_notifier('https://hooks.slack.com/a', 1.0, 10)
+        assert slack_notifier('https://hooks.slack.com/a', 1.0, 10) is first
+        assert slack_notifier('https://hooks.slack.com/b', 1.0, 10) is not first
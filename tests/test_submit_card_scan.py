@@ -67,6 +67,9 @@ class TestConstructor:
         with pytest.raises(Exception):
             SubmitCardScan(mock_config, mock_door_lookup, mock_person_lookup)
 
+    def test_uses_scan_budget(self, submit_card_scan, mock_config, mock_webhook_session):
+        mock_webhook_session.with_budget.assert_called_once_with(mock_config.webhooks.scan_budget)
+
 
 class TestEarlyReturns:
     def test_no_post_when_door_not_found(self, submit_card_scan, mock_door_lookup, mock_webhook_session):
@@ -123,3 +126,10 @@ class TestCardScanPost:
         mock_webhook_session.post.return_value = make_post_response(ok=False, status_code=500)
         with pytest.raises(Exception):
             submit_card_scan.card_scanned(make_card_scan())
+
+    def test_every_grant_and_deny_logged(self, submit_card_scan, mock_config, mock_webhook_session):
+        mock_webhook_session.post.return_value = make_post_response()
+        submit_card_scan.card_scanned(make_card_scan())
+        submit_card_scan.card_scanned(make_card_scan(event_type=CommServerEventType.DENIED_WRONG_ACCESS_LEVEL))
+        outcomes = [c.args[2] for c in mock_config.logger.log.call_args_list if c.args[1].startswith("ACCESS")]
+        assert outcomes == ["GRANTED", "DENIED"]
@@ -0,0 +1,226 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from denhac_card_access.webhook_session import CircuitBreaker, CircuitOpenError, RetryBudget, WebhookSession
+
+BUDGET = RetryBudget(total_seconds=2, connect_timeout=1, read_timeout=1, backoff_seconds=0.01,
+                     max_backoff_seconds=0.05)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        statuses = self.server.statuses
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        self.server.calls += 1
+        time.sleep(self.server.delay)
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.statuses = [200]
+    server.calls = 0
+    server.delay = 0
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_session(budget=BUDGET, breaker=None):
+    session = WebhookSession("my-test-key", pool_connections=1, pool_maxsize=1, default_budget=budget,
+                             breaker=breaker or CircuitBreaker(failure_threshold=100, cooldown_seconds=60))
+    # The pooled adapter is only mounted for https, borrow it for the local test server
+    session.mount("http://", session.get_adapter("https://api.example.com"))
+    return session
+
+
+class TestWebhookSession:
+    def test_headers(self):
+        session = make_session()
+        assert session.headers["Authorization"] == "Bearer my-test-key"
+        assert session.headers["Accept"] == "application/json"
+
+    def test_no_connections_before_first_request(self):
+        stats = make_session().connection_stats
+        assert stats.connections == 0
+        assert stats.requests == 0
+
+    def test_connection_kept_alive_between_requests(self, server):
+        session = make_session()
+
+        for _ in range(3):
+            session.get(f"{server.url}/card_updates").raise_for_status()
+
+        stats = session.connection_stats
+        assert stats.connections == 1
+        assert stats.requests == 3
+        assert stats.reused == 2
+
+
+class TestRetryBudget:
+    @pytest.fixture(autouse=True)
+    def longest_backoff(self, monkeypatch):
+        # Always back off for the full jitter window so budgets run out predictably
+        monkeypatch.setattr("denhac_card_access.webhook_session.random.uniform", lambda low, high: high)
+
+    def test_server_errors_retried(self, server):
+        server.statuses = [503, 502, 200]
+        response = make_session().get(f"{server.url}/card_updates")
+        assert response.status_code == 200
+        assert server.calls == 3
+
+    def test_client_errors_not_retried(self, server):
+        server.statuses = [404]
+        response = make_session().get(f"{server.url}/card_updates")
+        assert response.status_code == 404
+        assert server.calls == 1
+
+    def test_last_response_returned_when_budget_runs_out(self, server):
+        server.statuses = [503]
+        budget = RetryBudget(total_seconds=0.5, connect_timeout=1, read_timeout=1, backoff_seconds=0.1,
+                             max_backoff_seconds=1)
+
+        started = time.monotonic()
+        response = make_session(budget).get(f"{server.url}/card_updates")
+
+        assert response.status_code == 503
+        # Backoffs of 0.2s then 0.4s, the second doesn't fit in the budget
+        assert server.calls == 2
+        assert time.monotonic() - started < 0.5
+
+    def test_per_call_budget_overrides_default(self, server):
+        server.statuses = [503]
+        tight = RetryBudget(total_seconds=0.5, connect_timeout=1, read_timeout=1, backoff_seconds=1)
+        response = make_session().with_budget(tight).get(f"{server.url}/card_updates")
+        assert response.status_code == 503
+        assert server.calls == 1
+
+    def test_connection_error_raised_when_budget_runs_out(self):
+        budget = RetryBudget(total_seconds=0.2, connect_timeout=0.1, read_timeout=0.1, backoff_seconds=0.05)
+        with pytest.raises(requests.ConnectionError):
+            # Nothing listens on port 9 locally
+            make_session(budget).get("http://127.0.0.1:9/card_updates")
+
+    def test_post_not_retried_on_server_error(self, server):
+        server.statuses = [503, 200]
+        response = make_session().post(f"{server.url}/events/card_scanned", json={})
+        assert response.status_code == 503
+        assert server.calls == 1
+
+    def test_post_not_retried_on_read_timeout(self, server):
+        server.delay = 0.3
+        budget = RetryBudget(total_seconds=2, connect_timeout=1, read_timeout=0.1, backoff_seconds=0.01)
+        with pytest.raises(requests.ReadTimeout):
+            make_session(budget).post(f"{server.url}/events/card_scanned", json={})
+        assert server.calls == 1
+
+    def test_post_retried_when_connection_refused(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr("denhac_card_access.webhook_session.time.sleep", sleeps.append)
+        budget = RetryBudget(total_seconds=0.5, connect_timeout=0.1, read_timeout=0.1, backoff_seconds=0.01)
+        with pytest.raises(requests.ConnectionError):
+            make_session(budget).post("http://127.0.0.1:9/events/card_scanned", json={})
+        assert len(sleeps) > 0
+
+    def test_get_retried_on_read_timeout(self, server):
+        server.delay = 0.3
+        budget = RetryBudget(total_seconds=0.5, connect_timeout=1, read_timeout=0.1, backoff_seconds=0.01)
+        with pytest.raises(requests.ReadTimeout):
+            make_session(budget).get(f"{server.url}/card_updates")
+        assert server.calls > 1
+
+
+class TestCircuitBreaker:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("denhac_card_access.webhook_session.time.monotonic", lambda: now[0])
+        return now
+
+    def test_opens_after_threshold(self, clock):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown_seconds=30)
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.record_failure()
+        assert not breaker.allow()
+        assert breaker.state == "open"
+        assert breaker.trips == 1
+
+    def test_success_resets_failures(self, clock):
+        breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.allow()
+
+    def test_one_probe_after_cooldown(self, clock):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+        breaker.record_failure()
+        clock[0] += 31
+        assert breaker.allow()
+        assert breaker.state == "half_open"
+        assert not breaker.allow()
+
+    def test_successful_probe_closes(self, clock):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+        breaker.record_failure()
+        clock[0] += 31
+        breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed"
+
+    def test_failed_probe_reopens(self, clock):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+        breaker.record_failure()
+        clock[0] += 31
+        breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+        clock[0] += 31
+        assert breaker.allow()
+
+    def test_open_breaker_fails_fast(self, server):
+        server.statuses = [503]
+        session = make_session(breaker=CircuitBreaker(failure_threshold=2, cooldown_seconds=60))
+        session.get(f"{server.url}/card_updates")
+        calls = server.calls
+
+        with pytest.raises(CircuitOpenError):
+            session.get(f"{server.url}/card_updates")
+        assert server.calls == calls
+
+    def test_unexpected_error_in_probe_reopens_breaker(self, monkeypatch):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+        breaker.record_failure()
+        session = make_session(breaker=breaker)
+
+        def broken_request(*args, **kwargs):
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+        monkeypatch.setattr(requests.Session, "request", broken_request)
+
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            session.get("https://api.example.com/card_updates")
+
+        assert breaker.state == "open"
+        # The cooldown is over straight away, so the next call gets to probe
+        assert breaker.allow()
@@ -0,0 +1,151 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+from denhac_card_access.metrics import PhaseTimings
+from denhac_card_access.write_batch import WriteBatch
+
+
+def make_person():
+    return Mock()
+
+
+def make_card(card_number=1, person=None):
+    card = Mock()
+    card.card_number = card_number
+    card.person = person
+    return card
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def batch():
+    return WriteBatch(batch_size=10, logger=logging.getLogger("test"))
+
+
+class TestWriteBatch:
+    def test_nothing_written_until_flush(self, batch):
+        card = make_card()
+        batch.add_card(card)
+        card.write.assert_not_called()
+        batch.flush()
+        card.write.assert_called_once()
+
+    def test_flushes_when_batch_size_reached(self):
+        batch = WriteBatch(batch_size=2, logger=logging.getLogger("test"))
+        first, second = make_card(1), make_card(2)
+        batch.add_card(first)
+        batch.add_card(second)
+        first.write.assert_called_once()
+        second.write.assert_called_once()
+
+    def test_same_object_written_once(self, batch):
+        card = make_card()
+        batch.add_card(card)
+        batch.add_card(card)
+        batch.flush()
+        card.write.assert_called_once()
+
+    def test_people_written_before_cards(self, batch, calls):
+        person = make_person()
+        person.write.side_effect = lambda: calls.append("person")
+        card = make_card(person=person)
+        card.write.side_effect = lambda: calls.append("card")
+        batch.add_card(card)
+        batch.add_person(person)
+        batch.flush()
+        assert calls == ["person", "card"]
+
+    def test_failed_card_does_not_stop_others(self, batch):
+        broken, fine = make_card(1), make_card(2)
+        broken.write.side_effect = RuntimeError("boom")
+        batch.add_card(broken)
+        batch.add_card(fine)
+        batch.flush()
+        fine.write.assert_called_once()
+        assert batch.failed(broken)
+        assert not batch.failed(fine)
+        assert batch.cards_written == 1
+
+    def test_card_not_written_when_person_failed(self, batch):
+        person = make_person()
+        person.write.side_effect = RuntimeError("boom")
+        card = make_card(person=person)
+        batch.add_person(person)
+        batch.add_card(card)
+        batch.flush()
+        card.write.assert_not_called()
+        assert batch.failed(person)
+        assert batch.failed(card)
+
+    def test_timings_count_each_write(self):
+        timings = PhaseTimings("test")
+        batch = WriteBatch(batch_size=10, logger=logging.getLogger("test"), timings=timings)
+        batch.add_person(make_person())
+        batch.add_card(make_card(1))
+        batch.add_card(make_card(2))
+        batch.flush()
+        assert timings.count("person_write") == 1
+        assert timings.count("card_write") == 2
+
+
+class TestParallelWriteBatch:
+    @pytest.fixture
+    def executor(self):
+        executor = ThreadPoolExecutor(max_workers=4)
+        yield executor
+        executor.shutdown()
+
+    def test_person_written_before_their_cards(self, executor, calls):
+        batch = WriteBatch(batch_size=100, logger=logging.getLogger("test"), executor=executor)
+        for n in range(10):
+            person = make_person()
+            person.write.side_effect = lambda n=n: calls.append(("person", n))
+            batch.add_person(person)
+            for card_number in range(3):
+                card = make_card(card_number, person=person)
+                card.write.side_effect = lambda n=n, c=card_number: calls.append(("card", n, c))
+                batch.add_card(card)
+        batch.flush()
+
+        assert len(calls) == 40
+        for n in range(10):
+            mine = [call for call in calls if call[1] == n]
+            assert mine == [("person", n), ("card", n, 0), ("card", n, 1), ("card", n, 2)]
+
+    def test_different_people_written_concurrently(self, executor):
+        barrier = threading.Barrier(2, timeout=1)
+        batch = WriteBatch(batch_size=100, logger=logging.getLogger("test"), executor=executor)
+        for card_number in range(2):
+            card = make_card(card_number, person=make_person())
+            card.write.side_effect = lambda: barrier.wait()
+            batch.add_card(card)
+        batch.flush()
+        assert batch.cards_written == 2
+
+    def test_failed_person_skips_only_their_cards(self, executor):
+        batch = WriteBatch(batch_size=100, logger=logging.getLogger("test"), executor=executor)
+        broken, fine = make_person(), make_person()
+        broken.write.side_effect = RuntimeError("boom")
+        broken_card, fine_card = make_card(1, person=broken), make_card(2, person=fine)
+        for item in (broken, fine):
+            batch.add_person(item)
+        for item in (broken_card, fine_card):
+            batch.add_card(item)
+        batch.flush()
+        broken_card.write.assert_not_called()
+        fine_card.write.assert_called_once()
+        assert batch.failed(broken_card)
+
+    def test_writes_per_second_reported(self, executor):
+        batch = WriteBatch(batch_size=100, logger=logging.getLogger("test"), executor=executor)
+        batch.add_card(make_card(1, person=make_person()))
+        batch.flush()
+        assert batch.writes_per_second > 0